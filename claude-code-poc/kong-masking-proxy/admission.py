@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Admission control for the masking proxy
+Caps requests in flight globally and per client. Requests over the global cap
+wait in a bounded FIFO queue for up to `queue_timeout` seconds. Anything that
+cannot be admitted is turned away at once with a Retry-After hint, so it
+never holds a body, a mapping-store context or an upstream connection.
+
+Runs on the event loop only (no locks).
+"""
+
+import asyncio
+import hashlib
+import math
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+# Headers that identify a client, in order of preference
+CLIENT_HEADERS = ("x-api-key", "authorization")
+
+
+class AdmissionRejected(Exception):
+    """Request not admitted; status is 429 (client over its limit) or 503"""
+
+    def __init__(self, status: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def client_key(headers, fallback: str, header: Optional[str] = None) -> str:
+    """Stable, non-reversible id for the client sending a request
+
+    API keys are hashed right away so they never sit in memory as dict keys.
+    """
+    for name in ((header,) if header else ()) + CLIENT_HEADERS:
+        value = headers.get(name)
+        if value:
+            return hashlib.blake2b(value.encode('utf-8'), digest_size=8).hexdigest()
+    return fallback
+
+
+class AdmissionController:
+    """Global and per-client in-flight limits with a bounded wait queue
+
+    A limit of 0 turns that limit off.
+    """
+
+    def __init__(self, max_in_flight: int = 256, max_per_client: int = 32,
+                 max_queue: int = 512, queue_timeout: float = 10.0):
+        self.max_in_flight = max_in_flight
+        self.max_per_client = max_per_client
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.in_flight = 0
+        # client -> admitted + queued requests
+        self._clients: Dict[str, int] = {}
+        # Waiters in arrival order
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._queued = 0
+        # Moving average of how long an admitted request holds its slot
+        self._hold_seconds = 1.0
+
+        self.stats = {
+            'admitted': 0,
+            'queued': 0,
+            'rejected_client_limit': 0,
+            'rejected_queue_full': 0,
+            'rejected_queue_timeout': 0,
+            'queue_wait_seconds': 0.0,
+            'queue_wait_max_seconds': 0.0,
+        }
+
+    async def acquire(self, client: str) -> Callable[[], None]:
+        """Wait for a slot; returns the function that gives it back (idempotent)
+
+        Raises AdmissionRejected when the client is over its limit, the
+        queue is full or the wait times out.
+        """
+        count = self._clients.get(client, 0)
+        if self.max_per_client and count >= self.max_per_client:
+            self.stats['rejected_client_limit'] += 1
+            raise AdmissionRejected(429, "too many concurrent requests for this client",
+                                    self._retry_after(1))
+        self._clients[client] = count + 1
+
+        if not self.max_in_flight or (self.in_flight < self.max_in_flight and not self._queued):
+            self.in_flight += 1
+        else:
+            try:
+                await self._wait()
+            except BaseException:
+                self._forget(client)
+                raise
+
+        self.stats['admitted'] += 1
+        admitted_at = time.monotonic()
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self._hold_seconds += (time.monotonic() - admitted_at - self._hold_seconds) * 0.1
+                self._forget(client)
+                self._release_slot()
+
+        return release
+
+    async def _wait(self):
+        """Queue for a slot; on return the slot has been handed to us"""
+        if self.max_queue and self._queued >= self.max_queue:
+            self.stats['rejected_queue_full'] += 1
+            raise AdmissionRejected(503, "proxy is at capacity", self._retry_after(self._queued + 1))
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        self._queued += 1
+        self.stats['queued'] += 1
+        started = time.monotonic()
+        timer = loop.call_later(self.queue_timeout, self._expire, waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # Client gone; give the slot back if it was handed over meanwhile
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                self._release_slot()
+            raise
+        finally:
+            timer.cancel()
+            if not waiter.done() or waiter.cancelled() or waiter.exception() is not None:
+                # Left the queue without a slot (served waiters are already out of it)
+                self._queued -= 1
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass  # already popped and skipped by _release_slot
+            waited = time.monotonic() - started
+            self.stats['queue_wait_seconds'] += waited
+            if waited > self.stats['queue_wait_max_seconds']:
+                self.stats['queue_wait_max_seconds'] = waited
+
+    def _expire(self, waiter: asyncio.Future):
+        if not waiter.done():
+            self.stats['rejected_queue_timeout'] += 1
+            waiter.set_exception(AdmissionRejected(
+                503, "timed out waiting for capacity", self._retry_after(self._queued)
+            ))
+
+    def _release_slot(self):
+        """Hand the slot to the oldest waiter, or free it"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            # A waiter whose timer fired or whose task was cancelled this very
+            # iteration is done but has not run its cleanup yet
+            if not waiter.done():
+                self._queued -= 1
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _forget(self, client: str):
+        count = self._clients.get(client, 0) - 1
+        if count > 0:
+            self._clients[client] = count
+        else:
+            self._clients.pop(client, None)
+
+    def _retry_after(self, ahead: int) -> int:
+        """Seconds until `ahead` requests have likely gone through, 1 .. 60"""
+        slots = self.max_in_flight or 1
+        return max(1, min(60, math.ceil(self._hold_seconds * ahead / slots)))
+
+    def snapshot(self) -> Dict[str, float]:
+        stats = {key: round(value, 6) if isinstance(value, float) else value
+                 for key, value in self.stats.items()}
+        stats.update(
+            in_flight=self.in_flight,
+            queue_depth=self._queued,
+            clients=len(self._clients),
+            max_in_flight=self.max_in_flight,
+            max_per_client=self.max_per_client,
+            max_queue=self.max_queue,
+            avg_hold_seconds=round(self._hold_seconds, 3),
+        )
+        return stats
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Batch masking and unmasking of independent documents
+Backs /v1/mask/batch and /v1/unmask/batch: every document of a batch is
+scanned first, the mapping store is consulted once for the whole batch, and
+only then are the documents rewritten
+
+A document is any JSON value; its string values are masked, object keys and
+other scalars are left alone (the same rule as mask_request_body).
+"""
+
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from masking_engine import MaskingEngine, Span
+from unmasking import ANY_TOKEN, restore_tokens, token_candidates
+
+# Documents per mapping-store round trip when the input is streamed
+DEFAULT_BATCH_SIZE = 1000
+
+
+def iter_strings(value: Any) -> Iterator[str]:
+    """Every string value in document order (the order map_strings visits them)
+
+    Walks with an explicit stack of iterators, so deep nesting cannot hit the
+    recursion limit.
+    """
+    stack = [iter((value,))]
+    while stack:
+        for item in stack[-1]:
+            if isinstance(item, str):
+                yield item
+            elif isinstance(item, dict):
+                stack.append(iter(item.values()))
+                break
+            elif isinstance(item, list):
+                stack.append(iter(item))
+                break
+        else:
+            stack.pop()
+
+
+def map_strings(value: Any, fn: Callable[[str], str]) -> Any:
+    """Copy of value with fn applied to every string value, in document order"""
+    root = [value]
+    # (copy being filled in, its (key, item) pairs still to visit)
+    stack = [(root, enumerate(root))]
+    while stack:
+        target, items = stack[-1]
+        for key, item in items:
+            if isinstance(item, str):
+                target[key] = fn(item)
+            elif isinstance(item, dict):
+                target[key] = dict(item)
+                stack.append((target[key], iter(item.items())))
+                break
+            elif isinstance(item, list):
+                target[key] = list(item)
+                stack.append((target[key], enumerate(item)))
+                break
+        else:
+            stack.pop()
+    return root[0]
+
+
+class MaskBatch:
+    """Scan once, resolve tokens once, then splice"""
+
+    def __init__(self, documents: List[Any], engine: MaskingEngine):
+        self.documents = documents
+        self.engine = engine
+        # (string, spans) for every string value, in iter_strings order
+        self._scanned: List[Tuple[str, List[Span]]] = [
+            (text, engine.scan(text)) for document in documents for text in iter_strings(document)
+        ]
+
+    @property
+    def matches(self) -> int:
+        return sum(len(spans) for _, spans in self._scanned)
+
+    def candidates(self) -> Iterator[Tuple[str, str]]:
+        """(pattern name, original value) for MappingStore.prefetch"""
+        for text, spans in self._scanned:
+            for start, end, name in spans:
+                yield name, text[start:end]
+
+    def apply(self, tokenize: Callable[[str, str], str]) -> List[Any]:
+        scanned = iter(self._scanned)
+
+        def mask(_text: str) -> str:
+            text, spans = next(scanned)
+            if not spans:
+                return text
+            tokens = [tokenize(name, text[start:end]) for start, end, name in spans]
+            return self.engine.splice(text, spans, tokens)
+
+        return [map_strings(document, mask) for document in self.documents]
+
+
+class UnmaskBatch:
+    """Collect every token of the batch, resolve them together, then restore"""
+
+    def __init__(self, documents: List[Any]):
+        self.documents = documents
+        self.tokens: Dict[str, None] = {}
+        for document in documents:
+            for text in iter_strings(document):
+                for match in ANY_TOKEN.finditer(text):
+                    self.tokens.update(dict.fromkeys(token_candidates(match)))
+
+    def apply(self, originals: Dict[str, str]) -> List[Any]:
+        if not originals:
+            return self.documents
+        lookup = originals.get
+        return [map_strings(document, lambda text: restore_tokens(text, lookup))
+                for document in self.documents]
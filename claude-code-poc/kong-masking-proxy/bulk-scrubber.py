@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Bulk AWS Resource Scrubber
+Masks logs and transcripts at rest with the proxy's masking engine
+
+Input files are memory-mapped and cut into chunks on line boundaries. A
+process pool scans the chunks in parallel, and the parent assigns tokens in
+file order and writes the output in order. So the same value gets the same
+token everywhere, as in one proxy session, and a given input always
+produces the same output.
+
+Limitation: the Kong plugin's patterns (MASK_PATTERN_SOURCE=kong) can match
+across lines, with no bound on the length of a match ([^:]+ runs to the next
+colon anywhere in the file). No chunk overlap is safe then, so each file is
+scanned whole in this process, and files larger than --max-unsplit-mb are
+refused. Restoring (--reverse) is always chunked: tokens never span lines.
+
+Usage:
+    python bulk-scrubber.py app.log                          # -> app.log.masked
+    python bulk-scrubber.py *.log --mapping-out mapping.json --workers 8
+    python bulk-scrubber.py new.log --mapping-in mapping.json --mapping-out mapping.json
+    python bulk-scrubber.py app.log.masked --reverse mapping.json -o app.log.restored
+"""
+
+import argparse
+import json
+import mmap
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from mapping_store import DEFAULT_SESSION, MappingStore, MaskingContext
+from masking_engine import Span, default_engine
+from unmasking import restore_tokens
+
+DEFAULT_CHUNK_BYTES = 8 * 1024 * 1024
+# Largest file an engine whose matches can span lines is run on (whole, in memory)
+DEFAULT_MAX_UNSPLIT_BYTES = 256 * 1024 * 1024
+
+# Set per worker process by _init_worker
+_worker_map: Optional[mmap.mmap] = None
+_worker_unmask: Optional[Dict[str, str]] = None
+
+
+def open_map(path: str) -> Optional[mmap.mmap]:
+    """Read-only map of the file, None when it is empty (mmap rejects size 0)"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def line_chunks(data: mmap.mmap, chunk_bytes: int) -> List[Tuple[int, int]]:
+    """(start, end) ranges of about chunk_bytes, each ending after a newline
+
+    Tokens never span lines, and neither do the patterns of a splittable
+    engine, so each chunk can be scanned on its own.
+    """
+    chunks = []
+    start = 0
+    size = len(data)
+    while start < size:
+        end = data.find(b'\n', min(start + chunk_bytes, size) - 1)
+        end = size if end == -1 else end + 1
+        chunks.append((start, end))
+        start = end
+    return chunks
+
+
+class UnsplittableFileError(ValueError):
+    """A file too large to scan whole with an engine that cannot be chunked"""
+
+
+def _init_worker(path: str, unmask_map: Optional[Dict[str, str]] = None):
+    global _worker_map, _worker_unmask
+    _worker_map = open_map(path)
+    _worker_unmask = unmask_map
+
+
+def scan_chunk(data, start: int, end: int) -> List[Span]:
+    """Matches in data[start:end] as absolute byte offsets
+
+    ASCII chunks are scanned as bytes; anything else is decoded so \\b and the
+    character classes behave exactly as they do in the proxy.
+    """
+    raw = data[start:end]
+    if raw.isascii():
+        return [(s + start, e + start, name) for s, e, name in default_engine.scan_bytes(raw)]
+
+    text = raw.decode('utf-8', 'surrogateescape')
+    spans = []
+    char_pos = byte_pos = 0
+    for s, e, name in default_engine.scan(text):
+        byte_pos += len(text[char_pos:s].encode('utf-8', 'surrogateescape'))
+        byte_end = byte_pos + len(text[s:e].encode('utf-8', 'surrogateescape'))
+        spans.append((byte_pos + start, byte_end + start, name))
+        char_pos, byte_pos = e, byte_end
+    return spans
+
+
+def _scan_job(chunk: Tuple[int, int]) -> List[Span]:
+    return scan_chunk(_worker_map, *chunk)
+
+
+def unmask_chunk(data, start: int, end: int, unmask_map: Dict[str, str]) -> bytes:
+    """data[start:end] with every token of unmask_map restored, the same
+    token resolution the proxy uses for responses (unmasking.py)"""
+    text = data[start:end].decode('utf-8', 'surrogateescape')
+    return restore_tokens(text, unmask_map.get).encode('utf-8', 'surrogateescape')
+
+
+def _unmask_job(chunk: Tuple[int, int]) -> bytes:
+    return unmask_chunk(_worker_map, *chunk, _worker_unmask)
+
+
+def ordered_results(pool: Optional[ProcessPoolExecutor], fn, serial_fn, chunks, window: int) -> Iterator:
+    """Results of fn(chunk) in chunk order, at most `window` chunks in flight"""
+    if pool is None:
+        yield from (serial_fn(chunk) for chunk in chunks)
+        return
+
+    pending = []
+    for chunk in chunks:
+        pending.append(pool.submit(fn, chunk))
+        if len(pending) >= window:
+            yield pending.pop(0).result()
+    for future in pending:
+        yield future.result()
+
+
+def scrub_file(path: str, out, context: MaskingContext, workers: int, chunk_bytes: int,
+               unmask_map: Optional[Dict[str, str]] = None,
+               max_unsplit_bytes: int = DEFAULT_MAX_UNSPLIT_BYTES) -> Dict[str, int]:
+    """Mask (or, with unmask_map, restore) one file into the binary stream out
+
+    Raises UnsplittableFileError for a file above max_unsplit_bytes when
+    the engine's matches can span lines (see the module docstring).
+    """
+    data = open_map(path)
+    if data is None:
+        return {'bytes': 0, 'chunks': 0, 'matches': 0}
+
+    stats = {'bytes': len(data), 'chunks': 0, 'matches': 0}
+    chunks = line_chunks(data, chunk_bytes)
+    if unmask_map is None and not default_engine.splittable:
+        if len(data) > max_unsplit_bytes:
+            data.close()
+            raise UnsplittableFileError(
+                f"{path}: {stats['bytes']:,} bytes; these patterns can match across lines, so files "
+                f"above {max_unsplit_bytes:,} bytes are not scanned (raise --max-unsplit-mb, or "
+                f"split the file on record boundaries)"
+            )
+        # A match may run past any newline: one chunk, scanned in this process
+        chunks = [(0, len(data))]
+    pool = None
+    if workers > 1 and len(chunks) > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(path, unmask_map))
+    try:
+        if unmask_map is not None:
+            results = ordered_results(pool, _unmask_job,
+                                      lambda chunk: unmask_chunk(data, *chunk, unmask_map),
+                                      chunks, workers * 2)
+            for restored in results:
+                out.write(restored)
+                stats['chunks'] += 1
+            return stats
+
+        results = ordered_results(pool, _scan_job, lambda chunk: scan_chunk(data, *chunk),
+                                  chunks, workers * 2)
+        tokenize = context.tokenize
+        for (start, end), spans in zip(chunks, results):
+            # Tokens are issued here, in file order, so numbering is deterministic
+            pieces = []
+            pos = start
+            for s, e, name in spans:
+                pieces.append(data[pos:s])
+                pieces.append(tokenize(name, data[s:e].decode('utf-8', 'surrogateescape')).encode('ascii'))
+                pos = e
+            pieces.append(data[pos:end])
+            out.write(b''.join(pieces))
+            stats['chunks'] += 1
+            stats['matches'] += len(spans)
+        return stats
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        data.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mask AWS resources in files at rest")
+    parser.add_argument("inputs", nargs="+", help="files to scrub")
+    parser.add_argument("-o", "--output", help="output file (single input only; '-' for stdout)")
+    parser.add_argument("--suffix", default=".masked", help="output name suffix (default .masked)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-mb", type=float, default=DEFAULT_CHUNK_BYTES / 1024 / 1024)
+    parser.add_argument("--max-unsplit-mb", type=float, default=DEFAULT_MAX_UNSPLIT_BYTES / 1024 / 1024,
+                        help="largest file scanned whole when the patterns can match across lines")
+    parser.add_argument("--mapping-in", help="continue from a saved mapping (same values keep their tokens)")
+    parser.add_argument("--mapping-out", help="save the masked -> original mapping as JSON")
+    parser.add_argument("--reverse", metavar="MAPPING", help="restore originals using a saved mapping")
+    args = parser.parse_args()
+
+    if args.output and len(args.inputs) > 1:
+        parser.error("--output needs a single input; use --suffix for several")
+
+    # Unbounded store: an eviction would give a value a second token mid-file
+    store = MappingStore(ttl=float('inf'), max_entries=sys.maxsize, max_bytes=sys.maxsize)
+    context = MaskingContext(store, DEFAULT_SESSION)
+    if args.mapping_in:
+        with open(args.mapping_in) as f:
+            saved = json.load(f)
+        store.restore(DEFAULT_SESSION, saved)
+        context.issued.update(saved)
+
+    unmask_map = None
+    if args.reverse:
+        with open(args.reverse) as f:
+            unmask_map = json.load(f)
+
+    chunk_bytes = max(1, int(args.chunk_mb * 1024 * 1024))
+    max_unsplit_bytes = int(args.max_unsplit_mb * 1024 * 1024)
+    started = time.perf_counter()
+    total_bytes = total_matches = 0
+
+    for path in args.inputs:
+        target = args.output or path + (".restored" if args.reverse and args.suffix == ".masked" else args.suffix)
+        file_started = time.perf_counter()
+        try:
+            if target == '-':
+                stats = scrub_file(path, sys.stdout.buffer, context, args.workers, chunk_bytes,
+                                   unmask_map, max_unsplit_bytes)
+            else:
+                with open(target, 'wb', buffering=1024 * 1024) as out:
+                    stats = scrub_file(path, out, context, args.workers, chunk_bytes,
+                                       unmask_map, max_unsplit_bytes)
+        except UnsplittableFileError as e:
+            if target != '-':
+                os.remove(target)
+            print(f"❌ {e}", file=sys.stderr)
+            sys.exit(1)
+        elapsed = time.perf_counter() - file_started
+        total_bytes += stats['bytes']
+        total_matches += stats['matches']
+        print(f"🎭 {path} -> {target}: {stats['bytes']:,} bytes, {stats['matches']:,} matches, "
+              f"{stats['chunks']} chunks, {stats['bytes'] / 1e6 / elapsed if elapsed else 0:,.1f} MB/s",
+              file=sys.stderr)
+
+    if args.mapping_out and not args.reverse:
+        with open(args.mapping_out, 'w') as f:
+            json.dump(context.issued, f)
+        print(f"🗺️  Mapping saved: {args.mapping_out} ({len(context.issued):,} values)", file=sys.stderr)
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ {total_bytes / 1e6:,.1f} MB, {total_matches:,} matches in {elapsed:.2f}s "
+          f"({total_bytes / 1e6 / elapsed if elapsed else 0:,.1f} MB/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
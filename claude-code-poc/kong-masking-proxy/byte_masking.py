@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Byte-level JSON request masking
+Masks string values directly in the raw request bytes: no json.loads of the
+whole body, no tree copy and no re-serialization of unchanged content
+
+The leaf-filter schema (leaf_filter.py) is applied by key path, so the same
+fields are skipped as in tree mode. One difference: an image or document
+block's base64 data is only recognized as such when the block's type and its
+source's type come before the data (as every Anthropic client writes them);
+otherwise the data is scanned.
+"""
+
+import json
+import re
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+from leaf_filter import BINARY, BINARY_BLOCK_TYPES, BINARY_SOURCE, CONTENT_BLOCK, REQUEST_SCHEMA
+from masking_engine import MaskingEngine
+
+# One JSON string token (unrolled loop: runs of plain bytes between escapes)
+_JSON_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_KEY_COLON = re.compile(rb'[ \t\r\n]*:')
+_BOOL_VALUE = re.compile(rb'[ \t\r\n]*:[ \t\r\n]*(true|false)')
+_NUMBER_VALUE = re.compile(rb'[ \t\r\n]*:[ \t\r\n]*(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)')
+# What may sit between string tokens: structure, whitespace and the JSON
+# scalars json.loads accepts. Possessive, so a failing gap fails fast.
+_GAP = re.compile(rb'(?:[ \t\r\n{}\[\],:]++|-?\d++(?:\.\d++)?(?:[eE][+-]?\d++)?'
+                  rb'|true|false|null|NaN|-?Infinity)*+')
+_BRACKET = re.compile(rb'[{}\[\]]')
+_OPEN_OBJECT, _OPEN_ARRAY, _CLOSE_OBJECT = ord('{'), ord('['), ord('}')
+
+# Container frame fields: schema node, object?, node of the current key's
+# value, the current key (schema objects only), value of their "type" field
+_NODE, _IS_OBJECT, _VALUE_NODE, _KEY, _TYPE = range(5)
+
+# Edit kinds
+_EDIT_SPAN = 0      # one match inside a plain ASCII string, byte offsets
+_EDIT_STRING = 1    # whole string token re-encoded (escapes or non-ASCII)
+
+
+class InvalidRequestBody(ValueError):
+    """The request body is not a JSON object the scanner can account for"""
+
+
+class JsonScan:
+    """Result of scan_json_bytes(): pending edits plus the fields the proxy needs"""
+
+    __slots__ = ('edits', 'stream', 'user_id', 'temperature')
+
+    def __init__(self):
+        self.edits: List[tuple] = []
+        self.stream = False
+        self.user_id: Optional[str] = None
+        self.temperature: Optional[float] = None
+
+
+def scan_json_bytes(body: bytes, engine: MaskingEngine, schema: Any = REQUEST_SCHEMA) -> JsonScan:
+    """Find every match inside JSON string values (object keys are left alone)
+
+    Values that schema (a leaf-filter node) marks SKIP or BINARY are not
+    scanned, nor is anything below them.
+
+    None of the patterns can match across a quote, a backslash escape or a
+    structural character, so each string token is scanned on its own. Plain
+    ASCII strings are scanned as bytes in place; strings with escapes or
+    non-ASCII text fall back to decoding just that token.
+
+    Every byte outside the string tokens must be JSON structure or a
+    scalar, so nothing that could hold a value goes unscanned (an unclosed
+    string, a bare word, single quotes). Otherwise json.loads decides, which
+    raises JSONDecodeError for such bodies; unbalanced brackets and bodies
+    that are not a JSON object raise InvalidRequestBody.
+    """
+    stripped = body.strip()
+    if not (stripped.startswith(b'{') and stripped.endswith(b'}')):
+        raise InvalidRequestBody("request body is not a JSON object")
+
+    result = JsonScan()
+    body_is_ascii = body.isascii()
+    # Patterns whose literals occur anywhere in the body; plain strings are
+    # slices of it, so this holds for each of them
+    active = engine.active_patterns(body)
+    # Open containers, outermost first (see _NODE ...)
+    frames: List[list] = []
+    pos = 0
+    top_key = None
+    capture_user_id = False
+
+    for token in _JSON_STRING.finditer(body):
+        start, end = token.span()
+        if not _GAP.fullmatch(body, pos, start):
+            _reject(body)
+        # Structural bytes between strings never appear inside one
+        _track_brackets(body, pos, start, frames, schema)
+        if not frames:
+            raise InvalidRequestBody("request body is not a single JSON object")
+        pos = end
+        depth = len(frames)
+        frame = frames[-1]
+
+        if body[end:end + 1] == b':' or _KEY_COLON.match(body, end):
+            node = frame[_NODE]
+            if node is None or node.__class__ is str:
+                # Free-form, or everything below a skipped field
+                frame[_VALUE_NODE] = node
+            else:
+                raw_key = frame[_KEY] = body[start + 1:end - 1]
+                key = json.loads(body[start:end]) if b'\\' in raw_key else raw_key.decode('utf-8')
+                if key == 'source' and node is CONTENT_BLOCK and frame[_TYPE] in BINARY_BLOCK_TYPES:
+                    frame[_VALUE_NODE] = BINARY_SOURCE
+                else:
+                    value_node = node.get(key)
+                    if value_node is BINARY and frame[_TYPE] != 'base64':
+                        value_node = None
+                    frame[_VALUE_NODE] = value_node
+            if depth == 1:
+                top_key = body[start + 1:end - 1]
+                if top_key == b'stream':
+                    value = _BOOL_VALUE.match(body, end)
+                    result.stream = bool(value) and value.group(1) == b'true'
+                elif top_key == b'temperature':
+                    value = _NUMBER_VALUE.match(body, end)
+                    result.temperature = float(value.group(1)) if value else None
+            capture_user_id = depth == 2 and top_key == b'metadata' and body[start + 1:end - 1] == b'user_id'
+            continue
+
+        raw_start, raw_end = start + 1, end - 1
+
+        if capture_user_id:
+            capture_user_id = False
+            result.user_id = json.loads(body[start:end])
+
+        node = frame[_VALUE_NODE] if frame[_IS_OBJECT] else frame[_NODE]
+        if node.__class__ is str:
+            # A block's or source's type decides whether its data is binary
+            if frame[_IS_OBJECT] and frame[_KEY] == b'type':
+                frame[_TYPE] = json.loads(body[start:end])
+            continue
+
+        if body.find(b'\\', raw_start, raw_end) == -1 and (
+                body_is_ascii or body[raw_start:raw_end].isascii()):
+            for span in engine.scan_bytes(body, raw_start, raw_end, active):
+                result.edits.append((_EDIT_SPAN, span))
+            continue
+
+        text = json.loads(body[start:end])
+        spans = engine.scan(text)
+        if spans:
+            result.edits.append((_EDIT_STRING, (start, end, text, spans)))
+
+    if not _GAP.fullmatch(body, pos):
+        _reject(body)
+    _track_brackets(body, pos, len(body), frames, schema)
+    if frames:
+        raise InvalidRequestBody("unbalanced brackets in request body")
+    return result
+
+
+def _track_brackets(body: bytes, pos: int, end: int, frames: List[list], schema: Any):
+    """Open and close container frames for the brackets in body[pos:end]"""
+    for bracket in _BRACKET.finditer(body, pos, end):
+        char = body[bracket.start()]
+        if char == _OPEN_OBJECT or char == _OPEN_ARRAY:
+            if frames:
+                parent = frames[-1]
+                node = parent[_VALUE_NODE] if parent[_IS_OBJECT] else parent[_NODE]
+            elif pos == 0 and bracket.start() == body.index(b'{'):
+                node = schema
+            else:
+                raise InvalidRequestBody("request body is not a single JSON object")
+            frames.append([node, char == _OPEN_OBJECT, None, None, None])
+        elif not frames or frames.pop()[_IS_OBJECT] != (char == _CLOSE_OBJECT):
+            raise InvalidRequestBody("unbalanced brackets in request body")
+
+
+def _reject(body: bytes):
+    """Raise for a body the string tokens and JSON structure do not account for"""
+    # json.loads gives the client the parser's own error
+    json.loads(body)
+    raise InvalidRequestBody("request body is not plain JSON")
+
+
+def iter_json_matches(body: bytes, scan: JsonScan) -> Iterator[Tuple[str, str]]:
+    """Yield (pattern name, original value) for every match found by the scan"""
+    for kind, edit in scan.edits:
+        if kind == _EDIT_SPAN:
+            start, end, name = edit
+            yield name, body[start:end].decode('ascii')
+        else:
+            _, _, text, spans = edit
+            for start, end, name in spans:
+                yield name, text[start:end]
+
+
+def apply_json_edits(body: bytes, scan: JsonScan, tokenize: Callable[[str, str], str]) -> bytes:
+    """Splice masked tokens into the original body; unchanged bytes are copied as-is"""
+    if not scan.edits:
+        return body
+
+    view = memoryview(body)
+    out = bytearray()
+    pos = 0
+
+    for kind, edit in scan.edits:
+        if kind == _EDIT_SPAN:
+            start, end, name = edit
+            out += view[pos:start]
+            out += tokenize(name, body[start:end].decode('ascii')).encode('ascii')
+        else:
+            start, end, text, spans = edit
+            tokens = [tokenize(name, text[s:e]) for s, e, name in spans]
+            out += view[pos:start]
+            out += json.dumps(MaskingEngine.splice(text, spans, tokens), ensure_ascii=False).encode('utf-8')
+        pos = end
+
+    out += view[pos:]
+    return bytes(out)
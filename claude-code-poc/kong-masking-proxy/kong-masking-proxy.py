@@ -5,226 +5,976 @@ Intercepts Claude Code requests, masks AWS resources, and forwards to Kong Gatew
 """
 
 from fastapi import FastAPI, Request, Response, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 import uvicorn
-import httpx
+import asyncio
 import json
 import logging
-import re
-from typing import Dict, Any, AsyncGenerator
+from typing import Dict, Any, AsyncGenerator, List, Optional, Tuple
 import os
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+from masking_engine import AWS_PATTERNS, PATTERN_SOURCE, TOKEN_FORMATS, default_engine
+from mapping_store import DEFAULT_SESSION, MappingStore, MaskingContext
+from unmasking import SSEUnmasker, Unmasker
+from byte_masking import InvalidRequestBody, apply_json_edits, iter_json_matches, scan_json_bytes
+from redis_mapping_store import DEFAULT_PREFIX, DEFAULT_REDIS_TTL, RedisMappingStore
+from masking_cache import MaskingCache
+from upstream_client import PoolMonitor, create_upstream_client, forwardable_headers, relayed_headers
+from masking_executor import LoopLagMonitor, MaskingExecutor
+from metrics import CONTENT_TYPE, SIZE_BUCKETS, MetricsRegistry, merge_stats
+from batch_masking import DEFAULT_BATCH_SIZE, MaskBatch, UnmaskBatch
+from admission import AdmissionController, AdmissionRejected, client_key
+from structured_logging import LogSampler, redact_headers, setup_logging
+from response_cache import ResponseCache, UpstreamResult
+from token_cipher import CipherTokenStore, TokenCipher
+from worker_stats import PUBLISH_INTERVAL, current_worker
+from leaf_filter import (BINARY, CACHED, CONTENT_BLOCK, PREFILTER, REQUEST_SCHEMA, SKIP,
+                         LeafStats, field_node, is_binary_block)
+
+# Setup logging: records are formatted and written by a background thread
+# (LOG_FORMAT json or text); LOG_SAMPLE_RATE of the requests get a summary line
+log_handler = setup_logging(
+    level=os.environ.get("LOG_LEVEL", "INFO"),
+    fmt=os.environ.get("LOG_FORMAT", "json"),
+    queue_size=int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
 )
+log_sampler = LogSampler(float(os.environ.get("LOG_SAMPLE_RATE", "1.0")))
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Prometheus metrics (/metrics): one latency histogram per request stage
+metrics = MetricsRegistry()
+STAGE_SECONDS = metrics.histogram(
+    "masking_proxy_stage_seconds",
+    "Time spent in each stage of a masked request (/v1/messages, count_tokens) "
+    "(body_read, parse, mask, pool_wait, upstream_connect, ttfb, stream, unmask)",
+    ["stage"]
+)
+REQUEST_SECONDS = metrics.histogram(
+    "masking_proxy_request_seconds", "End-to-end latency of masked requests", ["mode", "stream"]
+)
+REQUESTS_TOTAL = metrics.counter(
+    "masking_proxy_requests_total", "Completed masked requests by status", ["status"]
+)
+REQUEST_BYTES = metrics.histogram(
+    "masking_proxy_request_bytes", "Request body size", buckets=SIZE_BUCKETS
+)
+RESPONSE_BYTES = metrics.histogram(
+    "masking_proxy_response_bytes", "Response body size sent to the client", ["stream"],
+    buckets=SIZE_BUCKETS
+)
+MASKED_VALUES = metrics.counter(
+    "masking_proxy_masked_values_total",
+    "Distinct values masked per request, by pattern (cache hits included)", ["pattern"]
+)
+REQUESTS_IN_FLIGHT = metrics.gauge(
+    "masking_proxy_requests_in_flight", "Masked requests being handled"
+)
+STREAMS_IN_FLIGHT = metrics.gauge(
+    "masking_proxy_streams_in_flight", "Streaming responses being relayed"
+)
+BATCH_DOCUMENTS = metrics.counter(
+    "masking_proxy_batch_documents_total", "Documents processed by the batch API", ["op"]
+)
+ROUTED_REQUESTS = metrics.counter(
+    "masking_proxy_routed_requests_total",
+    "Anthropic API requests by endpoint and the path they took (masked, passthrough, not_found)",
+    ["endpoint", "path"]
+)
+LEAF_CHARS = metrics.histogram(
+    "masking_proxy_leaf_chars",
+    "Characters of string leaves per tree-mode request: scanned, or skipped by schema, binary, prefilter or cache",
+    ["leaf"], buckets=SIZE_BUCKETS
+)
+PASSTHROUGH_SECONDS = metrics.histogram(
+    "masking_proxy_passthrough_seconds", "Passthrough request latency, until the last response byte",
+    ["endpoint"]
+)
+
+# Label children resolved once, off the request path
+_STAGES = {stage: STAGE_SECONDS.labels(stage) for stage in (
+    "body_read", "parse", "mask", "pool_wait", "upstream_connect", "ttfb", "stream", "unmask"
+)}
+_LEAVES = {leaf: LEAF_CHARS.labels(leaf) for leaf in ("scanned", SKIP, BINARY, PREFILTER, CACHED)}
+_PATTERN_BY_PREFIX = {prefix: name for name, (_, prefix) in TOKEN_FORMATS.items()}
+
+def observe_stage(stage: str, seconds: float):
+    _STAGES[stage].observe(seconds)
+
+pool_monitor = PoolMonitor(on_phase=observe_stage)
+loop_monitor = LoopLagMonitor()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the shared Kong client on startup and close it on shutdown"""
+    app.state.upstream = create_upstream_client()
+    loop_monitor.start()
+    # Under proxy-launcher.py, share this worker's stats with the others
+    worker = current_worker()
+    publisher = asyncio.create_task(publish_worker_stats(app, worker)) if worker else None
+    try:
+        yield
+    finally:
+        if publisher is not None:
+            publisher.cancel()
+        await loop_monitor.stop()
+        masking_executor.shutdown()
+        await app.state.upstream.aclose()
+        if isinstance(mapping_store, RedisMappingStore):
+            await mapping_store.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Kong Gateway URL (can be HTTP since it's internal)
 KONG_URL = os.environ.get("KONG_URL", "http://kong:8000")
 KONG_ROUTE = os.environ.get("KONG_ROUTE", "/claude-proxy/v1/messages")
+# Kong path the other Anthropic endpoints live under (API_ROUTES)
+KONG_API_PREFIX = os.environ.get(
+    "KONG_API_PREFIX",
+    KONG_ROUTE[:-len("/v1/messages")] if KONG_ROUTE.endswith("/v1/messages") else ""
+)
 
-# AWS Resource Patterns (same as Kong plugin)
-AWS_PATTERNS = {
-    'ec2_instance': r'\bi-[0-9a-f]{8,17}\b',
-    's3_bucket': r'\b[a-z0-9][a-z0-9\-\.]{2,62}(?:-bucket|bucket-)\b',
-    'private_ip': r'\b10\.\d{1,3}\.\d{1,3}\.\d{1,3}\b',
-    'rds_instance': r'\b[a-z][a-z0-9\-]{0,62}\.rds\.amazonaws\.com\b',
-    'account_id': r'\b\d{12}\b',
-    'access_key': r'\bAKIA[A-Z0-9]{16}\b',
-    'arn': r'\barn:aws:[a-z0-9\-]+:[a-z0-9\-]*:\d{12}:[a-z0-9\-\/\:\_]+\b'
-}
+# Session-scoped mapping store (replaces the unbounded global masking map)
+# MASK_STORE_BACKEND=redis shares mappings across workers/replicas and with
+# the Kong plugin; the memory store then acts as its local cache.
+# MASK_STORE_BACKEND=cipher issues stateless encrypted tokens instead
+_store_options = dict(
+    ttl=float(os.environ.get("MASK_STORE_TTL", "3600")),
+    max_entries=int(os.environ.get("MASK_STORE_MAX_ENTRIES", "10000")),
+    max_bytes=int(os.environ.get("MASK_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+)
+MASK_STORE_BACKEND = os.environ.get("MASK_STORE_BACKEND", "memory")
+if MASK_STORE_BACKEND == "cipher":
+    # Tokens are encryptions of the values (MASK_TOKEN_KEYS): nothing to store
+    # or share, any replica with the keys unmasks them
+    mapping_store = CipherTokenStore(TokenCipher.from_env(), recent_entries=_store_options["max_entries"])
+elif MASK_STORE_BACKEND == "redis":
+    mapping_store = RedisMappingStore.from_url(
+        os.environ.get("REDIS_URL", "redis://redis:6379/0"),
+        prefix=os.environ.get("REDIS_PREFIX", DEFAULT_PREFIX),
+        redis_ttl=int(os.environ.get("REDIS_TTL", str(DEFAULT_REDIS_TTL))),
+        **_store_options
+    )
+else:
+    mapping_store = MappingStore(**_store_options)
+mask_counter = mapping_store.issued
+
+# Masked message content blocks, so resent conversation history is not rescanned
+masking_cache = MaskingCache(
+    max_bytes=int(os.environ.get("MASK_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+    min_block_bytes=int(os.environ.get("MASK_CACHE_MIN_BLOCK_BYTES", "256"))
+)
+
+# Bodies above MASK_INLINE_MAX_BYTES are parsed and masked on a thread pool so
+# they do not stall other requests; with MASK_SCAN_PROCESSES > 0, strings of
+# MASK_CHUNK_MIN_CHARS or more are also scanned in parallel windows
+masking_executor = MaskingExecutor(
+    inline_max_bytes=int(os.environ.get("MASK_INLINE_MAX_BYTES", str(256 * 1024))),
+    thread_workers=int(os.environ.get("MASK_POOL_WORKERS", "4")),
+    scan_processes=int(os.environ.get("MASK_SCAN_PROCESSES", "0")),
+    chunk_min_chars=int(os.environ.get("MASK_CHUNK_MIN_CHARS", str(1024 * 1024))),
+    window_chars=int(os.environ.get("MASK_CHUNK_CHARS", str(256 * 1024)))
+)
+
+# Admission control for masked requests: at most ADMISSION_MAX_IN_FLIGHT requests
+# at once and ADMISSION_MAX_PER_CLIENT per API key; the excess waits up to
+# ADMISSION_QUEUE_TIMEOUT seconds in a queue of ADMISSION_MAX_QUEUE (0 = no limit)
+admission = AdmissionController(
+    max_in_flight=int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", "256")),
+    max_per_client=int(os.environ.get("ADMISSION_MAX_PER_CLIENT", "32")),
+    max_queue=int(os.environ.get("ADMISSION_MAX_QUEUE", "512")),
+    queue_timeout=float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "10"))
+)
+# Header naming the client when it is not the API key (e.g. a user id set by a gateway)
+ADMISSION_CLIENT_HEADER = os.environ.get("ADMISSION_CLIENT_HEADER") or None
+
+# Identical non-streaming requests in flight share one upstream call
+# (COALESCE_REQUESTS); temperature 0 requests sent with the CACHE_HEADER
+# ("true" or seconds) are also answered from a short-TTL response cache of
+# RESPONSE_CACHE_MAX_BYTES (0 = off)
+response_cache = ResponseCache(
+    coalesce=os.environ.get("COALESCE_REQUESTS", "true").lower() == "true",
+    max_bytes=int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    default_ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "30")),
+    max_ttl=float(os.environ.get("RESPONSE_CACHE_MAX_TTL", "300"))
+)
+CACHE_HEADER = os.environ.get("RESPONSE_CACHE_HEADER", "x-masking-cache")
 
-# Masking map to store original values
-masking_map = {}
-mask_counter = {'ec2': 0, 's3': 0, 'ip': 0, 'rds': 0, 'account': 0, 'key': 0, 'arn': 0}
+metrics.gauge("masking_proxy_upstream_in_flight", "Upstream requests to Kong in flight",
+              function=lambda: pool_monitor.in_flight)
+metrics.gauge("masking_proxy_event_loop_lag_max_seconds", "Largest event loop stall seen",
+              function=lambda: loop_monitor.lag_max)
+metrics.gauge("masking_proxy_log_records_dropped", "Log records dropped because the log writer fell behind",
+              function=lambda: log_handler.dropped)
+metrics.snapshot("masking_proxy_mapping_store", "Mapping store statistics", mapping_store.snapshot)
+metrics.snapshot("masking_proxy_cache", "Incremental masking cache statistics", masking_cache.snapshot)
+metrics.snapshot("masking_proxy_executor", "Masking executor statistics", masking_executor.snapshot)
+metrics.snapshot("masking_proxy_response_cache", "Request coalescing and response cache statistics",
+                 response_cache.snapshot)
+metrics.snapshot("masking_proxy_admission", "Admission control statistics", admission.snapshot)
+metrics.snapshot("masking_proxy_patterns", "Masking engine scan statistics", default_engine.snapshot)
+metrics.labeled_snapshot("masking_proxy_pattern_hits_total", "Matches found per pattern", "pattern",
+                         lambda: default_engine.hits)
 
-def mask_aws_resources(text: str) -> str:
+# "tree": json.loads + mask_request_body walk; "bytes": mask string values in
+# the raw request bytes and forward everything else untouched
+MASKING_MODE = os.environ.get("MASKING_MODE", "tree")
+
+# Documents per mapping-store round trip in /v1/mask/batch and /v1/unmask/batch
+BATCH_SIZE = int(os.environ.get("MASK_BATCH_SIZE", str(DEFAULT_BATCH_SIZE)))
+# Largest request body the batch endpoints accept (413 above it)
+BATCH_MAX_BYTES = int(os.environ.get("MASK_BATCH_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Header that pins a masking session; falls back to metadata.user_id
+SESSION_HEADER = os.environ.get("MASKING_SESSION_HEADER", "x-masking-session")
+
+def resolve_session(headers, body: Any) -> str:
+    """Pick the masking session for a request (conversation-level token scope)"""
+    session = headers.get(SESSION_HEADER)
+    if session:
+        return session
+    
+    metadata = body.get('metadata') if isinstance(body, dict) else None
+    if isinstance(metadata, dict):
+        user_id = metadata.get('user_id')
+        if isinstance(user_id, str) and user_id:
+            return user_id
+    
+    return DEFAULT_SESSION
+
+def mask_aws_resources(text: str, context: Optional[MaskingContext] = None,
+                       active: Optional[int] = None) -> str:
     """Mask AWS resources in text"""
     if not isinstance(text, str):
         return text
     
-    masked_text = text
-    
-    # EC2 Instances
-    for match in re.finditer(AWS_PATTERNS['ec2_instance'], text):
-        original = match.group()
-        mask_counter['ec2'] += 1
-        masked = f"EC2_INSTANCE_{mask_counter['ec2']:03d}"
-        masking_map[masked] = original
-        masked_text = masked_text.replace(original, masked)
-    
-    # S3 Buckets
-    for match in re.finditer(AWS_PATTERNS['s3_bucket'], text):
-        original = match.group()
-        mask_counter['s3'] += 1
-        masked = f"S3_BUCKET_{mask_counter['s3']:03d}"
-        masking_map[masked] = original
-        masked_text = masked_text.replace(original, masked)
-    
-    # Private IPs
-    for match in re.finditer(AWS_PATTERNS['private_ip'], text):
-        original = match.group()
-        mask_counter['ip'] += 1
-        masked = f"PRIVATE_IP_{mask_counter['ip']:03d}"
-        masking_map[masked] = original
-        masked_text = masked_text.replace(original, masked)
-    
-    # RDS Instances
-    for match in re.finditer(AWS_PATTERNS['rds_instance'], text):
-        original = match.group()
-        mask_counter['rds'] += 1
-        masked = f"RDS_INSTANCE_{mask_counter['rds']:03d}"
-        masking_map[masked] = original
-        masked_text = masked_text.replace(original, masked)
-    
-    # AWS Account IDs
-    for match in re.finditer(AWS_PATTERNS['account_id'], text):
-        original = match.group()
-        mask_counter['account'] += 1
-        masked = f"AWS_ACCOUNT_{mask_counter['account']:03d}"
-        masking_map[masked] = original
-        masked_text = masked_text.replace(original, masked)
-    
-    # Access Keys
-    for match in re.finditer(AWS_PATTERNS['access_key'], text):
-        original = match.group()
-        mask_counter['key'] += 1
-        masked = f"ACCESS_KEY_{mask_counter['key']:03d}"
-        masking_map[masked] = original
-        masked_text = masked_text.replace(original, masked)
-    
-    # ARNs
-    for match in re.finditer(AWS_PATTERNS['arn'], text):
-        original = match.group()
-        mask_counter['arn'] += 1
-        masked = f"AWS_ARN_{mask_counter['arn']:03d}"
-        masking_map[masked] = original
-        masked_text = masked_text.replace(original, masked)
-    
-    if masked_text != text:
-        logger.info(f"🎭 Masked {len(masking_map)} AWS resources")
+    if context is None:
+        context = MaskingContext(mapping_store)
+    
+    if masking_executor.should_chunk(text):
+        spans = masking_executor.parallel_scan(text)
+        masked_text = default_engine.splice(
+            text, spans, [context.tokenize(name, text[start:end]) for start, end, name in spans]
+        ) if spans else text
+    else:
+        masked_text = default_engine.mask(text, context.tokenize, active)
+    
+    if masked_text is not text:
+        logger.debug("🎭 Masked AWS resources (%d mapped)", len(mapping_store))
     
     return masked_text
 
-def mask_request_body(body: Dict[str, Any]) -> Dict[str, Any]:
-    """Recursively mask AWS resources in request body"""
-    if isinstance(body, dict):
-        masked_body = {}
-        for key, value in body.items():
-            if isinstance(value, str):
-                masked_body[key] = mask_aws_resources(value)
-            elif isinstance(value, (dict, list)):
-                masked_body[key] = mask_request_body(value)
-            else:
-                masked_body[key] = value
-        return masked_body
-    elif isinstance(body, list):
-        return [mask_request_body(item) for item in body]
-    elif isinstance(body, str):
-        return mask_aws_resources(body)
-    else:
-        return body
+def mask_leaf(text: str, context: MaskingContext, leaves: LeafStats) -> str:
+    """Mask one string leaf unless the engine's prefilter rules it out"""
+    active = default_engine.active_patterns(text)
+    if not active:
+        leaves.skip(PREFILTER, len(text))
+        return text
+    leaves.scanned += len(text)
+    return mask_aws_resources(text, context, active)
+
+def mask_request_body(body: Any, context: Optional[MaskingContext] = None,
+                      leaves: Optional[LeafStats] = None, schema: Any = REQUEST_SCHEMA) -> Any:
+    """Mask AWS resources in the string leaves of a request body
+
+    Walks the body with an explicit stack, so deep nesting cannot hit the
+    recursion limit, and copies containers instead of changing the input.
+    Each string is classified first (leaf_filter.py): schema fields and
+    base64 data are skipped, the rest goes through the engine's prefilter.
+    leaves counts the characters scanned and skipped.
+    """
+    if context is None:
+        context = MaskingContext(mapping_store)
+    if leaves is None:
+        leaves = LeafStats()
+    
+    if isinstance(body, str):
+        return mask_leaf(body, context, leaves)
+    
+    cache_content = masking_cache.max_bytes > 0
+    root = [body]
+    # (container, key, schema node of container[key], message content?)
+    stack = [(root, 0, schema, False)]
+    while stack:
+        container, key, node, content = stack.pop()
+        value = container[key]
+        if content:
+            container[key] = mask_message_content(value, context, leaves, node)
+            continue
+        
+        # Strings are masked on the spot; containers wait on the stack,
+        # pushed in reverse so they come off it in document order
+        nested = []
+        if isinstance(value, dict):
+            masked = container[key] = dict(value)
+            binary = node is CONTENT_BLOCK and is_binary_block(value)
+            for field, item in value.items():
+                item_node = field_node(node, field, binary)
+                if item_node.__class__ is str:
+                    # SKIP or BINARY
+                    if isinstance(item, str):
+                        leaves.skip(item_node, len(item))
+                elif field == 'content' and cache_content:
+                    nested.append((masked, field, item_node, True))
+                elif isinstance(item, str):
+                    masked[field] = mask_leaf(item, context, leaves)
+                elif isinstance(item, (dict, list)):
+                    nested.append((masked, field, item_node, False))
+        elif isinstance(value, list):
+            masked = container[key] = list(value)
+            for index, item in enumerate(value):
+                if isinstance(item, str):
+                    masked[index] = mask_leaf(item, context, leaves)
+                elif isinstance(item, (dict, list)):
+                    nested.append((masked, index, node, False))
+        stack.extend(reversed(nested))
+    return root[0]
+
+def leaf_matches(body: Any, schema: Any = REQUEST_SCHEMA) -> List[Tuple[str, str]]:
+    """(pattern name, original) of every match in the leaves mask_request_body scans
+
+    Same leaf classification as the walk, so a store that resolves tokens in
+    batches (prefetch) is only asked for the values that get masked.
+    """
+    matches = []
+    stack = [(body, schema)]
+    while stack:
+        value, node = stack.pop()
+        if isinstance(value, str):
+            active = default_engine.active_patterns(value)
+            if active:
+                matches.extend((name, value[start:end])
+                               for start, end, name in default_engine.scan(value, active=active))
+        elif isinstance(value, dict):
+            binary = node is CONTENT_BLOCK and is_binary_block(value)
+            for field, item in value.items():
+                item_node = field_node(node, field, binary)
+                if item_node.__class__ is not str:
+                    stack.append((item, item_node))
+        elif isinstance(value, list):
+            stack.extend((item, node) for item in value)
+    return matches
+
+def mask_message_content(content: Any, context: MaskingContext, leaves: Optional[LeafStats] = None,
+                         node: Any = CONTENT_BLOCK) -> Any:
+    """Mask a message's content block by block through the incremental cache"""
+    if leaves is None:
+        leaves = LeafStats()
+    
+    def mask_block(block: Any, block_context: MaskingContext) -> Any:
+        return mask_request_body(block, block_context, leaves, node)
+    
+    if isinstance(content, list):
+        return [
+            # Hashing megabytes of base64 for a cache key costs more than the
+            # walk, which skips the data anyway
+            mask_block(block, context) if node is CONTENT_BLOCK and isinstance(block, dict)
+            and is_binary_block(block) else masking_cache.mask(block, context, mask_block, node, leaves)
+            for block in content
+        ]
+    if isinstance(content, (str, dict)):
+        return masking_cache.mask(content, context, mask_block, node, leaves)
+    return content
 
 @app.post("/v1/messages")
 async def proxy_messages(request: Request):
     """Proxy /v1/messages endpoint with masking"""
+    return await proxy_masked(request, "/v1/messages", KONG_ROUTE)
+
+def request_client(request: Request) -> str:
+    """Admission key of the caller"""
+    return client_key(request.headers, request.client.host if request.client else "unknown",
+                      ADMISSION_CLIENT_HEADER)
+
+def rejected_response(e: AdmissionRejected) -> JSONResponse:
+    """Anthropic-style error for a request turned away by admission control"""
+    REQUESTS_TOTAL.labels(str(e.status)).inc()
+    logger.warning("🚦 Request rejected (%d): %s", e.status, e.reason,
+                   extra={"event": "rejected", "status": e.status})
+    return JSONResponse(
+        status_code=e.status,
+        headers={"retry-after": str(e.retry_after)},
+        content={
+            "type": "error",
+            "error": {
+                "type": "rate_limit_error" if e.status == 429 else "overloaded_error",
+                "message": e.reason
+            }
+        }
+    )
+
+async def proxy_masked(request: Request, endpoint: str, upstream_path: str):
+    """Mask the request body, forward it to Kong and unmask the response"""
+    
+    started = time.perf_counter()
+    ROUTED_REQUESTS.labels(endpoint, "masked").inc()
+    client = request_client(request)
+    try:
+        release_slot = await admission.acquire(client)
+    except AdmissionRejected as e:
+        return rejected_response(e)
+    
+    REQUESTS_IN_FLIGHT.inc()
+    finished = False
+    stream = False
+    sampled = log_sampler.sample()
+    size = 0
+    masked = 0
+    served_from = "upstream"
+    leaves = None
+    
+    def finish(status: int):
+        """Record the end of the request exactly once"""
+        nonlocal finished
+        if not finished:
+            finished = True
+            release_slot()
+            REQUESTS_IN_FLIGHT.dec()
+            REQUESTS_TOTAL.labels(str(status)).inc()
+            elapsed = time.perf_counter() - started
+            REQUEST_SECONDS.labels(MASKING_MODE, "true" if stream else "false").observe(elapsed)
+            if leaves is not None:
+                for leaf, histogram in _LEAVES.items():
+                    histogram.observe(getattr(leaves, leaf))
+            if sampled:
+                logger.info("📨 %s %d in %.1f ms", endpoint, status, elapsed * 1000, extra={
+                    "event": "request", "endpoint": endpoint, "status": status, "stream": stream,
+                    "duration_ms": round(elapsed * 1000, 3), "request_bytes": size, "masked": masked,
+                    "served_from": served_from, **(leaves.snapshot() if leaves is not None else {})
+                })
     
-    # Get request body
-    body = await request.body()
     try:
-        body_json = json.loads(body)
-        logger.info(f"📨 Received request from Claude Code")
+        # Get request body
+        body = await request.body()
+        mark = time.perf_counter()
+        observe_stage("body_read", mark - started)
+        size = len(body)
+        REQUEST_BYTES.observe(size)
         
         # Mask AWS resources in the request
-        masked_body = mask_request_body(body_json)
+        # Large bodies are parsed and masked off the event loop
+        if MASKING_MODE == "bytes":
+            scan = await masking_executor.run(size, scan_json_bytes, body, default_engine)
+            mark = _stage_done("parse", mark)
+            session = request.headers.get(SESSION_HEADER) or scan.user_id or DEFAULT_SESSION
+            context = MaskingContext(mapping_store, session)
+            await mapping_store.prefetch(session, iter_json_matches(body, scan))
+            upstream_content = await masking_executor.run(size, apply_json_edits, body, scan, context.tokenize)
+            upstream_json = None
+            stream = scan.stream
+            temperature = scan.temperature
+        else:
+            body_json = await masking_executor.run(size, json.loads, body)
+            if not isinstance(body_json, dict):
+                raise InvalidRequestBody("request body is not a JSON object")
+            mark = _stage_done("parse", mark)
+            context = MaskingContext(mapping_store, resolve_session(request.headers, body_json))
+            if mapping_store.batch_prefetch:
+                # Resolve every token in one batch before the synchronous walk
+                candidates = await masking_executor.run(size, leaf_matches, body_json)
+                await mapping_store.prefetch(context.session, candidates)
+            upstream_content = None
+            leaves = LeafStats()
+            upstream_json = await masking_executor.run(size, mask_request_body, body_json, context, leaves)
+            stream = body_json.get('stream', False)
+            temperature = body_json.get('temperature')
+        mark = _stage_done("mask", mark)
+        count_masked_values(context.issued)
+        masked = len(context.issued)
+        unmasker = Unmasker(context.issued)
         
         # Forward to Kong
-        kong_url = f"{KONG_URL}{KONG_ROUTE}"
-        logger.info(f"🚀 Forwarding to Kong: {kong_url}")
+        kong_url = f"{KONG_URL}{upstream_path}"
+        logger.debug("🚀 Forwarding to Kong: %s", kong_url)
         
         # Prepare headers (forward most headers, update some)
-        headers = dict(request.headers)
+        headers = forwardable_headers(request.headers, drop=('content-length', CACHE_HEADER))  # Let httpx calculate
         headers['host'] = 'api.anthropic.com'  # Set correct host header
-        headers.pop('content-length', None)  # Let httpx calculate
         
-        # Check if streaming is requested
-        stream = body_json.get('stream', False)
+        coalescing = not stream and response_cache.enabled
+        if coalescing and upstream_content is None:
+            # Serialize here (as httpx would) so the masked bytes can be keyed
+            upstream_content = json.dumps(upstream_json).encode('utf-8')
+            upstream_json = None
+            headers.setdefault('content-type', 'application/json')
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            if stream:
-                # Handle streaming response
-                logger.info("📡 Streaming response requested")
-                response = await client.post(
-                    kong_url,
-                    json=masked_body,
-                    headers=headers,
-                    timeout=60.0
-                )
-                
-                # Stream the response back
-                async def generate():
+        client = request.app.state.upstream
+        upstream_request = client.build_request(
+            "POST",
+            kong_url,
+            content=upstream_content,
+            json=upstream_json,
+            headers=headers,
+            extensions=pool_monitor.extensions()
+        )
+        
+        if stream:
+            # Handle streaming response
+            pool_monitor.request_started()
+            try:
+                # Only the status line and headers are read here
+                response = await client.send(upstream_request, stream=True)
+            except BaseException:
+                pool_monitor.request_finished()
+                raise
+            mark = _stage_done("ttfb", mark)
+            
+            # Bodies are relayed decoded, so encoding and length no longer apply
+            response_headers = relayed_headers(
+                response.headers, drop=('content-encoding', 'content-length')
+            )
+            
+            STREAMS_IN_FLIGHT.inc()
+            closed = False
+            
+            async def close_upstream():
+                nonlocal closed
+                if not closed:
+                    closed = True
+                    await response.aclose()
+                    pool_monitor.request_finished()
+                    STREAMS_IN_FLIGHT.dec()
+                    finish(response.status_code)
+            
+            # Relay chunk by chunk: the next upstream read only happens once the
+            # client has taken the previous chunk, and a client disconnect
+            # cancels the generator, which closes the upstream response
+            async def relay():
+                sent = 0
+                unmask_seconds = 0.0
+                try:
+                    if not unmasker:
+                        async for chunk in response.aiter_bytes():
+                            sent += len(chunk)
+                            yield chunk
+                        return
+                    
+                    sse = SSEUnmasker(unmasker)
                     async for chunk in response.aiter_bytes():
-                        yield chunk
-                
-                return StreamingResponse(
-                    generate(),
-                    media_type=response.headers.get('content-type', 'text/event-stream'),
-                    status_code=response.status_code,
-                    headers=dict(response.headers)
+                        unmask_started = time.perf_counter()
+                        out = sse.feed(chunk)
+                        unmask_seconds += time.perf_counter() - unmask_started
+                        if out:
+                            sent += len(out)
+                            yield out
+                    tail = sse.flush()
+                    if tail:
+                        sent += len(tail)
+                        yield tail
+                finally:
+                    observe_stage("stream", time.perf_counter() - mark)
+                    observe_stage("unmask", unmask_seconds)
+                    RESPONSE_BYTES.labels("true").observe(sent)
+                    await close_upstream()
+            
+            return StreamingResponse(
+                relay(),
+                media_type=response.headers.get('content-type', 'text/event-stream'),
+                status_code=response.status_code,
+                headers=response_headers,
+                background=BackgroundTask(close_upstream)
+            )
+        else:
+            # Handle regular response
+            async def fetch_upstream() -> UpstreamResult:
+                fetch_mark = time.perf_counter()
+                pool_monitor.request_started()
+                try:
+                    response = await client.send(upstream_request, stream=True)
+                    fetch_mark = _stage_done("ttfb", fetch_mark)
+                    try:
+                        await response.aread()
+                    finally:
+                        await response.aclose()
+                finally:
+                    pool_monitor.request_finished()
+                _stage_done("stream", fetch_mark)
+                return UpstreamResult(response.status_code, response.headers, response.content)
+            
+            if coalescing:
+                # Identical requests in flight (or cached) share one upstream call;
+                # the shared response is still masked and unmasked per request below
+                result, served_from = await response_cache.fetch(
+                    response_cache.key(upstream_content, request.headers, upstream_path),
+                    len(upstream_content),
+                    response_cache.cache_ttl(request.headers.get(CACHE_HEADER), temperature),
+                    fetch_upstream
                 )
             else:
-                # Handle regular response
-                response = await client.post(
-                    kong_url,
-                    json=masked_body,
-                    headers=headers
-                )
-                
-                # Note: Response unmasking would be handled by Kong
-                # This proxy only masks the request
-                
-                return Response(
-                    content=response.content,
-                    status_code=response.status_code,
-                    headers=dict(response.headers),
-                    media_type=response.headers.get('content-type', 'application/json')
-                )
+                result = await fetch_upstream()
+            mark = time.perf_counter()
+            
+            # Bodies are relayed decoded, so encoding and length no longer apply
+            response_headers = relayed_headers(
+                result.headers, drop=('content-encoding', 'content-length')
+            )
+            if served_from != "upstream":
+                response_headers[CACHE_HEADER] = served_from
+            
+            # Restore the original values of every token this request used;
+            # large responses are unmasked off the event loop like masking
+            content = await masking_executor.run(len(result.content), unmasker.unmask_bytes, result.content)
+            _stage_done("unmask", mark)
+            RESPONSE_BYTES.labels("false").observe(len(content))
+            finish(result.status)
+            return Response(
+                content=content,
+                status_code=result.status,
+                headers=response_headers,
+                media_type=result.headers.get('content-type', 'application/json')
+            )
                 
-    except json.JSONDecodeError:
+    except (json.JSONDecodeError, UnicodeDecodeError, InvalidRequestBody):
+        finish(400)
         logger.error("Failed to parse request body as JSON")
         raise HTTPException(status_code=400, detail="Invalid JSON in request body")
     except Exception as e:
-        logger.error(f"Error proxying request: {e}")
+        finish(500)
+        logger.error("Error proxying request: %s", e, extra={"event": "error"})
         raise HTTPException(status_code=500, detail=str(e))
+    except BaseException:
+        # Client gone or task cancelled before a response was returned
+        finish(499)
+        raise
 
-@app.get("/health")
-async def health_check():
-    """Health check endpoint"""
+def _stage_done(stage: str, since: float) -> float:
+    """Observe the stage that started at `since`; return now as the next start"""
+    now = time.perf_counter()
+    _STAGES[stage].observe(now - since)
+    return now
+
+def count_masked_values(issued: Dict[str, str]):
+    """Count a request's masked values per pattern from its token prefixes"""
+    for token in issued:
+        pattern = _PATTERN_BY_PREFIX.get(token.rpartition('_')[0])
+        if pattern is not None:
+            MASKED_VALUES.labels(pattern).inc()
+
+# Batch API for internal services: documents in, documents out, no upstream
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl", "application/ndjson")
+
+def _batch_format(request: Request) -> str:
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in NDJSON_TYPES:
+        return "ndjson"
+    if content_type == "text/plain":
+        return "text"
+    return "json"
+
+class _BadLine:
+    """Placeholder for an NDJSON line that is not JSON; reported in place"""
+    __slots__ = ("number",)
+    
+    def __init__(self, number: int):
+        self.number = number
+
+class _BodyTooLarge(Exception):
+    """The batch body went past BATCH_MAX_BYTES"""
+
+async def _body_chunks(request: Request) -> AsyncGenerator[bytes, None]:
+    """request.stream(), cut off at BATCH_MAX_BYTES"""
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > BATCH_MAX_BYTES:
+            raise _BodyTooLarge()
+        yield chunk
+
+async def _body_lines(request: Request) -> AsyncGenerator[bytes, None]:
+    """Yield the body's lines, without their newline, as they arrive"""
+    partial = []
+    async for chunk in _body_chunks(request):
+        lines = chunk.split(b"\n")
+        if len(lines) == 1:
+            partial.append(chunk)
+            continue
+        partial.append(lines[0])
+        yield b"".join(partial)
+        for line in lines[1:-1]:
+            yield line
+        partial = [lines[-1]]
+    tail = b"".join(partial)
+    if tail:
+        yield tail
+
+async def _line_batches(request: Request, fmt: str) -> AsyncGenerator[Tuple[List[Any], int], None]:
+    """Yield (documents, bytes) every BATCH_SIZE lines, parsed as the body arrives"""
+    documents = []
+    size = 0
+    number = 0
+    async for line in _body_lines(request):
+        number += 1
+        size += len(line) + 1
+        if fmt == "text":
+            documents.append(line.decode("utf-8"))
+        elif line.strip():
+            try:
+                documents.append(json.loads(line))
+            except ValueError:
+                documents.append(_BadLine(number))
+        if len(documents) == BATCH_SIZE:
+            yield documents, size
+            documents, size = [], 0
+    if documents:
+        yield documents, size
+
+async def _batch_input(request: Request, fmt: str):
+    """Return (session, batches); batches yields (documents, bytes) per BATCH_SIZE documents
+
+    json: an array, or {"documents": [...], "session": "..."}; read whole,
+          since the session may come after the documents
+    ndjson: one JSON value per line (bad lines become an error result)
+    text: one string document per line
+    """
+    session = request.headers.get(SESSION_HEADER)
+    if fmt != "json":
+        return session or DEFAULT_SESSION, _line_batches(request, fmt)
+    
+    body = b"".join([chunk async for chunk in _body_chunks(request)])
+    payload = await masking_executor.run(len(body), json.loads, body)
+    if isinstance(payload, dict):
+        session = session or payload.get("session")
+        payload = payload.get("documents")
+    if not isinstance(payload, list):
+        raise ValueError("expected an array of documents")
+    
+    async def batches():
+        per_document = len(body) // max(len(payload), 1)
+        for start in range(0, len(payload), BATCH_SIZE):
+            documents = payload[start:start + BATCH_SIZE]
+            yield documents, per_document * len(documents)
+    
+    return session or DEFAULT_SESSION, batches()
+
+def _serialize_result(document: Any, fmt: str) -> str:
+    if isinstance(document, _BadLine):
+        return json.dumps({"error": f"line {document.number} is not valid JSON"})
+    if fmt == "text":
+        return document
+    return json.dumps(document, ensure_ascii=False, separators=(",", ":"))
+
+async def _process_batch(op: str, documents: List[Any], context: MaskingContext, size: int) -> List[Any]:
+    """Mask or unmask one batch with one mapping-store round trip"""
+    if op == "mask":
+        batch = await masking_executor.run(size, MaskBatch, documents, default_engine)
+        await mapping_store.prefetch(context.session, batch.candidates())
+        return await masking_executor.run(size, batch.apply, context.tokenize)
+    
+    batch = await masking_executor.run(size, UnmaskBatch, documents)
+    originals = await mapping_store.resolve_tokens(context.session, batch.tokens)
+    return await masking_executor.run(size, batch.apply, originals)
+
+async def _batch_endpoint(request: Request, op: str):
+    """Mask or unmask a batch request under admission control and BATCH_MAX_BYTES
+    
+    Each BATCH_SIZE batch is processed as soon as its lines have arrived, but
+    the response only starts once the body is read: StreamingResponse listens
+    for disconnects on the channel the body arrives on.
+    """
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > BATCH_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Batch body over {BATCH_MAX_BYTES} bytes")
+    try:
+        release_slot = await admission.acquire(request_client(request))
+    except AdmissionRejected as e:
+        return rejected_response(e)
+    
+    fmt = _batch_format(request)
+    pieces = []
+    count = 0
+    try:
+        session, batches = await _batch_input(request, fmt)
+        context = MaskingContext(mapping_store, session)
+        async for batch, size in batches:
+            parseable = [document for document in batch if not isinstance(document, _BadLine)]
+            processed = iter(await _process_batch(op, parseable, context, size))
+            batch = [document if isinstance(document, _BadLine) else next(processed) for document in batch]
+            BATCH_DOCUMENTS.labels(op).inc(len(batch))
+            
+            serialized = [_serialize_result(document, fmt) for document in batch]
+            if fmt == "json":
+                pieces.append(("," if count else "") + ",".join(serialized))
+            else:
+                pieces.append("\n".join(serialized) + "\n")
+            count += len(batch)
+    except _BodyTooLarge:
+        raise HTTPException(status_code=413, detail=f"Batch body over {BATCH_MAX_BYTES} bytes")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch input: {e}")
+    finally:
+        release_slot()
+    
+    async def results():
+        if fmt == "json":
+            yield '{"session":' + json.dumps(session) + ',"count":' + str(count) + ',"results":['
+        for piece in pieces:
+            yield piece
+        if fmt == "json":
+            yield "]}"
+    
+    media_type = {"json": "application/json", "ndjson": "application/x-ndjson", "text": "text/plain"}[fmt]
+    return StreamingResponse(results(), media_type=media_type, headers={SESSION_HEADER: session})
+
+@app.post("/v1/mask/batch")
+async def mask_batch(request: Request):
+    """Mask an array / NDJSON stream / text lines of documents, results streamed back in order"""
+    return await _batch_endpoint(request, "mask")
+
+@app.post("/v1/unmask/batch")
+async def unmask_batch(request: Request):
+    """Restore the originals of tokens issued in the same session"""
+    return await _batch_endpoint(request, "unmask")
+
+def local_health(app: FastAPI) -> Dict[str, Any]:
+    """This process's stats (the whole /health body when running standalone)"""
     return {
         "status": "healthy",
         "service": "kong-masking-proxy",
         "timestamp": datetime.now().isoformat(),
         "masking_stats": {
-            "total_masked": len(masking_map),
-            "by_type": dict(mask_counter)
-        }
+            "total_masked": len(mapping_store),
+            "by_type": dict(mask_counter),
+            "mapping_store": mapping_store.snapshot(),
+            "cache": masking_cache.snapshot()
+        },
+        "patterns": dict(source=PATTERN_SOURCE, **default_engine.snapshot()),
+        "admission": admission.snapshot(),
+        "response_cache": response_cache.snapshot(),
+        "executor": masking_executor.snapshot(),
+        "event_loop": loop_monitor.snapshot(),
+        "upstream": pool_monitor.snapshot(app.state.upstream)
     }
 
+async def publish_worker_stats(app: FastAPI, worker):
+    """Keep this worker's slot in the shared stats current"""
+    warned = False
+    while True:
+        if not worker.publish(local_health(app), metrics.export()) and not warned:
+            warned = True
+            logger.warning("⚠️  Worker stats do not fit their shared memory slot; not shared")
+        await asyncio.sleep(PUBLISH_INTERVAL)
+
+@app.get("/health")
+async def health_check(request: Request):
+    """Health check endpoint (instance totals when running several workers)"""
+    health = local_health(request.app)
+    worker = current_worker()
+    if worker is None:
+        return health
+    
+    worker.publish(health, metrics.export())
+    peers = worker.peers()
+    health = merge_stats([health, *(peer["health"] for peer in peers)])
+    health["workers"] = 1 + len(peers)
+    return health
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    worker = current_worker()
+    peers = [peer["metrics"] for peer in worker.peers()] if worker else ()
+    return PlainTextResponse(metrics.render(peers), media_type=CONTENT_TYPE)
+
+async def proxy_passthrough(request: Request, endpoint: str):
+    """Relay a request that carries no user content to Kong as is
+
+    Nothing is parsed or copied: the request body (if any) is streamed to the
+    pooled upstream connection and the response is streamed back raw, still
+    encoded, with its headers.
+    """
+    started = time.perf_counter()
+    ROUTED_REQUESTS.labels(endpoint, "passthrough").inc()
+    
+    kong_url = f"{KONG_URL}{KONG_API_PREFIX}{request.url.path}"
+    if request.url.query:
+        kong_url += f"?{request.url.query}"
+    logger.debug("🚀 Passing through to Kong: %s %s", request.method, kong_url)
+    
+    headers = forwardable_headers(request.headers)
+    headers['host'] = 'api.anthropic.com'
+    has_body = 'content-length' in request.headers or 'transfer-encoding' in request.headers
+    
+    client = request.app.state.upstream
+    upstream_request = client.build_request(
+        request.method,
+        kong_url,
+        content=request.stream() if has_body else None,
+        headers=headers,
+        extensions=pool_monitor.extensions()
+    )
+    pool_monitor.request_started()
+    try:
+        response = await client.send(upstream_request, stream=True)
+    except Exception as e:
+        pool_monitor.request_finished()
+        logger.error("Error passing through %s: %s", endpoint, e, extra={"event": "error"})
+        raise HTTPException(status_code=500, detail=str(e))
+    except BaseException:
+        pool_monitor.request_finished()
+        raise
+    
+    closed = False
+    
+    async def close_upstream():
+        nonlocal closed
+        if not closed:
+            closed = True
+            await response.aclose()
+            pool_monitor.request_finished()
+            PASSTHROUGH_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+    
+    async def relay():
+        try:
+            async for chunk in response.aiter_raw():
+                yield chunk
+        finally:
+            await close_upstream()
+    
+    return StreamingResponse(
+        relay(),
+        status_code=response.status_code,
+        headers=relayed_headers(response.headers),
+        background=BackgroundTask(close_upstream)
+    )
+
+# Anthropic endpoints besides /v1/messages that Claude Code calls. "masked"
+# ones carry conversation content and go through the masking pipeline;
+# "passthrough" ones carry none and are relayed unparsed. Anything not listed
+# still gets a 404, so no content reaches Kong unmasked by accident.
+API_ROUTES = {
+    ("POST", "/v1/messages/count_tokens"): "masked",
+    ("GET", "/v1/models"): "passthrough",
+    ("GET", "/v1/models/{model_id}"): "passthrough",
+}
+
+def _route_handler(endpoint: str, path: str):
+    if path == "masked":
+        async def handler(request: Request):
+            return await proxy_masked(request, endpoint, f"{KONG_API_PREFIX}{request.url.path}")
+    else:
+        async def handler(request: Request):
+            return await proxy_passthrough(request, endpoint)
+    return handler
+
+for (method, endpoint), path in API_ROUTES.items():
+    app.add_api_route(endpoint, _route_handler(endpoint, path), methods=[method], include_in_schema=False)
+
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "HEAD", "PATCH"])
 async def catch_all(request: Request, path: str):
     """Catch all other requests for debugging"""
-    logger.warning(f"⚠️  Unhandled request: {request.method} /{path}")
-    logger.warning(f"   Headers: {dict(request.headers)}")
+    ROUTED_REQUESTS.labels("other", "not_found").inc()
+    logger.warning("⚠️  Unhandled request: %s /%s", request.method, path)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("   Headers: %s", redact_headers(request.headers))
     
-    # For now, return 404
     raise HTTPException(
         status_code=404, 
-        detail=f"Path /{path} not found. This proxy only handles /v1/messages"
+        detail=f"Path /{path} not found. This proxy handles /v1/messages and "
+               + ", ".join(sorted({endpoint for _, endpoint in API_ROUTES}))
     )
 
 if __name__ == "__main__":
@@ -239,5 +989,8 @@ if __name__ == "__main__":
         app,
         host="0.0.0.0",
         port=8082,
-        log_level="info"
+        log_level="info",
+        # Keep uvicorn on the queued handlers set up above
+        log_config=None,
+        access_log=os.environ.get("ACCESS_LOG", "true").lower() == "true"
     )
\ No newline at end of file
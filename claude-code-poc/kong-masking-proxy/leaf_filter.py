@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+String leaf classification for the tree-mode request walk
+Tells mask_request_body which strings of an Anthropic request are worth a
+scan. The rest are skipped without running any regex:
+
+- schema: fields the API defines as enums, ids, model or tool names
+  (model, role, type, id, tool_use_id, ...). They are only skipped where
+  the schema puts them. Tool inputs and other free-form JSON are scanned in
+  full, whatever their keys are called.
+- binary: the data of image and document blocks with a base64 source,
+  often megabytes that no pattern can match.
+- prefilter: strings in which the engine finds none of its literals or
+  trigger characters (MaskingEngine.active_patterns).
+- cached: strings of content blocks the masking cache had already masked
+  (masking_cache.py).
+
+Schema nodes: a dict maps field names to the nodes of their values; lists
+take the node of the field that holds them; None means free-form (scan every
+string below); SKIP and BINARY mark values that are not scanned.
+"""
+
+from typing import Any, Dict
+
+# Why a leaf was skipped (also the LeafStats field it is counted in)
+SKIP = "schema"
+BINARY = "binary"
+PREFILTER = "prefilter"
+CACHED = "cached"
+
+# Content block types that carry base64 data in source.data
+BINARY_BLOCK_TYPES = ("image", "document")
+
+# source of a base64 image/document block
+BINARY_SOURCE = {
+    'type': SKIP,
+    'media_type': SKIP,
+    'data': BINARY,
+}
+
+# Content blocks (text, image, document, tool_use, tool_result, thinking, ...)
+CONTENT_BLOCK: Dict[str, Any] = {
+    'type': SKIP,
+    'id': SKIP,
+    'tool_use_id': SKIP,
+    'name': SKIP,
+    'signature': SKIP,
+    # redacted_thinking: encrypted, opaque
+    'data': SKIP,
+    'cache_control': SKIP,
+    'source': {
+        'type': SKIP,
+        'media_type': SKIP,
+    },
+    # tool_use input and everything else not listed: free-form
+    'input': None,
+}
+# tool_result content is a string or content blocks again
+CONTENT_BLOCK['content'] = CONTENT_BLOCK
+
+# Top level of a /v1/messages (or count_tokens) request
+REQUEST_SCHEMA: Dict[str, Any] = {
+    'model': SKIP,
+    'service_tier': SKIP,
+    'messages': {
+        'role': SKIP,
+        'content': CONTENT_BLOCK,
+    },
+    'system': CONTENT_BLOCK,
+    'tools': {
+        'type': SKIP,
+        'name': SKIP,
+        'cache_control': SKIP,
+    },
+    'tool_choice': {
+        'type': SKIP,
+        'name': SKIP,
+    },
+    'thinking': SKIP,
+}
+
+
+def is_binary_block(block: Dict[str, Any]) -> bool:
+    """An image or document block whose data is inline base64"""
+    source = block.get('source')
+    return (block.get('type') in BINARY_BLOCK_TYPES and isinstance(source, dict)
+            and source.get('type') == 'base64')
+
+
+def field_node(node: Any, field: str, binary: bool = False) -> Any:
+    """Schema node of an object's field; binary: the object is_binary_block"""
+    if binary and field == 'source':
+        return BINARY_SOURCE
+    return node.get(field) if node is not None else None
+
+
+class LeafStats:
+    """Characters of string leaves by what happened to them, for one request"""
+
+    __slots__ = ('scanned', 'schema', 'binary', 'prefilter', 'cached')
+
+    def __init__(self):
+        self.scanned = 0
+        self.schema = 0
+        self.binary = 0
+        self.prefilter = 0
+        self.cached = 0
+
+    @property
+    def skipped(self) -> int:
+        return self.schema + self.binary + self.prefilter + self.cached
+
+    @property
+    def total(self) -> int:
+        return self.scanned + self.skipped
+
+    def skip(self, reason: str, chars: int):
+        """Count a leaf skipped for reason (SKIP, BINARY, PREFILTER or CACHED)"""
+        setattr(self, reason, getattr(self, reason) + chars)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            'scanned_chars': self.scanned,
+            'skipped_chars': self.skipped,
+            'schema_chars': self.schema,
+            'binary_chars': self.binary,
+            'prefilter_chars': self.prefilter,
+            'cached_chars': self.cached,
+        }
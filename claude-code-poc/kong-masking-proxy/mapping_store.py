@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Session-scoped mask mapping store
+Python counterpart of the Kong plugin's memory store (create_mapping_store /
+_memory_get_or_create_masked_id) with LRU + TTL eviction and a memory ceiling
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from masking_engine import TOKEN_FORMATS
+
+DEFAULT_SESSION = "default"
+
+# Marks the tokens a shared store issues locally while its backend is down
+# (PREFIX_L001): counter tokens are all digits after the prefix, so the two
+# never collide, not even when text glues more digits onto a token
+LOCAL_TOKEN_MARK = "L"
+
+# Rough per-entry cost of the OrderedDict slot, the reverse dict slot,
+# the two key tuples and the entry object itself
+ENTRY_OVERHEAD_BYTES = 360
+
+
+class _Entry:
+    __slots__ = ('masked', 'expires_at', 'size')
+
+    def __init__(self, masked: str, expires_at: float, size: int):
+        self.masked = masked
+        self.expires_at = expires_at
+        self.size = size
+
+
+class MappingStore:
+    """Bounded original <-> masked id mapping, one namespace per session
+
+    The same value always gets the same token within a session. Entries expire
+    `ttl` seconds after their last use, and the least recently used entries are
+    evicted once `max_entries` or `max_bytes` is exceeded.
+    """
+
+    type = "memory"
+    # True when tokens come from a backend shared with other workers/replicas
+    shared = False
+    # True when prefetch() resolves candidates in batches, so tree mode
+    # collects them before its synchronous walk
+    batch_prefetch = False
+    # Tokens issued by get_or_create
+    local_token_format = "{prefix}_{number:03d}"
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # Large bodies are masked on worker threads (masking_executor.py)
+        self._lock = threading.RLock()
+
+        # (session, original) -> _Entry, least recently used first
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        # (session, masked) -> original
+        self._reverse: Dict[Tuple[str, str], str] = {}
+        # session -> {counter key: last issued number}
+        self._counters: Dict[str, Dict[str, int]] = {}
+        # session -> live entry count, so idle sessions drop their counters
+        self._session_sizes: Dict[str, int] = {}
+
+        # counter key -> tokens issued since start (bounded by pattern count)
+        self.issued: Dict[str, int] = {key: 0 for key, _ in TOKEN_FORMATS.values()}
+
+        self.bytes_used = 0
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_or_create(self, session: str, pattern_name: str, original: str) -> str:
+        """Return the masked token for original, issuing a new one on first sight"""
+        with self._lock:
+            now = time.monotonic()
+            key = (session, original)
+            entry = self._entries.get(key)
+
+            if entry is not None and entry.expires_at > now:
+                self.stats['hits'] += 1
+                entry.expires_at = now + self.ttl
+                self._entries.move_to_end(key)
+                return entry.masked
+
+            if entry is not None:
+                self._remove(key, entry)
+                self.stats['expirations'] += 1
+
+            self.stats['misses'] += 1
+            session = sys.intern(session)
+            counter_key, prefix = TOKEN_FORMATS[pattern_name]
+            counters = self._counters.setdefault(session, {})
+            number = counters.get(counter_key, 0) + 1
+            masked = self.local_token_format.format(prefix=prefix, number=number)
+            # Tokens inserted by restore() may already use this number
+            while (session, masked) in self._reverse:
+                number += 1
+                masked = self.local_token_format.format(prefix=prefix, number=number)
+            counters[counter_key] = number
+            self.issued[counter_key] += 1
+
+            self._insert(session, original, masked, now)
+            return masked
+
+    async def prefetch(self, session: str, candidates: Iterable[Tuple[str, str]]):
+        """Make tokens for (pattern name, original) candidates available locally
+
+        Nothing to do for the memory store; shared backends resolve every
+        candidate of a request here in one batch before masking starts.
+        """
+
+    def peek(self, session: str, original: str) -> Optional[str]:
+        """Return the live token for original without issuing one (refreshes LRU/TTL)"""
+        with self._lock:
+            key = (session, original)
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= time.monotonic():
+                return None
+            entry.expires_at = time.monotonic() + self.ttl
+            self._entries.move_to_end(key)
+            return entry.masked
+
+    def restore(self, session: str, mapping: Dict[str, str]):
+        """Load saved masked -> original pairs (e.g. an earlier scrub's mapping),
+        so the same values keep their tokens and numbering continues after them"""
+        with self._lock:
+            now = time.monotonic()
+            session = sys.intern(session)
+            prefixes = {prefix: key for key, prefix in TOKEN_FORMATS.values()}
+            counters = self._counters.setdefault(session, {})
+            for masked, original in mapping.items():
+                self._insert(session, original, masked, now)
+                prefix, _, number = masked.rpartition('_')
+                counter_key = prefixes.get(prefix)
+                if counter_key is not None and number.isdigit():
+                    counters[counter_key] = max(counters.get(counter_key, 0), int(number))
+
+    def lookup(self, session: str, masked: str) -> Optional[str]:
+        """Return the original value behind a masked token, if still stored"""
+        return self._reverse.get((session, masked))
+
+    async def resolve_tokens(self, session: str, tokens: Iterable[str]) -> Dict[str, str]:
+        """Originals for every known token in one batch (masked -> original)"""
+        found = {}
+        for token in tokens:
+            original = self._reverse.get((session, token))
+            if original is not None:
+                found[token] = original
+        return found
+
+    def snapshot(self) -> Dict[str, int]:
+        """Counters and sizes for /health"""
+        return {
+            'type': self.type,
+            'entries': len(self._entries),
+            'sessions': len(self._session_sizes),
+            'bytes_used': self.bytes_used,
+            'max_bytes': self.max_bytes,
+            **self.stats,
+        }
+
+    def _insert(self, session: str, original: str, masked: str, now: float):
+        with self._lock:
+            key = (session, original)
+            stale = self._entries.get(key)
+            if stale is not None:
+                self._remove(key, stale)
+            # A token stands for one value: drop the older value that had it
+            # (it gets a fresh token the next time it is seen)
+            taken = self._reverse.get((session, masked))
+            if taken is not None:
+                self._remove((session, taken), self._entries[(session, taken)])
+
+            size = len(original) + len(masked) + ENTRY_OVERHEAD_BYTES
+            self._entries[key] = _Entry(masked, now + self.ttl, size)
+            self._reverse[(session, masked)] = original
+            self._session_sizes[session] = self._session_sizes.get(session, 0) + 1
+            self.bytes_used += size
+
+            self._evict(now)
+
+    def _evict(self, now: float):
+        entries = self._entries
+        while entries:
+            key, entry = next(iter(entries.items()))
+            if entry.expires_at <= now:
+                self.stats['expirations'] += 1
+            elif len(entries) > self.max_entries or self.bytes_used > self.max_bytes:
+                self.stats['evictions'] += 1
+            else:
+                break
+            self._remove(key, entry)
+
+    def _remove(self, key: Tuple[str, str], entry: _Entry):
+        session = key[0]
+        del self._entries[key]
+        self._reverse.pop((session, entry.masked), None)
+        self.bytes_used -= entry.size
+
+        remaining = self._session_sizes[session] - 1
+        if remaining:
+            self._session_sizes[session] = remaining
+        else:
+            del self._session_sizes[session]
+            self._counters.pop(session, None)
+
+
+class MaskingContext:
+    """Per-request masking state: the session plus every token the request used
+
+    `issued` (masked -> original) is the request's unmask map, the Python side
+    of the plugin's prepare_unmask_data().
+    """
+
+    __slots__ = ('store', 'session', 'issued')
+
+    def __init__(self, store: MappingStore, session: str = DEFAULT_SESSION):
+        self.store = store
+        self.session = session
+        self.issued: Dict[str, str] = {}
+
+    def tokenize(self, pattern_name: str, original: str) -> str:
+        masked = self.store.get_or_create(self.session, pattern_name, original)
+        self.issued[masked] = original
+        return masked
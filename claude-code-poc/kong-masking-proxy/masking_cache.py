@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Incremental masking cache
+Claude Code resends the whole conversation every turn; this cache remembers
+the masked form of each message content block so only new turns are scanned
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from leaf_filter import CACHED, LeafStats
+from mapping_store import MaskingContext
+
+# Rough fixed cost of one cache entry besides its payload
+ENTRY_OVERHEAD_BYTES = 200
+
+
+class _CachedBlock:
+    __slots__ = ('masked', 'mappings', 'leaf_chars', 'size')
+
+    def __init__(self, masked: Any, mappings: Tuple[Tuple[str, str], ...], leaf_chars: int, size: int):
+        self.masked = masked
+        # (masked token, original value) pairs the block was masked with
+        self.mappings = mappings
+        # Characters of the block's string leaves, counted as CACHED on a hit
+        self.leaf_chars = leaf_chars
+        self.size = size
+
+
+class MaskingCache:
+    """Content-addressed, byte-bounded LRU of masked content blocks
+
+    Entries are keyed by (session, schema node, blake2b of the block): a hit
+    can only return tokens issued in the same session, and a block masked
+    under one leaf-filter node (which decides the fields that are skipped) is
+    not reused under another. A hit is used only if the mapping
+    store still holds every token the block was masked with. This keeps a hit
+    identical to masking the block again.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, min_block_bytes: int = 256):
+        self.max_bytes = max_bytes
+        self.min_block_bytes = min_block_bytes
+        # Held around entry bookkeeping only, never while a block is masked
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, int, bytes], _CachedBlock]" = OrderedDict()
+        self.bytes_used = 0
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'stale': 0,
+            'evictions': 0,
+            'bytes_saved': 0,
+        }
+
+    def mask(self, block: Any, context: MaskingContext, mask_fn: Callable[[Any, MaskingContext], Any],
+             schema: Any = None, leaves: Optional[LeafStats] = None) -> Any:
+        """Return mask_fn(block, context), from cache when the block was seen before
+
+        schema is the leaf-filter node mask_fn masks the block under; nodes
+        are module-level constants, so their id() is stable. mask_fn counts
+        the block's leaves in leaves; a hit counts them there as CACHED.
+        """
+        if isinstance(block, str):
+            data = block.encode('utf-8', 'surrogatepass')
+        else:
+            data = json.dumps(block, separators=(',', ':')).encode('ascii')
+
+        if len(data) < self.min_block_bytes:
+            return mask_fn(block, context)
+
+        key = (context.session, id(schema), hashlib.blake2b(data, digest_size=16).digest())
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                store = context.store
+                if all(store.peek(context.session, original) == masked
+                       for masked, original in entry.mappings):
+                    self.stats['hits'] += 1
+                    self.stats['bytes_saved'] += len(data)
+                    self._entries.move_to_end(key)
+                    context.issued.update(entry.mappings)
+                    if leaves is not None:
+                        leaves.skip(CACHED, entry.leaf_chars)
+                    return entry.masked
+
+                # A token was evicted or reissued since; mask the block again
+                self.stats['stale'] += 1
+                self._discard(key)
+
+            self.stats['misses'] += 1
+
+        block_context = MaskingContext(context.store, context.session)
+        counted = leaves.total if leaves is not None else 0
+        masked = mask_fn(block, block_context)
+        context.issued.update(block_context.issued)
+        leaf_chars = leaves.total - counted if leaves is not None else 0
+
+        mappings = tuple(block_context.issued.items())
+        size = 2 * len(data) + ENTRY_OVERHEAD_BYTES + sum(
+            len(token) + len(original) for token, original in mappings
+        )
+        if size <= self.max_bytes:
+            with self._lock:
+                previous = self._entries.get(key)
+                if previous is not None:
+                    # Another thread masked the same block meanwhile
+                    self._discard(key)
+                self._entries[key] = _CachedBlock(masked, mappings, leaf_chars, size)
+                self.bytes_used += size
+                self._evict()
+
+        return masked
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters for /health, next to masking_stats"""
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            'entries': len(self._entries),
+            'bytes_used': self.bytes_used,
+            'max_bytes': self.max_bytes,
+            'hit_ratio': round(self.stats['hits'] / lookups, 4) if lookups else 0.0,
+            **self.stats,
+        }
+
+    def _evict(self):
+        while self.bytes_used > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._discard(key)
+            self.stats['evictions'] += 1
+
+    def _discard(self, key: Tuple[str, int, bytes]):
+        entry = self._entries.pop(key)
+        self.bytes_used -= entry.size
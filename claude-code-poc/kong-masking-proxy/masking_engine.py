@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Single-pass AWS resource masking engine
+Compiles every pattern once into one alternation and splices the output left to right
+
+Each pattern can name literals that any match must contain. A scan first
+checks which literals occur in the text and runs an alternation of just the
+patterns that can match there, so adding patterns costs little as long as
+their literals are rare. Patterns without literals can name trigger
+characters instead (digits for account ids), looked for in one str.translate
+pass, so text with no literal and no trigger character never reaches a regex.
+A pattern whose literal is too common to filter much can add a guard: a
+short regex every match contains, searched only once the literal is present.
+
+MASK_PATTERN_SOURCE=kong swaps the seven patterns below for the Kong
+plugin's own pattern tables (pattern_registry.py).
+"""
+
+import functools
+import os
+import re
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# AWS Resource Patterns (same as Kong plugin)
+AWS_PATTERNS = {
+    'ec2_instance': r'\bi-[0-9a-f]{8,17}\b',
+    's3_bucket': r'\b[a-z0-9][a-z0-9\-\.]{2,62}(?:-bucket|bucket-)\b',
+    'private_ip': r'\b10\.\d{1,3}\.\d{1,3}\.\d{1,3}\b',
+    'rds_instance': r'\b[a-z][a-z0-9\-]{0,62}\.rds\.amazonaws\.com\b',
+    'account_id': r'\b\d{12}\b',
+    'access_key': r'\bAKIA[A-Z0-9]{16}\b',
+    'arn': r'\barn:aws:[a-z0-9\-]+:[a-z0-9\-]*:\d{12}:[a-z0-9\-\/\:\_]+\b'
+}
+
+# Alternation order: when two patterns match at the same position the more
+# specific one wins (an ARN is masked whole instead of just its account id)
+PATTERN_PRIORITY = [
+    'arn',
+    'access_key',
+    'rds_instance',
+    'ec2_instance',
+    's3_bucket',
+    'private_ip',
+    'account_id',
+]
+
+# Pattern name -> (mask_counter key, masked token prefix)
+TOKEN_FORMATS = {
+    'ec2_instance': ('ec2', 'EC2_INSTANCE'),
+    's3_bucket': ('s3', 'S3_BUCKET'),
+    'private_ip': ('ip', 'PRIVATE_IP'),
+    'rds_instance': ('rds', 'RDS_INSTANCE'),
+    'account_id': ('account', 'AWS_ACCOUNT'),
+    'access_key': ('key', 'ACCESS_KEY'),
+    'arn': ('arn', 'AWS_ARN'),
+}
+
+# Pattern name -> literals a match must contain one of (no entry: always tried)
+PATTERN_LITERALS = {
+    'ec2_instance': ('i-',),
+    's3_bucket': ('bucket',),
+    'private_ip': ('10.',),
+    'rds_instance': ('.rds.amazonaws.com',),
+    'access_key': ('AKIA',),
+    'arn': ('arn:aws:',),
+}
+
+# Pattern name -> characters every match contains one of, for patterns
+# without literals
+PATTERN_TRIGGERS = {
+    'account_id': '0123456789',
+}
+
+# (start, end, pattern name)
+Span = Tuple[int, int, str]
+
+# Alternations compiled per set of patterns whose literals were present
+SUBSET_CACHE_SIZE = 256
+# Literals are grouped by this many leading characters for the presence checks
+GATE_HEAD_CHARS = 4
+
+
+class MaskingEngine:
+    """Masks all AWS patterns with one compiled regex and one scan per string
+
+    patterns maps a name to a regex. A pattern may mark the part to mask with
+    a (?P<value>...) group; the rest of its match is context and stays as is.
+    validators can reject a match (the text is then left unmasked), and
+    splittable=False tells masking_executor.py that the patterns can match
+    across whitespace, so a string must not be scanned in windows. guards
+    maps a name to a regex every match of that pattern contains.
+    """
+
+    def __init__(self, patterns: Dict[str, str], priority: Optional[List[str]] = None,
+                 literals: Optional[Dict[str, Sequence[str]]] = None,
+                 validators: Optional[Dict[str, Callable[[str], bool]]] = None,
+                 splittable: bool = True, triggers: Optional[Dict[str, str]] = None,
+                 guards: Optional[Dict[str, str]] = None):
+        order = list(priority or patterns.keys())
+        order += [name for name in patterns if name not in order]
+        self.pattern_names = order
+        self.splittable = splittable
+        self._sources = [
+            f'(?P<{name}>' + patterns[name].replace('(?P<value>', f'(?P<{name}__value>') + ')'
+            for name in order
+        ]
+        self.regex = re.compile('|'.join(self._sources))
+        # ASCII semantics; only equivalent to self.regex on pure-ASCII input
+        self.bytes_regex = re.compile('|'.join(self._sources).encode('ascii'))
+
+        # Name -> its value group, for patterns that mask only part of their match
+        self._value_groups = {name: f'{name}__value' for name in order
+                              if f'{name}__value' in self.regex.groupindex}
+        self._validators = dict(validators or {})
+
+        # literal -> bit mask of the patterns it lets through (bit i = order[i])
+        literals = literals or {}
+        triggers = triggers or {}
+        self._all = (1 << len(order)) - 1
+        self._always = 0
+        # (str.translate table, bytes to delete, pattern bits) per trigger set
+        self._triggers: List[Tuple[Dict[int, None], bytes, int]] = []
+        gates: Dict[str, int] = {}
+        for index, name in enumerate(order):
+            if not literals.get(name):
+                if name in triggers:
+                    chars = triggers[name]
+                    self._triggers.append((str.maketrans('', '', chars), chars.encode('utf-8'), 1 << index))
+                else:
+                    self._always |= 1 << index
+            for literal in literals.get(name, ()):
+                gates[literal] = gates.get(literal, 0) | 1 << index
+        # Literals sharing their first characters ("arn:aws:lambda:",
+        # "arn:aws:ecs:", ...) are only looked for once that head is present
+        heads: Dict[str, List[Tuple[str, int]]] = {}
+        for literal, bits in gates.items():
+            heads.setdefault(literal[:GATE_HEAD_CHARS], []).append((literal, bits))
+        self._gates = [self._gate(members) for members in heads.values()]
+        self._bytes_gates = [self._gate([(literal.encode('utf-8'), bits) for literal, bits in members])
+                             for members in heads.values()]
+        # (str regex, bytes regex, pattern bit) checked after the literals
+        self._guards = [(re.compile(guard), re.compile(guard.encode('ascii')), 1 << order.index(name))
+                        for name, guard in (guards or {}).items() if name in patterns]
+        self._subset = functools.lru_cache(maxsize=SUBSET_CACHE_SIZE)(self._compile_subset)
+
+        # Best-effort counters: no lock on the scan path, so increments from
+        # concurrent masking threads can occasionally be lost
+        self.hits: Dict[str, int] = dict.fromkeys(order, 0)
+        self.stats = {
+            'scans': 0,
+            'scans_skipped': 0,       # no pattern could match, regex not run
+            'patterns_tried': 0,      # summed over scans; / scans = average
+            'rejected': 0,            # matches a validator turned down
+        }
+
+    def active_patterns(self, text, pos: int = 0, endpos: Optional[int] = None) -> int:
+        """Bit mask of the patterns whose literals occur in text[pos:endpos]
+
+        text may be str or bytes. A pattern outside the mask cannot match
+        anywhere in that range, so the result can be reused for sub-ranges.
+        """
+        as_bytes = isinstance(text, bytes)
+        gates = self._bytes_gates if as_bytes else self._gates
+        if endpos is None:
+            endpos = len(text)
+        whole = pos == 0 and endpos == len(text)
+        if whole:
+            contains = text.__contains__
+        else:
+            def contains(literal) -> bool:
+                return text.find(literal, pos, endpos) != -1
+
+        active = self._always
+        if self._triggers:
+            segment = text if whole else text[pos:endpos]
+            for table, delete, bits in self._triggers:
+                # Deleting the trigger characters shortens the text iff one occurs
+                stripped = segment.translate(None, delete) if as_bytes else segment.translate(table)
+                if len(stripped) != len(segment):
+                    active |= bits
+        for head, members, bits in gates:
+            if active & bits == bits or not contains(head):
+                continue
+            if members is None:
+                active |= bits
+                continue
+            for literal, member_bits in members:
+                if contains(literal):
+                    active |= member_bits
+        for str_guard, bytes_guard, bit in self._guards:
+            if active & bit and (bytes_guard if as_bytes else str_guard).search(text, pos, endpos) is None:
+                active &= ~bit
+        return active
+
+    @staticmethod
+    def _gate(members):
+        """(head to look for, literals behind it or None, all their pattern bits)"""
+        bits = 0
+        for _, member_bits in members:
+            bits |= member_bits
+        if len(members) == 1:
+            return members[0][0], None, bits
+        return members[0][0][:GATE_HEAD_CHARS], members, bits
+
+    def _compile_subset(self, active: int, as_bytes: bool) -> re.Pattern:
+        if active == self._all:
+            return self.bytes_regex if as_bytes else self.regex
+        source = '|'.join(source for index, source in enumerate(self._sources) if active >> index & 1)
+        return re.compile(source.encode('ascii') if as_bytes else source)
+
+    def _scan(self, text, pos: int, endpos: Optional[int], active: Optional[int],
+              as_bytes: bool) -> List[Span]:
+        if endpos is None:
+            endpos = len(text)
+        if active is None:
+            active = self.active_patterns(text, pos, endpos)
+        stats = self.stats
+        stats['scans'] += 1
+        if not active:
+            stats['scans_skipped'] += 1
+            return []
+
+        regex = self._subset(active, as_bytes)
+        if not self._value_groups and not self._validators:
+            spans = [(m.start(), m.end(), m.lastgroup) for m in regex.finditer(text, pos, endpos)]
+        else:
+            spans = []
+            for m in regex.finditer(text, pos, endpos):
+                name = m.lastgroup
+                value = self._value_groups.get(name)
+                start, end = m.span(value) if value else m.span()
+                validator = self._validators.get(name)
+                if validator is not None:
+                    original = text[start:end]
+                    if not validator(original.decode('ascii') if as_bytes else original):
+                        stats['rejected'] += 1
+                        continue
+                spans.append((start, end, name))
+
+        stats['patterns_tried'] += active.bit_count()
+        if spans:
+            hits = self.hits
+            for _, _, name in spans:
+                hits[name] += 1
+        return spans
+
+    def record_hits(self, spans: List[Span]):
+        """Count matches found by scans in other processes (parallel windows)"""
+        for _, _, name in spans:
+            self.hits[name] += 1
+
+    def scan(self, text: str, pos: int = 0, endpos: Optional[int] = None,
+             active: Optional[int] = None) -> List[Span]:
+        """Return every match in text as (start, end, pattern name), left to right
+
+        active (from active_patterns) skips the literal checks when the caller
+        already knows which patterns can match.
+        """
+        return self._scan(text, pos, endpos, active, False)
+
+    def scan_bytes(self, data: bytes, pos: int = 0, endpos: Optional[int] = None,
+                   active: Optional[int] = None) -> List[Span]:
+        """scan() over raw ASCII bytes, returning byte offsets"""
+        return self._scan(data, pos, endpos, active, True)
+
+    def mask(self, text: str, tokenize: Callable[[str, str], str],
+             active: Optional[int] = None) -> str:
+        """Replace every match with tokenize(pattern name, original value)
+
+        Returns the input object unchanged when nothing matched.
+        """
+        spans = self.scan(text, active=active)
+        if not spans:
+            return text
+        return self.splice(text, spans, [tokenize(name, text[start:end]) for start, end, name in spans])
+
+    def snapshot(self) -> Dict[str, object]:
+        """Scan counters and per-pattern hits (for /health and /metrics)"""
+        stats = dict(self.stats)
+        hits = {name: count for name, count in self.hits.items() if count}
+        scanned = stats['scans'] - stats['scans_skipped']
+        stats['patterns'] = len(self.pattern_names)
+        stats['avg_patterns_tried'] = round(stats['patterns_tried'] / scanned, 2) if scanned else 0
+        stats['subset_regexes'] = self._subset.cache_info().currsize
+        stats['hits'] = hits
+        return stats
+
+    @staticmethod
+    def splice(text: str, spans: List[Span], tokens: List[str]) -> str:
+        """Rebuild text with spans[i] replaced by tokens[i] in one left-to-right pass"""
+        if not spans:
+            return text
+
+        pieces = []
+        pos = 0
+        for (start, end, _), token in zip(spans, tokens):
+            pieces.append(text[pos:start])
+            pieces.append(token)
+            pos = end
+        pieces.append(text[pos:])
+        return ''.join(pieces)
+
+
+PATTERN_SOURCE = os.environ.get('MASK_PATTERN_SOURCE', 'builtin')
+
+if PATTERN_SOURCE == 'kong':
+    from pattern_registry import load_registry
+
+    registry = load_registry()
+    # Token prefixes of the Kong tables (AWS_EC2, AWS_S3_BUCKET, ...); replaced
+    # in place so the mapping stores and unmasking pick them up on import
+    TOKEN_FORMATS.clear()
+    TOKEN_FORMATS.update(registry.token_formats)
+    default_engine = MaskingEngine(registry.patterns, registry.priority, registry.literals,
+                                   registry.validators, splittable=False, triggers=PATTERN_TRIGGERS,
+                                   guards=registry.guards)
+else:
+    default_engine = MaskingEngine(AWS_PATTERNS, PATTERN_PRIORITY, PATTERN_LITERALS,
+                                   triggers=PATTERN_TRIGGERS)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Size-aware execution of masking work
+Small bodies are masked inline, large ones in a thread pool off the event
+loop, and very large strings are scanned in parallel windows on a process pool
+"""
+
+import asyncio
+import logging
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from masking_engine import Span, default_engine
+
+logger = logging.getLogger(__name__)
+
+# No pattern matches whitespace or these (ASCII, non-word) characters, so a
+# window that starts on one can be scanned on its own: no match crosses the
+# split and \b sees the same neighbours as in the full string
+_SAFE_SPLIT = re.compile(r'[\s,;"\'(){}\[\]<>=|]')
+
+
+def split_windows(text: str, window_chars: int) -> List[Tuple[int, int]]:
+    """Cut text into ~window_chars windows, each starting on a safe split character"""
+    bounds = []
+    start = 0
+    length = len(text)
+    while start < length:
+        split = _SAFE_SPLIT.search(text, start + window_chars) if start + window_chars < length else None
+        end = split.start() if split else length
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def _scan_window(window: str, offset: int) -> List[Span]:
+    """Process pool entry point: scan one window, spans in full-string offsets"""
+    return [(start + offset, end + offset, name) for start, end, name in default_engine.scan(window)]
+
+
+class MaskingExecutor:
+    """Decides where masking runs and records how long the event loop was blocked"""
+
+    def __init__(self, inline_max_bytes: int = 256 * 1024, thread_workers: int = 4,
+                 scan_processes: int = 0, chunk_min_chars: int = 1024 * 1024,
+                 window_chars: int = 256 * 1024):
+        self.inline_max_bytes = inline_max_bytes
+        self.chunk_min_chars = max(chunk_min_chars, inline_max_bytes)
+        self.window_chars = window_chars
+        self._threads = ThreadPoolExecutor(max_workers=thread_workers, thread_name_prefix="masking")
+        self._processes: Optional[ProcessPoolExecutor] = (
+            ProcessPoolExecutor(max_workers=scan_processes) if scan_processes > 0 else None
+        )
+        self.stats = {
+            'inline': 0,
+            'offloaded': 0,
+            'chunked_scans': 0,
+            'loop_blocked_seconds': 0.0,
+            'loop_blocked_max_seconds': 0.0,
+            'offloaded_seconds': 0.0,
+        }
+
+    async def run(self, size: int, fn: Callable[..., Any], *args) -> Any:
+        """Run fn(*args) inline when size is small, otherwise on the thread pool"""
+        started = time.perf_counter()
+        if size <= self.inline_max_bytes:
+            try:
+                return fn(*args)
+            finally:
+                blocked = time.perf_counter() - started
+                self.stats['inline'] += 1
+                self.stats['loop_blocked_seconds'] += blocked
+                if blocked > self.stats['loop_blocked_max_seconds']:
+                    self.stats['loop_blocked_max_seconds'] = blocked
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._threads, fn, *args)
+        finally:
+            self.stats['offloaded'] += 1
+            self.stats['offloaded_seconds'] += time.perf_counter() - started
+
+    def should_chunk(self, text: str) -> bool:
+        return (self._processes is not None and default_engine.splittable
+                and len(text) >= self.chunk_min_chars)
+
+    def parallel_scan(self, text: str) -> List[Span]:
+        """Scan a very large string across the process pool (blocking; call off-loop)
+
+        Result is identical to default_engine.scan(text).
+        """
+        bounds = split_windows(text, self.window_chars)
+        if len(bounds) == 1:
+            return default_engine.scan(text)
+
+        self.stats['chunked_scans'] += 1
+        futures = [self._processes.submit(_scan_window, text[start:end], start) for start, end in bounds]
+        spans: List[Span] = []
+        for future in futures:
+            spans.extend(future.result())
+        default_engine.record_hits(spans)
+        return spans
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {key: round(value, 6) if isinstance(value, float) else value
+                for key, value in self.stats.items()}
+
+    def shutdown(self):
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=True, cancel_futures=True)
+
+
+class LoopLagMonitor:
+    """Measures event loop stalls from every source (inline masking, GIL
+    contention with masking threads, logging, ...) by timing a periodic sleep"""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+        self.samples = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - expected)
+            self.samples += 1
+            self.lag_total += lag
+            if lag > self.lag_max:
+                self.lag_max = lag
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'samples': self.samples,
+            'lag_avg_ms': round(self.lag_total / self.samples * 1000, 3) if self.samples else 0.0,
+            'lag_max_ms': round(self.lag_max * 1000, 3),
+        }
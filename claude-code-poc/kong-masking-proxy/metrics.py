@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Minimal Prometheus instrumentation for the masking proxy
+Counters, gauges and fixed-bucket histograms rendered in the Prometheus text
+exposition format (0.0.4). No client library needed; updates are a dict
+lookup and an add, so they can sit on the request path.
+
+Not thread-safe: update metrics from the event loop only.
+
+With several worker processes (proxy-launcher.py), each worker export()s its
+values and /metrics renders the merge of all of them.
+"""
+
+import bisect
+import math
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, 0.5 ms .. 60 s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Bytes, 256 B .. 64 MB in powers of 4
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(10))
+
+# Joins label values into one key in export()ed data
+_LABEL_SEP = "\x1f"
+
+# Snapshot fields that describe configuration, not load: taken from one worker
+CONFIG_FIELDS = frozenset(("patterns", "keys"))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def labels(self, *values: str):
+        """Child metric for one label combination (cache it on hot paths)"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def export(self) -> Dict[str, Any]:
+        """Label key -> value (histograms: per-bucket counts followed by the sum)"""
+        return {_LABEL_SEP.join(values): child.value for values, child in self._children.items()}
+
+    def render(self, exported: Dict[str, Any]) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, value in exported.items():
+            values = tuple(key.split(_LABEL_SEP)) if self.labelnames else ()
+            lines.extend(self._render_child(values, value))
+        return lines
+
+    def _render_child(self, values, value) -> List[str]:
+        return [f"{self.name}{_label_text(self.labelnames, values)} {_format_value(value)}"]
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+
+
+class Gauge(_Metric):
+    """Gauge set directly, or read from `function` at scrape time"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._children[()].dec(amount)
+
+    def set(self, value: float):
+        self._children[()].set(value)
+
+    def export(self) -> Dict[str, Any]:
+        if self.function is not None:
+            self._children[()].value = self.function()
+        return super().export()
+
+
+class _HistogramChild:
+    __slots__ = ('upper_bounds', 'counts', 'sum')
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        # Per-bucket (not cumulative) counts, last one is +Inf
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.upper_bounds)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def export(self) -> Dict[str, Any]:
+        return {_LABEL_SEP.join(values): child.counts + [child.sum] for values, child in self._children.items()}
+
+    def _render_child(self, values, value) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.upper_bounds + (math.inf,), value):
+            cumulative += count
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(f"{self.name}_bucket{_label_text(self.labelnames, values, le)} {cumulative}")
+        labels = _label_text(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(value[-1])}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds the process's metrics and renders them for /metrics"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        # (name prefix, snapshot function) rendered as one gauge per numeric field
+        self._snapshots: List[Tuple[str, str, Callable[[], Dict[str, Any]]]] = []
+        # (name, documentation, label name, {label value: number} function, type)
+        self._labeled: List[Tuple[str, str, str, Callable[[], Dict[str, float]], str]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self._add(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self, prefix: str, documentation: str, function: Callable[[], Dict[str, Any]]):
+        """Export the numeric fields of an existing stats snapshot (the /health
+        dicts) as `<prefix>_<field>` gauges, read at scrape time"""
+        self._snapshots.append((prefix, documentation, function))
+
+    def labeled_snapshot(self, name: str, documentation: str, labelname: str,
+                         function: Callable[[], Dict[str, float]], metric_type: str = "counter"):
+        """Export a {label value: number} dict as one labeled series, read at scrape time"""
+        self._labeled.append((name, documentation, labelname, function, metric_type))
+
+    def export(self) -> Dict[str, Any]:
+        """Every current value as plain (JSON-able) data, see merge_exports()"""
+        return {
+            "series": {metric.name: metric.export() for metric in self._metrics},
+            "labeled": {name: dict(function()) for name, _, _, function, _ in self._labeled},
+            "snapshots": {prefix: function() for prefix, _, function in self._snapshots},
+        }
+
+    def render(self, peers: Sequence[Dict[str, Any]] = ()) -> str:
+        """Exposition text; with peers (other workers' export()s), instance totals"""
+        data = self.export()
+        if peers:
+            data = merge_exports([data, *peers])
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render(data["series"].get(metric.name, {})))
+        for name, documentation, labelname, function, metric_type in self._labeled:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for value_label, value in data["labeled"].get(name, {}).items():
+                lines.append(f"{name}{_label_text((labelname,), (value_label,))} {_format_value(value)}")
+        for prefix, documentation, function in self._snapshots:
+            for field, value in data["snapshots"].get(prefix, {}).items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{field}"
+                lines.append(f"# HELP {name} {documentation} ({field})")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+def _combine(field: str, values: List[Any]) -> Any:
+    """Instance-wide value of one numeric field from several workers"""
+    if "max" in field:
+        return max(values)
+    if "avg" in field or "ratio" in field:
+        return round(sum(values) / len(values), 6)
+    total = sum(values)
+    return round(total, 6) if isinstance(total, float) else total
+
+
+def merge_stats(snapshots: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine the stats dicts (/health sections) of several workers
+
+    Counts and sizes are summed and nested dicts merged field by field.
+    Fields named *max* take the largest value and *avg*/*ratio* the mean.
+    Strings, flags and CONFIG_FIELDS come from the first worker.
+    """
+    merged: Dict[str, Any] = {}
+    for field in dict.fromkeys(field for snapshot in snapshots for field in snapshot):
+        values = [snapshot[field] for snapshot in snapshots if field in snapshot]
+        first = values[0]
+        if isinstance(first, dict):
+            merged[field] = merge_stats([value for value in values if isinstance(value, dict)])
+        elif isinstance(first, bool) or not isinstance(first, (int, float)) or field in CONFIG_FIELDS:
+            merged[field] = first
+        else:
+            merged[field] = _combine(field, [value for value in values if isinstance(value, (int, float))])
+    return merged
+
+
+def merge_exports(exports: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """Sum MetricsRegistry.export()s of several workers (gauges named *max*: largest)"""
+    series: Dict[str, Dict[str, Any]] = {}
+    for export in exports:
+        for name, children in export["series"].items():
+            merged = series.setdefault(name, {})
+            for key, value in children.items():
+                previous = merged.get(key)
+                if previous is None:
+                    merged[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    merged[key] = [a + b for a, b in zip(previous, value)]
+                else:
+                    merged[key] = _combine(name, [previous, value])
+    labeled: Dict[str, Dict[str, Any]] = {}
+    for export in exports:
+        for name, values in export["labeled"].items():
+            merged = labeled.setdefault(name, {})
+            for label, value in values.items():
+                merged[label] = merged.get(label, 0) + value
+    snapshots = {
+        prefix: merge_stats([export["snapshots"][prefix] for export in exports if prefix in export["snapshots"]])
+        for prefix in dict.fromkeys(prefix for export in exports for prefix in export["snapshots"])
+    }
+    return {"series": series, "labeled": labeled, "snapshots": snapshots}
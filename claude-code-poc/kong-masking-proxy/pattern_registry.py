@@ -0,0 +1,695 @@
+#!/usr/bin/env python3
+"""
+Kong plugin pattern registry
+Loads the AWS patterns of kong/plugins/aws-masker (patterns.lua plus
+patterns_extension.lua, merged the way pattern_integrator.lua does) and
+translates the Lua patterns into regexes for masking_engine.py
+
+The translation is kept in kong-patterns.json next to this file, keyed by a
+hash of the Lua sources: later starts skip parsing and translating, and the
+proxy's container (which has no Lua sources) uses it as is. It is tracked in
+git and rewritten whenever the Lua sources no longer match it; commit it
+together with any change to the plugin's patterns.
+
+Lua patterns are translated literally. They have no word boundaries, `{8}`
+is the text "{8}" and `-` after a single-character class is a lazy `*`, so
+the proxy matches exactly what the plugin's string.gmatch matches. A pattern
+written with a regex repetition like `{8}` therefore only matches text that
+contains the braces; such dead patterns are logged, marked `dead` in
+kong-patterns.json and left out of the engine.
+
+The prefilter literal of a pattern is the longest text every match contains.
+One shorter than three characters is dropped, as ".", ":" or "db" occur in
+almost any text. Such patterns, and those whose literal is an ordinary word
+("logs", "cache"), get a guard instead: the longest run of items every match
+contains, widened by the characters that must sit next to it, e.g. a dotted
+quad for public_ip or "[a-z0-9-]logs" for s3_logs_bucket.
+
+Usage:
+    MASK_PATTERN_SOURCE=kong python kong-masking-proxy.py
+    python pattern_registry.py              # list the translated patterns
+    python pattern_registry.py --write      # refresh kong-patterns.json
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import string
+import sys
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PLUGIN_DIR = Path(os.environ.get(
+    "MASK_PATTERN_DIR",
+    Path(__file__).resolve().parents[2] / "kong" / "plugins" / "aws-masker"
+))
+CACHE_PATH = Path(os.environ.get(
+    "MASK_PATTERN_CACHE",
+    Path(__file__).resolve().parent / "kong-patterns.json"
+))
+PATTERN_FILES = ("patterns.lua", "patterns_extension.lua")
+
+# Bump when the translation changes so cached artifacts are rebuilt
+TRANSLATOR_VERSION = 2
+
+# Prefilter literals shorter than this are dropped (see the module docstring)
+MIN_LITERAL_CHARS = 3
+_WORD = re.compile(r'[a-z]+')
+# A regex repetition, which Lua reads as literal text
+_REPETITION = re.compile(r'\{\d+(?:,\d*)?\}')
+
+
+class LuaPatternError(ValueError):
+    """A Lua pattern or table the translator does not support"""
+
+
+# --- Lua table constructors ---------------------------------------------------
+
+class LuaFunction:
+    """Stands in for a function value (the body is not evaluated)"""
+
+    def __repr__(self):
+        return "<lua function>"
+
+
+_LUA_TOKEN = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<comment>--\[(?P<ceq>=*)\[.*?\](?P=ceq)\]|--[^\n]*)
+  | (?P<long>\[(?P<leq>=*)\[.*?\](?P=leq)\])
+  | (?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+  | (?P<number>0[xX][0-9a-fA-F]+|\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)
+  | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<op>\.\.\.|\.\.|==|~=|<=|>=|::|.)
+''', re.VERBOSE | re.DOTALL)
+
+_LUA_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'a': '\a', 'b': '\b', 'f': '\f',
+                'v': '\v', '\\': '\\', '"': '"', "'": "'", '\n': '\n'}
+
+# Keywords that open a block closed by `end` (for/while open theirs with `do`)
+_BLOCK_OPENERS = {'function', 'if', 'do'}
+
+
+def _lua_string(literal: str) -> str:
+    def unescape(match):
+        escape = match.group(1)
+        if escape[0].isdigit():
+            return chr(int(escape))
+        if escape[0] == 'x':
+            return chr(int(escape[1:], 16))
+        return _LUA_ESCAPES.get(escape, escape)
+
+    return re.sub(r'\\(\d{1,3}|x[0-9a-fA-F]{2}|.)', unescape, literal[1:-1], flags=re.DOTALL)
+
+
+def _lua_tokens(source: str) -> List[Tuple[str, str]]:
+    tokens = []
+    for match in _LUA_TOKEN.finditer(source):
+        kind = match.lastgroup
+        if kind in ('ceq', 'leq'):
+            kind = 'comment' if match.group('comment') else 'long'
+        if kind in ('space', 'comment'):
+            continue
+        tokens.append((kind, match.group(kind)))
+    return tokens
+
+
+class _TableParser:
+    def __init__(self, tokens: List[Tuple[str, str]], pos: int):
+        self.tokens = tokens
+        self.pos = pos
+
+    def peek(self, offset: int = 0) -> Tuple[str, str]:
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else ('eof', '')
+
+    def take(self, text: Optional[str] = None) -> Tuple[str, str]:
+        token = self.peek()
+        if text is not None and token[1] != text:
+            raise LuaPatternError(f"expected {text!r}, got {token[1]!r}")
+        self.pos += 1
+        return token
+
+    def value(self) -> Any:
+        kind, text = self.peek()
+        if text == '{':
+            return self.table()
+        if text == 'function' and kind == 'name':
+            return self.function()
+        self.take()
+        if kind == 'string':
+            return _lua_string(text)
+        if kind == 'long':
+            body = text[text.index('[', 1) + 1:text.rindex(']', 0, -1)]
+            return body[1:] if body.startswith('\n') else body
+        if kind == 'number':
+            return float(text) if any(c in text for c in '.eE') and not text.startswith(('0x', '0X')) \
+                else int(text, 0)
+        if kind == 'name' and text in ('true', 'false', 'nil'):
+            return {'true': True, 'false': False, 'nil': None}[text]
+        raise LuaPatternError(f"unsupported value {text!r} in table")
+
+    def function(self) -> LuaFunction:
+        depth = 0
+        while True:
+            kind, text = self.take()
+            if kind == 'eof':
+                raise LuaPatternError("unterminated function")
+            if kind != 'name':
+                continue
+            if text in _BLOCK_OPENERS or text == 'repeat':
+                depth += 1
+            elif text in ('end', 'until'):
+                depth -= 1
+                if depth == 0:
+                    return LuaFunction()
+
+    def table(self) -> Any:
+        self.take('{')
+        keyed: Dict[Any, Any] = {}
+        items: List[Any] = []
+        while self.peek()[1] != '}':
+            kind, text = self.peek()
+            if text == '[' and kind == 'op':
+                self.take()
+                key = self.value()
+                self.take(']')
+                self.take('=')
+                keyed[key] = self.value()
+            elif kind == 'name' and self.peek(1)[1] == '=':
+                self.take()
+                self.take('=')
+                keyed[text] = self.value()
+            else:
+                items.append(self.value())
+            if self.peek()[1] in (',', ';'):
+                self.take()
+            elif self.peek()[1] != '}':
+                raise LuaPatternError(f"expected ',' or '}}', got {self.peek()[1]!r}")
+        self.take('}')
+        if keyed and items:
+            keyed.update(enumerate(items, 1))
+        return keyed if keyed or not items else items
+
+
+def parse_lua_tables(source: str) -> Dict[str, Any]:
+    """Every top-level `name.field = { ... }` assignment of a Lua file, by
+    dotted name, in file order (dict tables keep their field order)
+
+    Statements inside function bodies are skipped.
+    """
+    tokens = _lua_tokens(source)
+    tables: Dict[str, Any] = {}
+    depth = 0
+    i = 0
+    while i < len(tokens):
+        kind, text = tokens[i]
+        if kind == 'name' and (text in _BLOCK_OPENERS or text == 'repeat'):
+            depth += 1
+        elif kind == 'name' and text in ('end', 'until'):
+            depth -= 1
+        elif depth == 0 and kind == 'name' and (i == 0 or tokens[i - 1][1] not in ('.', ':')):
+            j = i + 1
+            while j + 1 < len(tokens) and tokens[j][1] == '.' and tokens[j + 1][0] == 'name':
+                j += 2
+            if j + 1 < len(tokens) and tokens[j][1] == '=' and tokens[j + 1][1] == '{':
+                name = ''.join(text for _, text in tokens[i:j])
+                parser = _TableParser(tokens, j + 1)
+                tables[name] = parser.table()
+                i = parser.pos
+                continue
+        i += 1
+    return tables
+
+
+# --- Lua patterns -------------------------------------------------------------
+
+# Lua character classes (C locale) as regex set contents
+_LUA_CLASSES = {
+    'a': 'A-Za-z',
+    'c': r'\x00-\x1f\x7f',
+    'd': '0-9',
+    'g': r'!-~',
+    'l': 'a-z',
+    'p': ''.join('\\' + c for c in string.punctuation),
+    's': r' \t\n\r\f\v',
+    'u': 'A-Z',
+    'w': 'A-Za-z0-9',
+    'x': '0-9A-Fa-f',
+}
+
+_QUANTIFIERS = {'*': '*', '+': '+', '?': '?', '-': '*?'}
+
+
+def _set_escape(char: str) -> str:
+    return '\\' + char if char in '\\]^-[' else char
+
+
+def _lua_items(pattern: str) -> Iterator[Tuple[str, Optional[str], str]]:
+    """Yield (regex, literal character or None, quantifier) per pattern item;
+    captures come through as ('(', None, '') / (')', None, '')"""
+    i = 0
+    length = len(pattern)
+    while i < length:
+        char = pattern[i]
+        if char == '(':
+            if pattern[i + 1:i + 2] == ')':
+                raise LuaPatternError("position captures () are not supported")
+            yield '(', None, ''
+            i += 1
+            continue
+        if char == ')':
+            yield ')', None, ''
+            i += 1
+            continue
+        if char == '^' and i == 0:
+            yield '^', None, ''
+            i += 1
+            continue
+        if char == '$' and i == length - 1:
+            yield r'\Z', None, ''
+            i += 1
+            continue
+
+        literal = None
+        if char == '%':
+            if i + 1 >= length:
+                raise LuaPatternError("pattern ends with '%'")
+            escape = pattern[i + 1]
+            i += 2
+            if escape.lower() in _LUA_CLASSES:
+                regex = ('[^' if escape.isupper() else '[') + _LUA_CLASSES[escape.lower()] + ']'
+            elif escape.isalnum():
+                raise LuaPatternError(f"%{escape} is not supported")
+            else:
+                regex, literal = re.escape(escape), escape
+        elif char == '[':
+            regex, i = _lua_set(pattern, i)
+        elif char == '.':
+            regex = '(?s:.)'
+            i += 1
+        else:
+            regex, literal = re.escape(char), char
+            i += 1
+
+        quantifier = ''
+        if i < length and pattern[i] in _QUANTIFIERS:
+            quantifier = _QUANTIFIERS[pattern[i]]
+            i += 1
+        yield regex, literal, quantifier
+
+
+def _lua_set(pattern: str, i: int) -> Tuple[str, int]:
+    """Translate the [set] starting at pattern[i]; returns (regex, index after it)"""
+    i += 1
+    parts = ['[']
+    if pattern[i:i + 1] == '^':
+        parts.append('^')
+        i += 1
+    first = True
+    while True:
+        if i >= len(pattern):
+            raise LuaPatternError("unterminated [set]")
+        char = pattern[i]
+        if char == ']' and not first:
+            return ''.join(parts) + ']', i + 1
+        first = False
+        if char == '%':
+            escape = pattern[i + 1:i + 2]
+            if escape.lower() in _LUA_CLASSES and escape.islower():
+                parts.append(_LUA_CLASSES[escape])
+            elif escape.isalnum() or not escape:
+                raise LuaPatternError(f"%{escape} is not supported inside a set")
+            else:
+                parts.append(_set_escape(escape))
+            i += 2
+        elif pattern[i + 1:i + 2] == '-' and pattern[i + 2:i + 3] not in ('', ']'):
+            parts.append(f'{_set_escape(char)}-{_set_escape(pattern[i + 2])}')
+            i += 3
+        else:
+            parts.append(_set_escape(char))
+            i += 1
+
+
+def translate_lua_pattern(pattern: str, trim_prefix: str = '', trim_suffix: str = '') -> Tuple[str, str]:
+    """Translate a Lua pattern into (regex, longest literal every match contains)
+
+    The first capture becomes the (?P<value>...) group, as string.gmatch
+    yields only the first capture. Without captures, a literal head or tail
+    of the pattern equal to trim_prefix / trim_suffix (the text a replacement
+    like "AWS_API_GW_%03d.execute-api." keeps) is left out of the value.
+    """
+    items = list(_lua_items(pattern))
+    has_capture = any(regex == '(' for regex, _, _ in items)
+
+    if not has_capture and (trim_prefix or trim_suffix):
+        head = _literal_edge(items, trim_prefix, from_start=True)
+        tail = _literal_edge(items, trim_suffix, from_start=False)
+        if head or tail:
+            items = (items[:head] + [('(', None, '')] + items[head:len(items) - tail]
+                     + [(')', None, '')] + items[len(items) - tail:])
+            has_capture = True
+
+    parts = []
+    captures = 0
+    for regex, _, quantifier in items:
+        if regex == '(':
+            parts.append('(?P<value>' if captures == 0 else '(?:')
+            captures += 1
+        else:
+            parts.append(regex + quantifier)
+
+    # Longest run of characters every match must contain
+    best = run = ''
+    for regex, literal, quantifier in items:
+        if regex in ('(', ')'):
+            continue
+        if literal is not None and quantifier in ('', '+'):
+            run += literal
+            if quantifier == '':
+                best = max(best, run, key=len)
+                continue
+        best = max(best, run, key=len)
+        run = ''
+    best = max(best, run, key=len)
+    return ''.join(parts), best
+
+
+def _literal_edge(items, text: str, from_start: bool) -> int:
+    """How many items at one end of the pattern spell exactly text (0 if not)"""
+    if not text:
+        return 0
+    sequence = items if from_start else items[::-1]
+    chars = []
+    for count, (_, literal, quantifier) in enumerate(sequence, 1):
+        if literal is None or quantifier:
+            return 0
+        chars.append(literal)
+        spelled = ''.join(chars if from_start else chars[::-1])
+        if spelled == text:
+            return count
+        if len(spelled) >= len(text):
+            return 0
+    return 0
+
+
+def pattern_guard(pattern: str) -> str:
+    """A regex every match of the Lua pattern contains a match of ('' if none)
+
+    Built from the longest run of required items (no `*`, `?` or `-`) plus
+    the character that must sit right before and after it: the optional
+    items next to the run and the first required one beyond them, as one set.
+    The regex starts with the run's first literal text and checks what comes
+    before it with a lookbehind, so the re module can search for that text
+    instead of trying a character set at every position. Without any literal
+    text in the run the guard would cost as much as the pattern: ''.
+    """
+    items = [item for item in _lua_items(pattern) if item[0] not in ('(', ')')]
+    required = [quantifier in ('', '+') and regex not in ('^', r'\Z') for regex, _, quantifier in items]
+
+    best = (0, 0)
+    start = None
+    for index, flag in enumerate(required + [False]):
+        if flag and start is None:
+            start = index
+        elif not flag and start is not None:
+            if index - start > best[1] - best[0]:
+                best = (start, index)
+            start = None
+    start, end = best
+
+    # (regex, literal character or None), each exactly one character wide,
+    # except the `*` that keeps the rest of an inner `+` item
+    sequence: List[Tuple[str, Optional[str]]] = []
+    before = _neighbour(items, required, range(start - 1, -1, -1))
+    if before:
+        sequence.append((before, None))
+    for index in range(start, end):
+        regex, literal, quantifier = items[index]
+        sequence.append((regex, literal))
+        if quantifier == '+' and start < index < end - 1:
+            sequence.append((regex + '*', None))
+    after = _neighbour(items, required, range(end, len(items)))
+    if after:
+        sequence.append((after, None))
+
+    first = next((index for index, (_, literal) in enumerate(sequence) if literal is not None), None)
+    if first is None or len(sequence) < 2:
+        return ''
+    text_end = first
+    while text_end < len(sequence) and sequence[text_end][1] is not None:
+        text_end += 1
+    text = ''.join(regex for regex, _ in sequence[first:text_end])
+    behind = first
+    while behind > 0 and not sequence[behind - 1][0].endswith('*'):
+        behind -= 1
+    lookbehind = ''.join(regex for regex, _ in sequence[behind:first])
+    rest = ''.join(regex for regex, _ in sequence[text_end:])
+    return text + (f'(?<={lookbehind}{text})' if lookbehind else '') + rest
+
+
+def _neighbour(items, required, indexes) -> str:
+    """The character next to a run of required items, walking outwards over
+    optional items to the first required one ('' when the pattern may end)"""
+    choices = []
+    for index in indexes:
+        regex, literal, _ = items[index]
+        if regex in ('^', r'\Z'):
+            return ''
+        if regex not in choices:
+            choices.append(regex)
+        if required[index]:
+            break
+    else:
+        return ''
+    if len(choices) == 1:
+        return choices[0]
+    if all(choice.startswith('[') and not choice.startswith('[^') for choice in choices):
+        return '[' + ''.join(choice[1:-1] for choice in choices) + ']'
+    return '(?:' + '|'.join(choices) + ')'
+
+
+_TOKEN_FORMAT = re.compile(r'([A-Z][A-Z0-9_]*?)_?%0?\d*d')
+
+
+def token_format(replacement: str) -> Tuple[str, str, str]:
+    """(token prefix, text kept before, text kept after) of a replacement
+
+    "AWS_EC2_%03d" -> ("AWS_EC2", "", ""); "AWS_API_GW_%03d.execute-api."
+    -> ("AWS_API_GW", "", ".execute-api."). Text with $ placeholders is dropped.
+    """
+    match = _TOKEN_FORMAT.search(replacement)
+    if match is None:
+        raise LuaPatternError(f"replacement {replacement!r} has no %d counter")
+    before, after = replacement[:match.start()], replacement[match.end():]
+    return match.group(1), '' if '$' in before else before, '' if '$' in after else after
+
+
+# --- Validators ---------------------------------------------------------------
+
+def is_public_ip(ip: str) -> bool:
+    """Port of masker_ngx_re.is_non_public_ip (negated): only public IPv4
+    addresses are masked"""
+    octets = ip.split('.')
+    if len(octets) != 4 or not all(octet.isdigit() for octet in octets):
+        return False
+    a, b, c, d = (int(octet) for octet in octets)
+    if max(a, b, c, d) > 255:
+        return False
+    if a == 10 or (a == 172 and 16 <= b <= 31) or (a == 192 and b == 168):
+        return False
+    if (a == 169 and b == 254) or a == 127 or a >= 224 or a == 0:
+        return False
+    return True
+
+
+# Lua validator functions by pattern name; a pattern with a validator that has
+# no Python port is left out (logged) rather than masking what Kong would not
+VALIDATORS: Dict[str, Callable[[str], bool]] = {
+    'public_ip': is_public_ip,
+}
+
+
+# --- Registry -----------------------------------------------------------------
+
+class PatternRegistry:
+    """Translated Kong patterns in priority order, ready for MaskingEngine"""
+
+    def __init__(self, entries: List[Dict[str, Any]], source_hash: str):
+        # Each entry: name, regex, literal, guard, prefix, counter, priority,
+        # origin, lua (the original pattern), validator (bool) and dead (why
+        # the pattern cannot match real text, or None)
+        self.entries = entries
+        self.source_hash = source_hash
+        # The entries the engine gets
+        self.live = [entry for entry in entries if not entry['dead']]
+
+    @property
+    def priority(self) -> List[str]:
+        return [entry['name'] for entry in self.live]
+
+    @property
+    def patterns(self) -> Dict[str, str]:
+        return {entry['name']: entry['regex'] for entry in self.live}
+
+    @property
+    def literals(self) -> Dict[str, Tuple[str, ...]]:
+        return {entry['name']: (entry['literal'],) for entry in self.live if entry['literal']}
+
+    @property
+    def guards(self) -> Dict[str, str]:
+        return {entry['name']: entry['guard'] for entry in self.live if entry['guard']}
+
+    @property
+    def validators(self) -> Dict[str, Callable[[str], bool]]:
+        return {entry['name']: VALIDATORS[entry['name']] for entry in self.live if entry['validator']}
+
+    @property
+    def token_formats(self) -> Dict[str, Tuple[str, str]]:
+        return {entry['name']: (entry['counter'], entry['prefix']) for entry in self.live}
+
+    def to_json(self) -> Dict[str, Any]:
+        return {'version': TRANSLATOR_VERSION, 'source_hash': self.source_hash, 'entries': self.entries}
+
+
+def _source_hash(plugin_dir: Path) -> Optional[str]:
+    digest = hashlib.sha256(str(TRANSLATOR_VERSION).encode())
+    for name in PATTERN_FILES:
+        try:
+            digest.update((plugin_dir / name).read_bytes())
+        except OSError:
+            return None
+    return digest.hexdigest()
+
+
+def _entry(name: str, definition: Dict[str, Any], priority: int, origin: str) -> Optional[Dict[str, Any]]:
+    prefix, keep_before, keep_after = token_format(definition['replacement'])
+    regex, literal = translate_lua_pattern(definition['pattern'], keep_before, keep_after)
+    has_validator = isinstance(definition.get('validator'), LuaFunction)
+    if has_validator and name not in VALIDATORS:
+        logger.warning("⚠️  Pattern %s has a Lua validator without a Python port; skipped", name)
+        return None
+
+    dead = None
+    repetition = _REPETITION.search(definition['pattern'])
+    if repetition is not None:
+        dead = f"{repetition.group()} is literal text in a Lua pattern"
+        logger.warning("⚠️  Pattern %s only matches text containing %r (Lua has no {n} repetition); "
+                       "left out", name, repetition.group())
+
+    guard = ''
+    if len(literal) < MIN_LITERAL_CHARS or _WORD.fullmatch(literal):
+        guard = pattern_guard(definition['pattern'])
+        if len(literal) < MIN_LITERAL_CHARS:
+            if re.escape(literal) == guard:
+                # Nothing stronger to look for: the short literal is the guard
+                guard = ''
+            else:
+                literal = ''
+    return {
+        'name': name,
+        'regex': regex,
+        'literal': literal,
+        'guard': guard,
+        'prefix': prefix,
+        # Kong counts tokens per type (<prefix>cnt:<type> in Redis)
+        'counter': definition.get('type') or name,
+        'priority': priority,
+        'origin': origin,
+        'lua': definition['pattern'],
+        'validator': has_validator,
+        'dead': dead,
+    }
+
+
+def build_registry(plugin_dir: Path = PLUGIN_DIR) -> PatternRegistry:
+    """Parse and translate the plugin's pattern files"""
+    source_hash = _source_hash(plugin_dir)
+    if source_hash is None:
+        raise FileNotFoundError(f"Kong pattern files not found in {plugin_dir}")
+
+    originals = parse_lua_tables((plugin_dir / "patterns.lua").read_text(encoding='utf-8')).get('_M.patterns')
+    if not isinstance(originals, dict):
+        raise LuaPatternError("patterns.lua has no _M.patterns table")
+    extension_tables = parse_lua_tables((plugin_dir / "patterns_extension.lua").read_text(encoding='utf-8'))
+
+    entries = []
+    for name, definition in originals.items():
+        if not all(definition.get(field) for field in ('pattern', 'type', 'replacement')):
+            logger.warning("⚠️  Skipping incomplete pattern: %s", name)
+            continue
+        entry = _entry(name, definition, definition.get('priority', 999), 'patterns.lua')
+        if entry is not None:
+            entries.append(entry)
+
+    # pattern_integrator.lua: extension patterns, in category order, get
+    # priorities after the highest original one; name or pattern clashes are dropped
+    next_priority = max((entry['priority'] for entry in entries), default=0) + 1
+    taken_names = {entry['name'] for entry in entries}
+    taken_patterns = {entry['lua'] for entry in entries}
+    for table_name, category in extension_tables.items():
+        if not table_name.endswith('_patterns') or not isinstance(category, list):
+            continue
+        for definition in category:
+            name, priority = definition.get('name'), next_priority
+            next_priority += 1
+            if name in taken_names or definition.get('pattern') in taken_patterns:
+                logger.warning("⚠️  Extension pattern %s conflicts with an existing pattern; skipped", name)
+                continue
+            entry = _entry(name, definition, priority, 'patterns_extension.lua')
+            if entry is not None:
+                entries.append(entry)
+                taken_names.add(name)
+
+    # Stable sort: equal priorities keep file order
+    entries.sort(key=lambda entry: entry['priority'])
+    return PatternRegistry(entries, source_hash)
+
+
+def load_registry(plugin_dir: Path = PLUGIN_DIR, cache_path: Path = CACHE_PATH) -> PatternRegistry:
+    """The translated registry, from the cached artifact when it matches the Lua sources
+
+    Without the Lua sources any cached artifact is used as is.
+    """
+    source_hash = _source_hash(plugin_dir)
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached.get('version') == TRANSLATOR_VERSION and source_hash in (None, cached.get('source_hash')):
+            return PatternRegistry(cached['entries'], cached['source_hash'])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    registry = build_registry(plugin_dir)
+    try:
+        write_registry(registry, cache_path)
+    except OSError as e:
+        logger.warning("⚠️  Could not write pattern cache %s: %s", cache_path, e)
+    logger.info("🧩 Translated %d Kong patterns from %s", len(registry.entries), plugin_dir)
+    return registry
+
+
+def write_registry(registry: PatternRegistry, cache_path: Path = CACHE_PATH):
+    """Replace the cached artifact atomically"""
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+    with open(temporary, 'w') as f:
+        json.dump(registry.to_json(), f, indent=1)
+    os.replace(temporary, cache_path)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--write"]:
+        logging.basicConfig(level=logging.INFO)
+        registry = build_registry()
+        write_registry(registry)
+        print(f"{len(registry.entries)} patterns in {CACHE_PATH}", file=sys.stderr)
+        sys.exit(0)
+    registry = build_registry(Path(sys.argv[1]) if len(sys.argv) > 1 else PLUGIN_DIR)
+    for entry in registry.entries:
+        print(f"{entry['priority']:>4} {entry['name']:<28} {entry['prefix']:<28} "
+              f"{entry['literal']!r:<26} {entry['regex']}")
+    print(f"{len(registry.entries)} patterns", file=sys.stderr)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Production launcher for the Kong masking proxy
+Pre-forks N worker processes that each serve kong-masking-proxy.py with
+uvloop and httptools (when installed). Workers either share one listening
+socket or, with --reuse-port, bind their own with SO_REUSEPORT, so the
+kernel spreads connections over them. The launcher replaces workers that
+die (backing off, and giving up when they keep crashing), and shares per-worker stats through shared memory so /health and
+/metrics report totals for the whole instance (worker_stats.py).
+
+Workers import the proxy after the fork, so each one has its own event
+loop, upstream pool, thread pools and log writer. With the in-memory mapping
+store every worker has its own mappings; run MASK_STORE_BACKEND=redis or
+cipher when /v1/unmask/batch must see tokens masked by any worker.
+
+Usage:
+    python proxy-launcher.py --workers 8 --port 8082
+    kill -HUP <launcher pid>     # rolling restart: new workers (new code) up, then old ones drained
+                                 # (ignored until the previous generation has drained)
+    kill -TERM <launcher pid>    # graceful stop
+"""
+
+import argparse
+import atexit
+import importlib.util
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import uvicorn
+
+import worker_stats
+
+PROXY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kong-masking-proxy.py")
+
+# Seconds a new worker gets to come up during a rolling restart
+READY_TIMEOUT = 30.0
+
+# A crashed worker is replaced after RESPAWN_DELAY seconds, doubled for every
+# other crash in the last CRASH_WINDOW seconds (at most MAX_RESPAWN_DELAY).
+# More than CRASH_LIMIT crashes in the window stop the launcher.
+RESPAWN_DELAY = 0.5
+MAX_RESPAWN_DELAY = 30.0
+CRASH_WINDOW = 60.0
+CRASH_LIMIT = 10
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("proxy-launcher")
+
+
+def event_loop_impl() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def http_impl() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+def bind_socket(host: str, port: int, reuse_port: bool = False, backlog: int = 2048) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Launcher:
+    """Pre-fork manager: spawns, watches, rolls and stops the workers"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        # Room for a full second generation during a rolling restart
+        self.stats = worker_stats.SharedStats.create(slots=2 * args.workers)
+        self.sock: Optional[socket.socket] = None
+        # pid -> stats slot
+        self.workers: Dict[int, int] = {}
+        # Workers told to stop; they are not replaced when they exit
+        self.retiring: set = set()
+        self.signals: List[int] = []
+        self.stopping = False
+        # When crashed workers are due to be replaced (monotonic seconds)
+        self.respawns: List[float] = []
+        self.crashes: Deque[float] = deque()
+        self.exit_code = 0
+
+    def run(self) -> int:
+        args = self.args
+        if not args.reuse_port:
+            self.sock = bind_socket(args.host, args.port)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, lambda signum, frame: self.signals.append(signum))
+
+        logger.info(f"🚀 {args.workers} workers on http://{args.host}:{args.port} "
+                    f"(loop={event_loop_impl()}, http={http_impl()}, "
+                    f"{'SO_REUSEPORT' if args.reuse_port else 'shared socket'})")
+        if args.workers > 1 and os.environ.get("MASK_STORE_BACKEND", "memory") == "memory":
+            logger.warning("⚠️  In-memory mapping stores are per worker; "
+                           "use MASK_STORE_BACKEND=redis or cipher to share tokens")
+        for _ in range(args.workers):
+            self.spawn()
+
+        try:
+            while self.workers or not self.stopping:
+                while self.signals:
+                    self.handle(self.signals.pop(0))
+                self.reap()
+                self.respawn()
+                time.sleep(0.2)
+        finally:
+            self.stop()
+            self.stats.close(unlink=True)
+            logger.info("👋 Launcher stopped")
+        return self.exit_code
+
+    def handle(self, signum: int):
+        if signum == signal.SIGHUP and not self.stopping:
+            if self.retiring:
+                # The last generation still holds its slots until it has drained
+                logger.warning(f"⚠️  {len(self.retiring)} workers still draining; ignoring SIGHUP")
+            else:
+                self.rolling_restart()
+        elif signum in (signal.SIGTERM, signal.SIGINT) and not self.stopping:
+            logger.info("🛑 Stopping workers")
+            self.stopping = True
+            self.terminate(list(self.workers))
+
+    def spawn(self) -> Optional[int]:
+        """Fork a worker into a free stats slot; None when every slot is taken"""
+        used = set(self.workers.values())
+        slot = next((slot for slot in range(self.stats.slots) if slot not in used), None)
+        if slot is None:
+            return None
+        self.stats.clear(slot)
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                self.run_worker(slot)
+                code = 0
+            except BaseException:
+                logger.exception("Worker crashed")
+            finally:
+                # Flush the worker's log queue, then leave without unwinding
+                # into the launcher's own frames
+                atexit._run_exitfuncs()
+                os._exit(code)
+        self.workers[pid] = slot
+        logger.info(f"👷 Worker {pid} started (slot {slot})")
+        return pid
+
+    def run_worker(self, slot: int):
+        # uvicorn installs its own SIGTERM/SIGINT handlers; SIGHUP is the
+        # launcher's business (a `kill -HUP` sent to the process group must
+        # not take the workers down)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        worker_stats.bind(self.stats, slot)
+
+        spec = importlib.util.spec_from_file_location("kong_masking_proxy", PROXY_PATH)
+        proxy = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(proxy)
+
+        args = self.args
+        config = uvicorn.Config(
+            proxy.app,
+            loop=event_loop_impl(),
+            http=http_impl(),
+            log_config=None,
+            log_level=args.log_level,
+            access_log=os.environ.get("ACCESS_LOG", "true").lower() == "true",
+            timeout_graceful_shutdown=args.graceful_timeout,
+            timeout_keep_alive=args.keep_alive
+        )
+        sock = self.sock or bind_socket(args.host, args.port, reuse_port=True)
+        uvicorn.Server(config).run(sockets=[sock])
+
+    def reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot = self.workers.pop(pid, None)
+            if slot is None:
+                continue
+            self.stats.clear(slot)
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                logger.info(f"👋 Worker {pid} stopped")
+            elif not self.stopping:
+                self.crashed(pid, status)
+
+    def crashed(self, pid: int, status: int):
+        """Schedule a replacement, backing off while workers keep crashing"""
+        now = time.monotonic()
+        self.crashes.append(now)
+        while self.crashes[0] < now - CRASH_WINDOW:
+            self.crashes.popleft()
+        if len(self.crashes) > CRASH_LIMIT:
+            logger.error(f"❌ {len(self.crashes)} worker crashes in {CRASH_WINDOW:.0f}s; stopping")
+            self.exit_code = 1
+            self.handle(signal.SIGTERM)
+            return
+        delay = min(RESPAWN_DELAY * 2 ** (len(self.crashes) - 1), MAX_RESPAWN_DELAY)
+        logger.warning(f"⚠️  Worker {pid} exited unexpectedly (status {status}); "
+                       f"replacing it in {delay:.1f}s")
+        self.respawns.append(now + delay)
+
+    def respawn(self):
+        """Start the replacements that are due, as slots become free"""
+        now = time.monotonic()
+        while self.respawns and not self.stopping:
+            due = min(self.respawns)
+            if due > now or self.spawn() is None:
+                return
+            self.respawns.remove(due)
+
+    def rolling_restart(self):
+        """Replace workers one at a time: the new one must be up before the old one drains"""
+        logger.info("🔄 Rolling restart")
+        for old in [pid for pid in self.workers if pid not in self.retiring]:
+            if self.stopping:
+                return
+            self.reap()
+            if old not in self.workers:
+                # Died meanwhile; reap() has already scheduled its replacement
+                continue
+            new = self.spawn()
+            if new is None:
+                logger.error(f"❌ No free worker slot; keeping worker {old} and the rest")
+                return
+            if not self.wait_ready(new):
+                logger.error(f"❌ Worker {new} did not come up; keeping worker {old}")
+                self.terminate([new])
+                return
+            self.terminate([old])
+
+    def wait_ready(self, pid: int) -> bool:
+        """True once the worker has published its first stats (its app has started)"""
+        deadline = time.monotonic() + READY_TIMEOUT
+        while time.monotonic() < deadline:
+            slot = self.workers.get(pid)
+            if slot is None:
+                return False
+            snapshot = self.stats.read(slot)
+            if snapshot is not None and snapshot.get("pid") == pid:
+                return True
+            if self.stopping or signal.SIGTERM in self.signals or signal.SIGINT in self.signals:
+                return False
+            self.reap()
+            self.respawn()
+            time.sleep(0.1)
+        return False
+
+    def terminate(self, pids: List[int]):
+        for pid in pids:
+            self.retiring.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def stop(self):
+        """SIGTERM every worker, then SIGKILL whatever is left after the grace period"""
+        self.stopping = True
+        self.terminate(list(self.workers))
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            logger.warning(f"⚠️  Worker {pid} did not stop in time; killing it")
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.workers.pop(pid, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Kong masking proxy on several worker processes")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8082")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WORKERS", "0")) or os.cpu_count() or 1,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--reuse-port", action="store_true",
+                        default=os.environ.get("REUSE_PORT", "false").lower() == "true",
+                        help="one SO_REUSEPORT socket per worker instead of a shared one")
+    parser.add_argument("--graceful-timeout", type=float, default=30.0,
+                        help="seconds a stopping worker gets to finish its requests")
+    parser.add_argument("--keep-alive", type=int, default=5, help="idle keep-alive timeout, seconds")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    if sys.platform == "win32":
+        parser.error("the launcher needs fork(); run kong-masking-proxy.py directly on Windows")
+    sys.exit(Launcher(args).run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Redis-backed mapping store shared by every proxy worker and replica
+Uses the Kong plugin's key layout (masker_ngx_re.lua) so both sides see
+the same mappings:
+
+    <prefix>rev:<base64(original)>  -> masked id
+    <prefix>map:<masked id>         -> original
+    <prefix>cnt:<type>              -> counter
+    <prefix>stats:<YYYYMMDD>        -> hash of per-type totals
+"""
+
+import base64
+import logging
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from mapping_store import LOCAL_TOKEN_MARK, MappingStore
+from masking_engine import TOKEN_FORMATS
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # optional dependency, only needed for MASK_STORE_BACKEND=redis
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+# Same defaults as the plugin's redis_config
+DEFAULT_PREFIX = "aws_masker:"
+DEFAULT_REDIS_TTL = 604800  # 7 days
+STATS_TTL = 2592000  # 30 days
+
+
+class RedisMappingStore(MappingStore):
+    """MappingStore whose tokens live in Redis, with the memory store in front
+    of it as a local read-through cache
+
+    prefetch() resolves every candidate of a request with one MGET of the
+    reverse keys. Values Redis has not seen take two more pipelined round
+    trips: SET NX GET of the reverse keys, whose reply names the winner of a
+    race, then SET of the forward keys for the tokens that won. Counter
+    numbers are leased from Redis in blocks (INCRBY), so issuing a token does
+    not normally add a round trip. Redis 7+ is required for SET NX GET.
+
+    Values served from the local cache still keep their Redis keys alive:
+    prefetch() renews the TTL of both keys of every such value at most once
+    per `refresh_interval` (a tenth of the TTL by default), in the same
+    round trip as the MGET, or in one pipeline of its own.
+
+    When Redis is unreachable, tokens are issued locally, as the plugin does
+    with its memory fallback. They are numbered PREFIX_LNNN: the %03d tokens
+    of Redis (and of the plugin) are digits only, so a local token cannot
+    collide with a shared one, nor with a shared token followed by digits.
+    """
+
+    type = "redis"
+    shared = True
+    batch_prefetch = True
+    local_token_format = "{prefix}_" + LOCAL_TOKEN_MARK + "{number:03d}"
+
+    def __init__(self, client, prefix: str = DEFAULT_PREFIX, redis_ttl: int = DEFAULT_REDIS_TTL,
+                 lease_size: int = 100, refresh_interval: Optional[float] = None, **local_options):
+        super().__init__(**local_options)
+        self.redis = client
+        self.prefix = prefix
+        self.redis_ttl = redis_ttl
+        self.lease_size = lease_size
+        self.refresh_interval = redis_ttl / 10 if refresh_interval is None else refresh_interval
+        # counter key -> [next number, end of lease)
+        self._leases: Dict[str, List[int]] = {}
+        # Tokens whose Redis TTL was renewed in the current interval
+        self._refreshed: Set[str] = set()
+        self._refresh_due = time.monotonic() + self.refresh_interval
+        self.stats.update({
+            'redis_hits': 0,
+            'ttl_refreshes': 0,
+            'redis_misses': 0,
+            'redis_errors': 0,
+            'round_trips': 0,
+        })
+
+    @classmethod
+    def from_url(cls, url: str, **options) -> "RedisMappingStore":
+        if aioredis is None:
+            raise RuntimeError("MASK_STORE_BACKEND=redis requires the 'redis' package")
+        return cls(aioredis.from_url(url), **options)
+
+    async def close(self):
+        await self.redis.aclose()
+
+    async def prefetch(self, session: str, candidates: Iterable[Tuple[str, str]]):
+        now = time.monotonic()
+        if now >= self._refresh_due:
+            self._refreshed.clear()
+            self._refresh_due = now + self.refresh_interval
+
+        pending: Dict[str, str] = {}
+        # (original, token) served locally whose Redis TTL is due for renewal
+        stale: List[Tuple[str, str]] = []
+        for pattern_name, original in candidates:
+            if original in pending:
+                continue
+            masked = self.peek(session, original)
+            if masked is None:
+                pending[original] = pattern_name
+            elif masked not in self._refreshed:
+                self._refreshed.add(masked)
+                stale.append((original, masked))
+        if not pending and not stale:
+            return
+
+        try:
+            await self._resolve(session, pending, stale)
+        except Exception as e:
+            self._refreshed.difference_update(masked for _, masked in stale)
+            self.stats['redis_errors'] += 1
+            logger.warning("⚠️  Redis mapping lookup failed, issuing tokens locally: %s", e)
+
+    async def resolve_tokens(self, session: str, tokens: Iterable[str]) -> Dict[str, str]:
+        tokens = list(dict.fromkeys(tokens))
+        found = await super().resolve_tokens(session, tokens)
+        missing = [token for token in tokens if token not in found]
+        if not missing:
+            return found
+
+        try:
+            self.stats['round_trips'] += 1
+            originals = await self.redis.mget([self.prefix + "map:" + token for token in missing])
+        except Exception as e:
+            self.stats['redis_errors'] += 1
+            logger.warning("⚠️  Redis token lookup failed, unmasking from local mappings only: %s", e)
+            return found
+
+        now = time.monotonic()
+        for token, original in zip(missing, originals):
+            if original is not None:
+                found[token] = _text(original)
+                self._insert(session, found[token], token, now)
+        return found
+
+    async def _resolve(self, session: str, pending: Dict[str, str], stale: List[Tuple[str, str]]):
+        originals = list(pending)
+        rev_keys = [self._rev_key(original) for original in originals]
+
+        pipe = self.redis.pipeline(transaction=False)
+        if rev_keys:
+            pipe.mget(rev_keys)
+        for original, masked in stale:
+            # Local fallback tokens have no keys; EXPIRE on them is a no-op
+            pipe.expire(self.prefix + "map:" + masked, self.redis_ttl)
+            pipe.expire(self._rev_key(original), self.redis_ttl)
+        self.stats['round_trips'] += 1
+        replies = await pipe.execute()
+        self.stats['ttl_refreshes'] += len(stale)
+        if not rev_keys:
+            return
+        found = replies[0]
+
+        now = time.monotonic()
+        new = []
+        for original, rev_key, masked in zip(originals, rev_keys, found):
+            if masked is None:
+                new.append((original, rev_key))
+            else:
+                self.stats['redis_hits'] += 1
+                self._insert(session, original, _text(masked), now)
+        if not new:
+            return
+
+        self.stats['redis_misses'] += len(new)
+        proposed = [await self._next_token(pending[original]) for original, _ in new]
+
+        pipe = self.redis.pipeline(transaction=False)
+        for (original, rev_key), masked in zip(new, proposed):
+            pipe.set(rev_key, masked, ex=self.redis_ttl, nx=True, get=True)
+        self.stats['round_trips'] += 1
+        winners = await pipe.execute()
+
+        # Only the tokens that won their SET NX get a forward key; a lost
+        # race's proposal is never handed out
+        now = time.monotonic()
+        created = []
+        for (original, _), masked, winner in zip(new, proposed, winners):
+            if winner is None:
+                created.append((original, masked))
+            else:
+                masked = _text(winner)
+            self._insert(session, original, masked, now)
+        if not created:
+            return
+
+        pipe = self.redis.pipeline(transaction=False)
+        for original, masked in created:
+            pipe.set(self.prefix + "map:" + masked, original, ex=self.redis_ttl)
+        stats_key = self.prefix + "stats:" + time.strftime("%Y%m%d")
+        pipe.hincrby(stats_key, "total", len(created))
+        for counter_key, count in Counter(TOKEN_FORMATS[pending[original]][0] for original, _ in created).items():
+            pipe.hincrby(stats_key, counter_key, count)
+        pipe.expire(stats_key, STATS_TTL)
+        self.stats['round_trips'] += 1
+        await pipe.execute()
+
+    async def _next_token(self, pattern_name: str) -> str:
+        counter_key, prefix = TOKEN_FORMATS[pattern_name]
+        lease = self._leases.get(counter_key)
+        if lease is None or lease[0] >= lease[1]:
+            self.stats['round_trips'] += 1
+            end = await self.redis.incrby(self.prefix + "cnt:" + counter_key, self.lease_size)
+            lease = self._leases[counter_key] = [end - self.lease_size + 1, end + 1]
+
+        number = lease[0]
+        lease[0] += 1
+        self.issued[counter_key] += 1
+        return f"{prefix}_{number:03d}"
+
+    def _rev_key(self, original: str) -> str:
+        return self.prefix + "rev:" + base64.b64encode(original.encode('utf-8')).decode('ascii')
+
+
+def _text(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
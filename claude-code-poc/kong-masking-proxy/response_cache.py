@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Request coalescing and response cache for non-streaming masked requests
+Identical requests that arrive while one is already on its way to Kong wait
+for that call instead of making their own (single flight). Deterministic
+requests (temperature 0) may also opt in, per request, to a short-TTL cache.
+
+Requests are keyed on the masked body and the path it is sent to, plus the
+headers that change the answer or who pays for it. Entries hold the upstream
+response as it came back, i.e. still masked. Every request unmasks it with its own
+mappings, so a shared response never carries another session's values.
+
+Runs on the event loop only (no locks).
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Mapping, NamedTuple, Optional, Tuple
+
+# Request headers that are part of the key
+KEY_HEADERS = ("x-api-key", "authorization", "anthropic-version", "anthropic-beta")
+
+# Rough fixed cost of one cache entry besides its body
+ENTRY_OVERHEAD_BYTES = 500
+
+
+class UpstreamResult(NamedTuple):
+    status: int
+    headers: Mapping[str, str]
+    content: bytes
+
+
+class _CachedResponse:
+    __slots__ = ('result', 'expires', 'size')
+
+    def __init__(self, result: UpstreamResult, expires: float, size: int):
+        self.result = result
+        self.expires = expires
+        self.size = size
+
+
+class ResponseCache:
+    """Single-flight coalescing plus a byte-bounded, short-TTL LRU of responses"""
+
+    def __init__(self, coalesce: bool = True, max_bytes: int = 64 * 1024 * 1024,
+                 default_ttl: float = 30.0, max_ttl: float = 300.0):
+        self.coalesce = coalesce
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+
+        self._inflight: Dict[bytes, asyncio.Task] = {}
+        self._entries: "OrderedDict[bytes, _CachedResponse]" = OrderedDict()
+        self.bytes_used = 0
+        self.stats = {
+            'upstream_calls': 0,
+            'coalesced': 0,
+            'hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'expired': 0,
+            'evictions': 0,
+            # Request plus response bytes that did not cross the upstream link
+            'bytes_saved': 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.coalesce or self.max_bytes > 0
+
+    def key(self, body: bytes, headers: Mapping[str, str], path: str = "") -> bytes:
+        """Key of a request: its body, the upstream path it goes to and KEY_HEADERS"""
+        digest = hashlib.blake2b(body, digest_size=16)
+        digest.update(b'\0' + path.encode('utf-8', 'surrogateescape'))
+        for name in KEY_HEADERS:
+            digest.update(b'\0' + headers.get(name, '').encode('utf-8', 'surrogateescape'))
+        return digest.digest()
+
+    def cache_ttl(self, header: Optional[str], temperature: Optional[float]) -> float:
+        """TTL the client asked for, 0 when the response must not be cached
+
+        The header is "true" or "1" for the default TTL, or a number of seconds;
+        only temperature 0 requests qualify.
+        """
+        if not header or not self.max_bytes or temperature != 0:
+            return 0.0
+        header = header.strip().lower()
+        if header in ("true", "1"):
+            return self.default_ttl
+        try:
+            return max(0.0, min(float(header), self.max_ttl))
+        except ValueError:
+            return 0.0
+
+    async def fetch(self, key: bytes, request_bytes: int, ttl: float,
+                    fn: Callable[[], Awaitable[UpstreamResult]]) -> Tuple[UpstreamResult, str]:
+        """fn() or a result shared with an identical request
+
+        Returns the result and where it came from: "upstream", "coalesced"
+        or "hit".
+        """
+        if ttl:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    self.stats['bytes_saved'] += request_bytes + len(entry.result.content)
+                    return entry.result, "hit"
+                self.stats['expired'] += 1
+                self._discard(key)
+            self.stats['misses'] += 1
+
+        if not self.coalesce:
+            self.stats['upstream_calls'] += 1
+            result = await fn()
+            self._store(key, ttl, result)
+            return result, "upstream"
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats['coalesced'] += 1
+            # shield: a follower that goes away must not cancel the shared call
+            result = await asyncio.shield(task)
+            self.stats['bytes_saved'] += request_bytes + len(result.content)
+            return result, "coalesced"
+
+        self.stats['upstream_calls'] += 1
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._finished(key, ttl, done))
+        # Shielded for the same reason: followers may still be waiting on it
+        return await asyncio.shield(task), "upstream"
+
+    def _finished(self, key: bytes, ttl: float, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Also marks the exception as retrieved when nobody is left to await it
+        if not task.cancelled() and task.exception() is None:
+            self._store(key, ttl, task.result())
+
+    def _store(self, key: bytes, ttl: float, result: UpstreamResult):
+        if not ttl or result.status != 200:
+            return
+        size = len(result.content) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        self._discard(key)
+        self._entries[key] = _CachedResponse(result, time.monotonic() + ttl, size)
+        self.bytes_used += size
+        self.stats['stores'] += 1
+        while self.bytes_used > self.max_bytes and self._entries:
+            self._discard(next(iter(self._entries)))
+            self.stats['evictions'] += 1
+
+    def _discard(self, key: bytes):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes_used -= entry.size
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'in_flight': len(self._inflight),
+            'entries': len(self._entries),
+            'bytes_used': self.bytes_used,
+            'max_bytes': self.max_bytes,
+            **self.stats,
+        }
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Non-blocking structured logging for the masking proxy and test tools
+Records go through a bounded queue to a background thread that formats them
+(JSON lines or the old text layout) and writes them to stdout. The request
+path only builds a LogRecord and does a put_nowait. If stdout stalls, the
+queue fills up and records are dropped and counted; the event loop never
+waits.
+
+Messages are formatted lazily, on the writer thread, so call sites pass
+%-style arguments instead of f-strings. Structured fields go in `extra`.
+Message arguments and fields are screened before anything is formatted:
+scalars are written as is, but bytes, dicts and lists (request bodies,
+header maps) only appear as their type and size. Headers can be logged only
+through redact_headers, which blanks the credential ones.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, Mapping
+
+# Headers whose values must never reach a log line
+SECRET_HEADERS = frozenset(("x-api-key", "authorization", "proxy-authorization", "cookie", "set-cookie"))
+
+# Longest string field value written as is
+MAX_FIELD_CHARS = 256
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# LogRecord attributes that are not user fields
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "exc", "color_message"  # uvicorn adds color_message
+}
+
+
+class RedactedHeaders(dict):
+    """Header map with credential values blanked; the only dict that gets logged"""
+
+
+def safe_value(value: Any) -> Any:
+    """Value as it may appear in a log line: containers summarised, text capped"""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, RedactedHeaders):
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview, Mapping, list, tuple, set)):
+        return f"<{type(value).__name__} len={len(value)}>"
+    # Exceptions, URLs and the like: their text, capped
+    text = value if isinstance(value, str) else str(value)
+    return text if len(text) <= MAX_FIELD_CHARS else text[:MAX_FIELD_CHARS] + "…"
+
+
+def redact_headers(headers: Mapping[str, str]) -> RedactedHeaders:
+    """Header map safe to log: credential values replaced, the rest kept"""
+    return RedactedHeaders(
+        (name, "<redacted>" if name.lower() in SECRET_HEADERS else value)
+        for name, value in headers.items()
+    )
+
+
+class SafeFormatter(logging.Formatter):
+    """Formatter that screens message arguments with safe_value first"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        args = record.args
+        if isinstance(args, Mapping):
+            # logging unpacks a lone mapping argument into record.args
+            if "%(" in str(record.msg):
+                record.args = {key: safe_value(value) for key, value in args.items()}
+            else:
+                record.args = (safe_value(args),)
+        elif args:
+            record.args = tuple(safe_value(value) for value in args)
+        return super().format(record)
+
+
+class JsonFormatter(SafeFormatter):
+    """One JSON object per record: ts, level, logger, msg and the `extra` fields"""
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.message,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = safe_value(value)
+        if getattr(record, "exc", None):
+            entry["exc"] = record.exc
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+    def format(self, record: logging.LogRecord) -> str:
+        # Keep tracebacks inside the JSON object instead of appended lines
+        exc_info, record.exc_info = record.exc_info, None
+        exc_text, record.exc_text = record.exc_text, None
+        try:
+            if exc_info:
+                record.exc = self.formatException(exc_info)
+            return super().format(record)
+        finally:
+            record.exc_info, record.exc_text = exc_info, exc_text
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks and leaves formatting to the listener"""
+
+    def __init__(self, maxsize: int):
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock prepare() formats the message here, on the caller's thread.
+        # Records stay in this process, so the listener can do it instead.
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogSampler:
+    """Per-request sampling decision for INFO-level request logs
+
+    Warnings and errors are always logged; only the routine per-request
+    records go through sample().
+    """
+
+    def __init__(self, rate: float = 1.0):
+        self.rate = max(0.0, min(1.0, rate))
+
+    def sample(self) -> bool:
+        return self.rate >= 1.0 or (self.rate > 0.0 and random.random() < self.rate)
+
+
+def setup_logging(level: str = "INFO", fmt: str = "json", queue_size: int = 10000,
+                  stream=None) -> NonBlockingQueueHandler:
+    """Route every logger (uvicorn's included) through one background writer
+
+    Returns the queue handler, whose `dropped` counter tells how many records
+    were shed because the writer fell behind.
+    """
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(JsonFormatter() if fmt == "json" else SafeFormatter(TEXT_FORMAT))
+
+    handler = NonBlockingQueueHandler(queue_size)
+    listener = logging.handlers.QueueListener(handler.queue, writer, respect_handler_level=False)
+    listener.start()
+    # Flush what is still queued on exit
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+    # uvicorn installs its own (synchronous) handlers unless told otherwise;
+    # send its records through the queue as well
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers.clear()
+        uvicorn_logger.propagate = True
+
+    return handler
@@ -2,49 +2,197 @@
 """
 Test proxy to verify if Claude Code accepts HTTP BASE_URL
 This will help us understand the HTTPS issue
+
+Also works as a mock Anthropic/Kong upstream for offline load tests:
+POST /v1/messages (and the Kong route) answers like the Messages API,
+buffered or as SSE, with configurable latency, token rate and response size.
+Masked tokens found in the request are echoed back so the masking proxy's
+unmasking path is exercised.
+
+    KONG_URL=http://localhost:8090 python kong-masking-proxy.py
+    python test-http-proxy.py --port 8090 --latency-ms 300 --token-rate 50
 """
 
 from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 import uvicorn
 import httpx
+import argparse
+import asyncio
 import json
 import logging
+import os
+import random
+import re
+import uuid
 from datetime import datetime
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+from structured_logging import redact_headers, setup_logging
+
+# Setup logging (queued, written by a background thread)
+setup_logging(
+    level=os.environ.get("LOG_LEVEL", "INFO"),
+    fmt=os.environ.get("LOG_FORMAT", "text")
 )
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
+# Mock upstream settings (environment or command line)
+MOCK_CONFIG = {
+    # auto: follow the request's "stream" flag; buffered / sse: force one
+    "mode": os.environ.get("MOCK_MODE", "auto"),
+    # Delay before the response starts (time to first byte)
+    "latency_ms": float(os.environ.get("MOCK_LATENCY_MS", "0")),
+    "jitter_ms": float(os.environ.get("MOCK_JITTER_MS", "0")),
+    # SSE deltas per second, 0 = as fast as possible
+    "token_rate": float(os.environ.get("MOCK_TOKEN_RATE", "0")),
+    # Response size in words, and characters per SSE text delta
+    "response_words": int(os.environ.get("MOCK_RESPONSE_WORDS", "200")),
+    "delta_chars": int(os.environ.get("MOCK_DELTA_CHARS", "8")),
+    "echo_tokens": os.environ.get("MOCK_ECHO_TOKENS", "true").lower() == "true",
+    # Fraction of requests answered with a 529 overloaded error
+    "error_rate": float(os.environ.get("MOCK_ERROR_RATE", "0")),
+}
+
+# Masked token shapes of both the Python proxy (EC2_INSTANCE_001, or encrypted
+# EC2_INSTANCE_A<base32>) and the Kong plugin (AWS_EC2_001)
+MASKED_TOKEN = re.compile(r'\b[A-Z][A-Z0-9]*(?:_[A-Z0-9]+)*_(?:\d{3,}|[A-Z][A-Z2-7]{18,})\b')
+
+FILLER_WORDS = (
+    "the", "instance", "is", "running", "in", "a", "private", "subnet", "and",
+    "its", "security", "group", "allows", "traffic", "from", "load", "balancer",
+    "check", "bucket", "policy", "before", "deploying", "changes", "to", "production",
+)
+
+
+def build_response_text(request_body: bytes) -> str:
+    """Filler text with every masked token of the request mixed in"""
+    tokens = []
+    if MOCK_CONFIG["echo_tokens"]:
+        tokens = list(dict.fromkeys(MASKED_TOKEN.findall(request_body.decode('utf-8', 'replace'))))
+
+    words = [FILLER_WORDS[i % len(FILLER_WORDS)] for i in range(MOCK_CONFIG["response_words"])]
+    if tokens:
+        step = max(1, len(words) // len(tokens))
+        for i, token in enumerate(tokens):
+            words.insert(min(len(words), i * (step + 1)), token)
+    return " ".join(words)
+
+
+async def wait_first_byte():
+    delay = MOCK_CONFIG["latency_ms"] + random.uniform(0, MOCK_CONFIG["jitter_ms"])
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+
+
+def sse_event(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode('utf-8')
+
+
+async def stream_message(message_id: str, model: str, text: str):
+    """Messages API event sequence; text deltas are cut at fixed widths so
+    masked tokens regularly straddle two events"""
+    await wait_first_byte()
+    yield sse_event("message_start", {
+        "type": "message_start",
+        "message": {
+            "id": message_id, "type": "message", "role": "assistant", "model": model,
+            "content": [], "stop_reason": None, "stop_sequence": None,
+            "usage": {"input_tokens": 0, "output_tokens": 0},
+        },
+    })
+    yield sse_event("content_block_start", {
+        "type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""},
+    })
+    yield sse_event("ping", {"type": "ping"})
+
+    interval = 1 / MOCK_CONFIG["token_rate"] if MOCK_CONFIG["token_rate"] > 0 else 0
+    width = max(1, MOCK_CONFIG["delta_chars"])
+    deltas = 0
+    for start in range(0, len(text), width):
+        yield sse_event("content_block_delta", {
+            "type": "content_block_delta", "index": 0,
+            "delta": {"type": "text_delta", "text": text[start:start + width]},
+        })
+        deltas += 1
+        if interval:
+            await asyncio.sleep(interval)
+
+    yield sse_event("content_block_stop", {"type": "content_block_stop", "index": 0})
+    yield sse_event("message_delta", {
+        "type": "message_delta",
+        "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+        "usage": {"output_tokens": deltas},
+    })
+    yield sse_event("message_stop", {"type": "message_stop"})
+
+
+@app.post("/v1/messages")
+@app.post("/claude-proxy/v1/messages")
+async def mock_messages(request: Request):
+    """Mock Messages API (the Kong route is accepted too, so the masking proxy
+    can point KONG_URL straight at this server)"""
+    body_bytes = await request.body()
+    try:
+        body = json.loads(body_bytes)
+    except ValueError:
+        return JSONResponse(status_code=400, content={
+            "type": "error", "error": {"type": "invalid_request_error", "message": "invalid JSON"},
+        })
+
+    if random.random() < MOCK_CONFIG["error_rate"]:
+        await wait_first_byte()
+        return JSONResponse(status_code=529, content={
+            "type": "error", "error": {"type": "overloaded_error", "message": "Overloaded (mock)"},
+        })
+
+    message_id = f"msg_mock_{uuid.uuid4().hex[:24]}"
+    model = body.get("model", "claude-3-sonnet-20240229")
+    text = build_response_text(body_bytes)
+
+    mode = MOCK_CONFIG["mode"]
+    stream = body.get("stream", False) if mode == "auto" else mode == "sse"
+    if stream:
+        return StreamingResponse(stream_message(message_id, model, text), media_type="text/event-stream")
+
+    await wait_first_byte()
+    return {
+        "id": message_id,
+        "type": "message",
+        "role": "assistant",
+        "model": model,
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": len(body_bytes) // 4, "output_tokens": len(text) // 4},
+    }
+
+
 # Test if we receive any requests
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "HEAD", "PATCH", "TRACE"])
 async def catch_all(request: Request, path: str):
     """Catch all requests to see what Claude Code sends"""
     
-    # Log request details
-    logger.info(f"🔍 Received request:")
-    logger.info(f"  Method: {request.method}")
-    logger.info(f"  Path: /{path}")
-    logger.info(f"  Headers: {dict(request.headers)}")
-    
-    # Get body if present
-    body = None
+    # Log request details; bodies are only described, never written out
+    body_bytes = b""
     if request.method in ["POST", "PUT", "PATCH"]:
         body_bytes = await request.body()
+    
+    logger.info("🔍 Received request: %s /%s", request.method, path, extra={
+        "event": "request",
+        "user_agent": request.headers.get("user-agent", ""),
+        "body_bytes": len(body_bytes)
+    })
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("  Headers: %s", redact_headers(request.headers))
         if body_bytes:
             try:
                 body = json.loads(body_bytes)
-                logger.info(f"  Body: {json.dumps(body, indent=2)}")
-            except:
-                logger.info(f"  Body (raw): {body_bytes[:200]}...")
-    
-    # Check if this is from Claude Code
-    user_agent = request.headers.get("user-agent", "")
-    logger.info(f"  User-Agent: {user_agent}")
+                shape = ", ".join(sorted(body)) if isinstance(body, dict) else type(body).__name__
+                logger.debug("  Body: %d bytes of JSON (%s)", len(body_bytes), shape)
+            except ValueError:
+                logger.debug("  Body: %d bytes, not JSON", len(body_bytes))
     
     # For now, return a simple response
     return {
@@ -56,13 +204,38 @@ async def catch_all(request: Request, path: str):
     }
 
 if __name__ == "__main__":
-    print("🚀 Starting HTTP test proxy on http://localhost:8082")
-    print("📋 Test with: ANTHROPIC_BASE_URL=http://localhost:8082 claude")
+    parser = argparse.ArgumentParser(description="HTTP test proxy / mock Anthropic upstream")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--mode", choices=["auto", "buffered", "sse"], default=MOCK_CONFIG["mode"])
+    parser.add_argument("--latency-ms", type=float, default=MOCK_CONFIG["latency_ms"])
+    parser.add_argument("--jitter-ms", type=float, default=MOCK_CONFIG["jitter_ms"])
+    parser.add_argument("--token-rate", type=float, default=MOCK_CONFIG["token_rate"])
+    parser.add_argument("--response-words", type=int, default=MOCK_CONFIG["response_words"])
+    parser.add_argument("--delta-chars", type=int, default=MOCK_CONFIG["delta_chars"])
+    parser.add_argument("--error-rate", type=float, default=MOCK_CONFIG["error_rate"])
+    parser.add_argument("--no-echo-tokens", action="store_true")
+    args = parser.parse_args()
+
+    MOCK_CONFIG.update(
+        mode=args.mode,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        token_rate=args.token_rate,
+        response_words=args.response_words,
+        delta_chars=args.delta_chars,
+        error_rate=args.error_rate,
+        echo_tokens=MOCK_CONFIG["echo_tokens"] and not args.no_echo_tokens,
+    )
+
+    print(f"🚀 Starting HTTP test proxy on http://localhost:{args.port}")
+    print(f"📋 Test with: ANTHROPIC_BASE_URL=http://localhost:{args.port} claude")
+    print(f"🧪 Mock /v1/messages: {MOCK_CONFIG}")
     print("-" * 60)
-    
+
     uvicorn.run(
         app,
         host="0.0.0.0",
-        port=8082,
-        log_level="warning"  # Reduce uvicorn noise
-    )
\ No newline at end of file
+        port=args.port,
+        log_level="warning",  # Reduce uvicorn noise
+        log_config=None
+    )
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Stateless reversible tokens
+A token is the keyed, authenticated encryption of the original value, so
+unmasking is a decrypt: no mapping store, no lookups, and any replica holding
+the keys can unmask what another one masked.
+
+    EC2_INSTANCE_A<base32(tag || ciphertext)>
+
+A is the key id: one letter, so old tokens keep decrypting after the active
+key is rotated. The scheme is SIV-style deterministic authenticated
+encryption built on keyed BLAKE2b (standard library only):
+
+    tag        = BLAKE2b-80(k_mac, prefix || 0x00 || value)
+    ciphertext = value XOR BLAKE2b-512(k_enc, tag || counter) ...
+
+The tag doubles as the IV. Equal values under the same prefix and key get
+equal tokens, which keeps a conversation consistent across turns and
+replicas. Decryption recomputes the tag, so a token that was altered, cut
+short or moved to another prefix does not decrypt.
+
+Keys come from MASK_TOKEN_KEYS ("A:<base64>,B:<base64>", at least 16 bytes
+each); MASK_TOKEN_KEY_ID picks the one new tokens use.
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from masking_engine import TOKEN_FORMATS
+
+TAG_BYTES = 10
+# Key id letter + base32 of the tag and at least one byte of ciphertext
+MIN_BODY_CHARS = 19
+TOKEN_BODY = r'[A-Z][A-Z2-7]{%d,}' % (MIN_BODY_CHARS - 1)
+
+_BLOCK = 64
+_KEY_ID = re.compile(r'[A-Z]')
+
+
+class TokenKeyError(ValueError):
+    """Missing or malformed token keys"""
+
+
+class _KeySchedule:
+    """Keyed BLAKE2b states for one key, derived once and copied per use"""
+
+    __slots__ = ('mac', 'enc', '_prefixed')
+
+    def __init__(self, key: bytes):
+        self.mac = hashlib.blake2b(key=hashlib.blake2b(key, person=b'mask-mac').digest(),
+                                   digest_size=TAG_BYTES)
+        self.enc = hashlib.blake2b(key=hashlib.blake2b(key, person=b'mask-enc').digest(),
+                                   digest_size=_BLOCK)
+        # prefix -> MAC state that has already absorbed prefix || 0x00
+        self._prefixed: Dict[bytes, "hashlib._Hash"] = {}
+
+    def tag(self, prefix: bytes, value: bytes) -> bytes:
+        state = self._prefixed.get(prefix)
+        if state is None:
+            state = self.mac.copy()
+            state.update(prefix + b'\0')
+            self._prefixed[prefix] = state
+        mac = state.copy()
+        mac.update(value)
+        return mac.digest()
+
+    def keystream(self, tag: bytes, length: int) -> bytes:
+        blocks = []
+        for counter in range((length + _BLOCK - 1) // _BLOCK):
+            enc = self.enc.copy()
+            enc.update(tag)
+            enc.update(counter.to_bytes(4, 'big'))
+            blocks.append(enc.digest())
+        return b''.join(blocks)[:length]
+
+
+def _xor(data: bytes, stream: bytes) -> bytes:
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(stream, 'big')).to_bytes(len(data), 'big')
+
+
+def parse_keys(spec: str) -> Dict[str, bytes]:
+    """"A:<base64>,B:<base64>" -> {key id: key}"""
+    keys = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        key_id, sep, encoded = item.partition(':')
+        if not sep or not _KEY_ID.fullmatch(key_id):
+            raise TokenKeyError(f"token key ids are single letters A-Z, got {key_id!r}")
+        try:
+            key = base64.b64decode(encoded, validate=True)
+        except binascii.Error:
+            raise TokenKeyError(f"token key {key_id} is not valid base64") from None
+        if len(key) < 16:
+            raise TokenKeyError(f"token key {key_id} is shorter than 16 bytes")
+        keys[key_id] = key
+    return keys
+
+
+class TokenCipher:
+    """Encrypts values to tokens and back, one cached key schedule per key"""
+
+    def __init__(self, keys: Dict[str, bytes], active: Optional[str] = None,
+                 token_formats: Dict[str, Tuple[str, str]] = TOKEN_FORMATS):
+        if not keys:
+            raise TokenKeyError("no token keys configured")
+        self.active = active or sorted(keys)[-1]
+        if self.active not in keys:
+            raise TokenKeyError(f"active token key {self.active} is not among the configured keys")
+        self._schedules = {key_id: _KeySchedule(key) for key_id, key in keys.items()}
+        self._formats = token_formats
+        self._prefixes = {prefix for _, prefix in token_formats.values()}
+        self.token_regex = re.compile(
+            r'\b(' + '|'.join(re.escape(prefix) for prefix in sorted(self._prefixes, key=len, reverse=True))
+            + r')_(' + TOKEN_BODY + r')\b'
+        )
+
+    @property
+    def key_ids(self) -> Tuple[str, ...]:
+        return tuple(sorted(self._schedules))
+
+    @classmethod
+    def from_env(cls) -> "TokenCipher":
+        return cls(parse_keys(os.environ.get("MASK_TOKEN_KEYS", "")),
+                   os.environ.get("MASK_TOKEN_KEY_ID") or None)
+
+    def encrypt(self, pattern_name: str, original: str) -> str:
+        prefix = self._formats[pattern_name][1]
+        schedule = self._schedules[self.active]
+        value = original.encode('utf-8', 'surrogatepass')
+        tag = schedule.tag(prefix.encode('ascii'), value)
+        sealed = tag + _xor(value, schedule.keystream(tag, len(value)))
+        return f"{prefix}_{self.active}{base64.b32encode(sealed).decode('ascii').rstrip('=')}"
+
+    def decrypt(self, token: str) -> Optional[str]:
+        """Original value, or None when token is not a valid token under our keys"""
+        match = self.token_regex.fullmatch(token)
+        if match is None:
+            return None
+        prefix, body = match.groups()
+        schedule = self._schedules.get(body[0])
+        if schedule is None:
+            return None
+        encoded = body[1:]
+        try:
+            sealed = base64.b32decode(encoded + '=' * (-len(encoded) % 8))
+        except binascii.Error:
+            return None
+        tag, ciphertext = sealed[:TAG_BYTES], sealed[TAG_BYTES:]
+        if not ciphertext:
+            return None
+        value = _xor(ciphertext, schedule.keystream(tag, len(ciphertext)))
+        if not hmac.compare_digest(tag, schedule.tag(prefix.encode('ascii'), value)):
+            return None
+        try:
+            return value.decode('utf-8', 'surrogatepass')
+        except UnicodeDecodeError:
+            return None
+
+    def encrypt_batch(self, items: Iterable[Tuple[str, str]]) -> Dict[str, str]:
+        """original -> token for every (pattern name, original), each value once"""
+        tokens: Dict[str, str] = {}
+        for pattern_name, original in items:
+            if original not in tokens:
+                tokens[original] = self.encrypt(pattern_name, original)
+        return tokens
+
+    def decrypt_batch(self, tokens: Iterable[str]) -> Dict[str, str]:
+        """token -> original for every token that decrypts"""
+        originals: Dict[str, str] = {}
+        for token in tokens:
+            if token not in originals:
+                original = self.decrypt(token)
+                if original is not None:
+                    originals[token] = original
+        return originals
+
+
+class CipherTokenStore:
+    """Mapping-store interface over TokenCipher (MASK_STORE_BACKEND=cipher)
+
+    Nothing has to be stored for unmasking. The only state is a small LRU of
+    recent encryptions: it lets repeated values skip the cipher and backs
+    peek(), which the incremental masking cache uses to validate its entries.
+    """
+
+    type = "cipher"
+    # Tokens are valid on every replica that has the keys, nothing is shared
+    shared = False
+    # prefetch() encrypts a request's new values in one pass
+    batch_prefetch = True
+
+    def __init__(self, cipher: TokenCipher, recent_entries: int = 10000):
+        self.cipher = cipher
+        self.recent_entries = recent_entries
+        self._lock = threading.Lock()
+        self._recent: "OrderedDict[str, str]" = OrderedDict()
+        # counter key -> tokens issued since start (bounded by pattern count)
+        self.issued: Dict[str, int] = {key: 0 for key, _ in TOKEN_FORMATS.values()}
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'encrypted': 0,
+            'decrypted': 0,
+            'rejected': 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._recent)
+
+    def get_or_create(self, session: str, pattern_name: str, original: str) -> str:
+        with self._lock:
+            token = self._recent.get(original)
+            if token is not None and token.startswith(TOKEN_FORMATS[pattern_name][1] + '_'):
+                self._recent.move_to_end(original)
+                self.stats['hits'] += 1
+                return token
+            self.stats['misses'] += 1
+        token = self.cipher.encrypt(pattern_name, original)
+        with self._lock:
+            self._remember({original: token})
+            self.stats['encrypted'] += 1
+            self.issued[TOKEN_FORMATS[pattern_name][0]] += 1
+        return token
+
+    async def prefetch(self, session: str, candidates: Iterable[Tuple[str, str]]):
+        """Encrypt every new value of a request in one pass"""
+        with self._lock:
+            pending = {original: name for name, original in candidates if original not in self._recent}
+        if pending:
+            tokens = self.cipher.encrypt_batch((name, original) for original, name in pending.items())
+            with self._lock:
+                self._remember(tokens)
+                self.stats['encrypted'] += len(tokens)
+                for name in pending.values():
+                    self.issued[TOKEN_FORMATS[name][0]] += 1
+
+    def peek(self, session: str, original: str) -> Optional[str]:
+        with self._lock:
+            return self._recent.get(original)
+
+    def restore(self, session: str, mapping: Dict[str, str]):
+        """Nothing to restore: saved tokens decrypt on their own"""
+
+    def lookup(self, session: str, masked: str) -> Optional[str]:
+        return self.cipher.decrypt(masked)
+
+    async def resolve_tokens(self, session: str, tokens: Iterable[str]) -> Dict[str, str]:
+        tokens = list(tokens)
+        found = self.cipher.decrypt_batch(tokens)
+        self.stats['decrypted'] += len(found)
+        self.stats['rejected'] += len(set(tokens)) - len(found)
+        return found
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            'type': self.type,
+            'entries': len(self._recent),
+            'active_key': self.cipher.active,
+            'keys': len(self.cipher.key_ids),
+            **self.stats,
+        }
+
+    def _remember(self, tokens: Dict[str, str]):
+        """Add encryptions to the LRU; the caller holds the lock"""
+        self._recent.update(tokens)
+        for original in tokens:
+            self._recent.move_to_end(original)
+        while len(self._recent) > self.recent_entries:
+            self._recent.popitem(last=False)
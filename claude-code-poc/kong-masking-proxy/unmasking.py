@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Response unmasking for the masking proxy
+Python side of the plugin's prepare_unmask_data / apply_unmask_data: tokens
+are found by their shape and looked up in the request's map, for buffered
+bodies and SSE streams
+"""
+
+import json
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from mapping_store import LOCAL_TOKEN_MARK
+from masking_engine import TOKEN_FORMATS
+from token_cipher import MIN_BODY_CHARS, TOKEN_BODY
+
+_PREFIXES = '|'.join(sorted({prefix for _, prefix in TOKEN_FORMATS.values()}, key=len, reverse=True))
+
+# Any token shape the proxy issues: counter tokens (group 1 holds the number),
+# encrypted ones (token_cipher.py, group 2 holds the body) or the local
+# fallback tokens of a shared store (mapping_store.py, group 3 holds the
+# number). Not anchored on a word boundary: Kong patterns can mask a value
+# glued to the text around it. Never starts inside a longer token name, though.
+ANY_TOKEN = re.compile(
+    r'(?<![A-Z_])(?:' + _PREFIXES + r')_(?:(\d{3,})|(' + TOKEN_BODY + r')|'
+    + LOCAL_TOKEN_MARK + r'(\d{3,}))'
+)
+
+# Tail of a text that may still grow into a token: a whole prefix and the
+# token characters so far. A bare partial prefix is checked separately.
+_TOKEN_TAIL = re.compile(
+    r'(?<![A-Z_])(?:' + _PREFIXES + r')_(?:\d*|[A-Z][A-Z2-7]*|' + LOCAL_TOKEN_MARK + r'\d*)\Z'
+)
+_PREFIX_HEADS = frozenset(
+    prefix[:size] for _, prefix in TOKEN_FORMATS.values() for size in range(1, len(prefix) + 1)
+)
+_PREFIX_HEAD_MAX = max(map(len, _PREFIX_HEADS), default=0)
+
+# SSE framing: an event ends at a blank line, lines end in CRLF, LF or CR
+_EVENT_END = re.compile(rb'\r\n\r\n|\n\n|\r\r')
+_LINE_BREAK = re.compile(r'(\r\n|\r|\n)')
+
+# content_block_delta payload field per delta type
+_DELTA_FIELDS = {
+    'text_delta': 'text',
+    'input_json_delta': 'partial_json',
+}
+
+
+def token_candidates(match: re.Match) -> Iterable[str]:
+    """Tokens an ANY_TOKEN match may stand for, longest first
+
+    A value can end right before more digits (prod-bucket-9751 masks to
+    S3_BUCKET_001 + 9751), so every cut down to three digits is a candidate.
+    The same goes for encrypted tokens followed by base32 characters, down
+    to the shortest body.
+    """
+    token = match.group()
+    if match.group(1) is not None:
+        shortest = match.start(1) - match.start() + 3
+    elif match.group(3) is not None:
+        shortest = match.start(3) - match.start() + 3
+    else:
+        shortest = match.start(2) - match.start() + MIN_BODY_CHARS
+    return (token[:cut] for cut in range(len(token), shortest - 1, -1))
+
+
+def restore_tokens(text: str, lookup: Callable[[str], Optional[str]]) -> str:
+    """Replace every token lookup() knows with its original value"""
+    def restore(match):
+        for candidate in token_candidates(match):
+            original = lookup(candidate)
+            if original is not None:
+                return original + match.group()[len(candidate):]
+        return match.group()
+
+    return ANY_TOKEN.sub(restore, text)
+
+
+class Unmasker:
+    """Restores the tokens one request issued
+
+    Tokens are found with the generic ANY_TOKEN shape and looked up in the
+    request's map, the same resolution /v1/unmask/batch uses, so the cost
+    does not grow with the number of tokens the request issued.
+    """
+
+    def __init__(self, unmask_map: Dict[str, str]):
+        self.unmask_map = unmask_map
+
+    def __bool__(self) -> bool:
+        return bool(self.unmask_map)
+
+    def unmask(self, text: str) -> str:
+        if not self.unmask_map:
+            return text
+        return restore_tokens(text, self.unmask_map.get)
+
+    def unmask_bytes(self, body: bytes) -> bytes:
+        """Unmask a buffered UTF-8 body (JSON or text)
+
+        Originals never contain quotes or backslashes, so substituting inside
+        serialized JSON keeps it valid without a parse/dump round trip.
+        """
+        if not self.unmask_map or not body:
+            return body
+        try:
+            text = body.decode('utf-8')
+        except UnicodeDecodeError:
+            return body
+        return self.unmask(text).encode('utf-8')
+
+    def split_safe(self, text: str) -> Tuple[str, str]:
+        """Split text into (ready, held): held is the tail that could still
+        grow into a token (or more digits of one) once more text arrives"""
+        match = _TOKEN_TAIL.search(text)
+        if match is not None:
+            return text[:match.start()], text[match.start():]
+        for size in range(min(len(text), _PREFIX_HEAD_MAX), 0, -1):
+            if text[-size:] in _PREFIX_HEADS:
+                return text[:-size], text[-size:]
+        return text, ''
+
+
+class SSEUnmasker:
+    """Unmasks an Anthropic SSE byte stream chunk by chunk
+
+    Events are relayed as soon as they are complete. For content_block_delta
+    events only a tail that might be the start of a token is held back per
+    content block, and it is flushed as its own delta before content_block_stop.
+    """
+
+    def __init__(self, unmasker: Unmasker):
+        self.unmasker = unmasker
+        self._pending = b''
+        # content block index -> (delta type, held text)
+        self._carry: Dict[int, Tuple[str, str]] = {}
+        # Line break of the upstream's framing, reused for flushed deltas
+        self._newline = '\n'
+
+    def feed(self, chunk: bytes) -> bytes:
+        """Consume upstream bytes, return the bytes ready to send downstream"""
+        data = self._pending + chunk
+        self._pending = b''
+        out: List[bytes] = []
+        start = 0
+        for end in _EVENT_END.finditer(data):
+            # A lone CR may still become CRLF with the next chunk
+            if end.group() == b'\r\r' and end.end() == len(data):
+                break
+            out.append(self._process_event(data[start:end.end()]))
+            start = end.end()
+        self._pending = data[start:]
+        return b''.join(out)
+
+    def flush(self) -> bytes:
+        """Emit whatever is still held when the upstream stream ends"""
+        out = self._flush_carry()
+        if self._pending:
+            out += self.unmasker.unmask_bytes(self._pending)
+            self._pending = b''
+        return out
+
+    def _flush_carry(self) -> bytes:
+        return b''.join(self._delta_event(index) for index in list(self._carry))
+
+    def _process_event(self, raw: bytes) -> bytes:
+        try:
+            text = raw.decode('utf-8')
+        except UnicodeDecodeError:
+            return raw
+
+        # Lines at even indexes, their line breaks at odd ones
+        parts = _LINE_BREAK.split(text)
+        data_index = next((i for i in range(0, len(parts), 2) if parts[i].startswith('data:')), None)
+        if data_index is None:
+            return raw
+        self._newline = parts[1]
+
+        try:
+            payload = json.loads(parts[data_index][5:])
+        except ValueError:
+            return self.unmasker.unmask(text).encode('utf-8')
+
+        event_type = payload.get('type') if isinstance(payload, dict) else None
+        if event_type == 'content_block_delta':
+            return self._process_delta(parts, data_index, payload)
+        if event_type == 'content_block_stop':
+            flushed = self._delta_event(payload.get('index', 0))
+            return flushed + raw
+        if event_type == 'message_stop':
+            return self._flush_carry() + raw
+
+        return self.unmasker.unmask(text).encode('utf-8')
+
+    def _process_delta(self, parts: List[str], data_index: int, payload: dict) -> bytes:
+        delta = payload.get('delta') or {}
+        field = _DELTA_FIELDS.get(delta.get('type'))
+        if field is None or not isinstance(delta.get(field), str):
+            return self.unmasker.unmask(''.join(parts)).encode('utf-8')
+
+        index = payload.get('index', 0)
+        _, held = self._carry.pop(index, ('', ''))
+        ready, held = self.unmasker.split_safe(held + delta[field])
+        if held:
+            self._carry[index] = (delta['type'], held)
+
+        delta[field] = self.unmasker.unmask(ready)
+        parts[data_index] = 'data: ' + json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+        return ''.join(parts).encode('utf-8')
+
+    def _delta_event(self, index: int) -> bytes:
+        delta_type, held = self._carry.pop(index, (None, ''))
+        if not held:
+            return b''
+        payload = {
+            'type': 'content_block_delta',
+            'index': index,
+            'delta': {'type': delta_type, _DELTA_FIELDS[delta_type]: self.unmasker.unmask(held)},
+        }
+        newline = self._newline
+        return (
+            'event: content_block_delta' + newline + 'data: '
+            + json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+            + newline + newline
+        ).encode('utf-8')
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Shared upstream HTTP client for Kong
+One pooled httpx.AsyncClient per process with keep-alive, optional HTTP/2
+and per-phase timeouts, plus pool occupancy / wait-time statistics
+"""
+
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, Mapping, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+# RFC 7230 section 6.1 connection-scoped headers, never forwarded by a proxy
+HOP_BY_HOP_HEADERS = frozenset({
+    'connection',
+    'keep-alive',
+    'proxy-authenticate',
+    'proxy-authorization',
+    'proxy-connection',
+    'te',
+    'trailer',
+    'trailers',
+    'transfer-encoding',
+    'upgrade',
+})
+
+# Added by the proxy's own server to every response it sends
+SERVER_HEADERS = ('date', 'server')
+
+
+def forwardable_headers(headers: Mapping[str, str], drop: Iterable[str] = ()) -> Dict[str, str]:
+    """Copy headers minus hop-by-hop ones, anything named in Connection, and drop"""
+    excluded = set(HOP_BY_HOP_HEADERS)
+    excluded.update(name.lower() for name in drop)
+    connection = headers.get('connection')
+    if connection:
+        excluded.update(token.strip().lower() for token in connection.split(','))
+
+    return {name: value for name, value in headers.items() if name.lower() not in excluded}
+
+
+def relayed_headers(headers: Mapping[str, str], drop: Iterable[str] = ()) -> Dict[str, str]:
+    """forwardable_headers for an upstream response sent on to the client
+
+    Also drops the headers our own server (uvicorn) adds to every response,
+    which would otherwise appear twice.
+    """
+    return forwardable_headers(headers, drop=(*SERVER_HEADERS, *drop))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class PoolMonitor:
+    """Tracks in-flight upstream requests and how long each waited for a connection
+
+    Wait time is measured from request start to the first httpcore trace event
+    that needs a connection (TCP connect for a new one, request headers for a
+    reused one), so it covers pool queueing but not the request itself.
+    Connect time runs from TCP connect start to the first request headers, so
+    it includes the TLS handshake. Both are passed to `on_phase` when set.
+    """
+
+    _CONNECTION_EVENTS = (
+        "connection.connect_tcp.started",
+        "http11.send_request_headers.started",
+        "http2.send_request_headers.started",
+    )
+
+    def __init__(self, on_phase: Optional[Callable[[str, float], None]] = None):
+        self.on_phase = on_phase
+        self.in_flight = 0
+        self.requests = 0
+        self.new_connections = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def request_started(self):
+        self.in_flight += 1
+        self.requests += 1
+
+    def request_finished(self):
+        self.in_flight -= 1
+
+    def extensions(self) -> Dict[str, Any]:
+        """Per-request httpx extensions carrying a trace hook"""
+        started = time.perf_counter()
+        waited = False
+        connect_started = None
+
+        async def trace(event_name: str, info: Dict[str, Any]):
+            nonlocal waited, connect_started
+            if event_name == "connection.connect_tcp.started":
+                self.new_connections += 1
+                connect_started = time.perf_counter()
+            if not waited and event_name in self._CONNECTION_EVENTS:
+                waited = True
+                wait = time.perf_counter() - started
+                self.wait_total += wait
+                if wait > self.wait_max:
+                    self.wait_max = wait
+                if self.on_phase is not None:
+                    self.on_phase("pool_wait", wait)
+            elif connect_started is not None and event_name.endswith("send_request_headers.started"):
+                if self.on_phase is not None:
+                    self.on_phase("upstream_connect", time.perf_counter() - connect_started)
+                connect_started = None
+
+        return {"trace": trace}
+
+    def snapshot(self, client: httpx.AsyncClient) -> Dict[str, Any]:
+        """Pool occupancy and wait statistics for /health"""
+        stats = {
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "pool_wait_avg_ms": round(self.wait_total / self.requests * 1000, 3) if self.requests else 0.0,
+            "pool_wait_max_ms": round(self.wait_max * 1000, 3),
+        }
+
+        # httpcore does not expose pool state publicly; read it defensively
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is not None:
+            stats["connections"] = len(connections)
+            stats["idle_connections"] = sum(1 for conn in connections if conn.is_idle())
+            stats["http2_connections"] = sum(
+                1 for conn in connections if "HTTP/2" in conn.info()
+            )
+        return stats
+
+
+def create_upstream_client() -> httpx.AsyncClient:
+    """Build the process-wide Kong client from UPSTREAM_* environment variables"""
+    limits = httpx.Limits(
+        max_connections=_env_int("UPSTREAM_MAX_CONNECTIONS", 100),
+        max_keepalive_connections=_env_int("UPSTREAM_MAX_KEEPALIVE", 20),
+        keepalive_expiry=_env_float("UPSTREAM_KEEPALIVE_EXPIRY", 30.0),
+    )
+    timeout = httpx.Timeout(
+        connect=_env_float("UPSTREAM_CONNECT_TIMEOUT", 5.0),
+        read=_env_float("UPSTREAM_READ_TIMEOUT", 60.0),
+        write=_env_float("UPSTREAM_WRITE_TIMEOUT", 60.0),
+        pool=_env_float("UPSTREAM_POOL_TIMEOUT", 10.0),
+    )
+
+    http2 = os.environ.get("UPSTREAM_HTTP2", "false").lower() == "true"
+    if http2 and not _http2_available():
+        logger.warning("⚠️  UPSTREAM_HTTP2=true but the 'h2' package is missing, using HTTP/1.1")
+        http2 = False
+
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
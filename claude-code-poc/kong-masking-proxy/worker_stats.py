@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Stats shared between the worker processes of one proxy instance
+proxy-launcher.py creates one shared memory segment with a slot per worker
+before it forks. Each worker rewrites its own slot with a JSON snapshot of
+its /health stats and metrics about once a second. /health and /metrics
+read every slot, so they can report totals for the whole instance.
+
+Slots are written under a sequence lock. The counter is odd while a slot is
+being written, and readers retry if it changed while they copied the slot.
+"""
+
+import json
+import os
+import struct
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional
+
+# Seconds between snapshots of a worker's stats
+PUBLISH_INTERVAL = 1.0
+SLOT_BYTES = 512 * 1024
+
+_HEADER = struct.Struct('<QI')  # sequence, payload length
+_READ_ATTEMPTS = 5
+
+# This worker's slot, set right after fork (None in a standalone proxy)
+_current: Optional["WorkerSlot"] = None
+
+
+class SharedStats:
+    """Fixed-size slots in one shared memory segment"""
+
+    def __init__(self, shm: shared_memory.SharedMemory, slots: int, slot_bytes: int):
+        self.shm = shm
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+
+    @classmethod
+    def create(cls, slots: int, slot_bytes: int = SLOT_BYTES) -> "SharedStats":
+        stats = cls(shared_memory.SharedMemory(create=True, size=slots * slot_bytes), slots, slot_bytes)
+        stats.shm.buf[:slots * slot_bytes] = bytes(slots * slot_bytes)
+        return stats
+
+    def publish(self, slot: int, data: Dict[str, Any]) -> bool:
+        """Replace the slot's snapshot; False when it does not fit"""
+        payload = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        if _HEADER.size + len(payload) > self.slot_bytes:
+            return False
+        buf = self.shm.buf
+        offset = slot * self.slot_bytes
+        sequence = _HEADER.unpack_from(buf, offset)[0]
+        if sequence % 2 == 0:
+            sequence += 1
+        _HEADER.pack_into(buf, offset, sequence, 0)
+        start = offset + _HEADER.size
+        buf[start:start + len(payload)] = payload
+        _HEADER.pack_into(buf, offset, sequence + 1, len(payload))
+        return True
+
+    def read(self, slot: int) -> Optional[Dict[str, Any]]:
+        buf = self.shm.buf
+        offset = slot * self.slot_bytes
+        for _ in range(_READ_ATTEMPTS):
+            sequence, length = _HEADER.unpack_from(buf, offset)
+            if sequence % 2:
+                continue
+            start = offset + _HEADER.size
+            payload = bytes(buf[start:start + length])
+            if _HEADER.unpack_from(buf, offset)[0] != sequence:
+                continue
+            if not length:
+                return None
+            try:
+                return json.loads(payload)
+            except ValueError:
+                return None
+        return None
+
+    def clear(self, slot: int):
+        """Drop a slot's snapshot (its worker has exited)"""
+        buf = self.shm.buf
+        offset = slot * self.slot_bytes
+        sequence = _HEADER.unpack_from(buf, offset)[0]
+        _HEADER.pack_into(buf, offset, sequence + 2 - sequence % 2, 0)
+
+    def close(self, unlink: bool = False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class WorkerSlot:
+    """This worker's view of the shared stats: its own slot plus everyone else's"""
+
+    def __init__(self, stats: SharedStats, slot: int):
+        self.stats = stats
+        self.slot = slot
+        self.pid = os.getpid()
+
+    def publish(self, health: Dict[str, Any], metrics: Dict[str, Any]) -> bool:
+        return self.stats.publish(self.slot, {'pid': self.pid, 'health': health, 'metrics': metrics})
+
+    def peers(self) -> List[Dict[str, Any]]:
+        """Latest snapshots of the other live workers"""
+        snapshots = []
+        for slot in range(self.stats.slots):
+            if slot != self.slot:
+                snapshot = self.stats.read(slot)
+                if snapshot is not None:
+                    snapshots.append(snapshot)
+        return snapshots
+
+
+def bind(stats: SharedStats, slot: int):
+    """Called by the launcher in a freshly forked worker"""
+    global _current
+    _current = WorkerSlot(stats, slot)
+
+
+def current_worker() -> Optional[WorkerSlot]:
+    """This process's slot, or None when the proxy runs on its own"""
+    return _current
@@ -0,0 +1,55 @@
+"""
+pytest setup for the masking proxy modules
+They import each other by plain module name from kong-masking-proxy/.
+"""
+
+import asyncio
+import importlib.util
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+PROXY_DIR = Path(__file__).resolve().parents[1] / "kong-masking-proxy"
+sys.path.insert(0, str(PROXY_DIR))
+
+
+@pytest.fixture(scope="session")
+def proxy():
+    """kong-masking-proxy.py loaded as a module (its app is not started)"""
+    spec = importlib.util.spec_from_file_location("kong_masking_proxy", PROXY_DIR / "kong-masking-proxy.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class MockKong:
+    """Stands in for Kong behind the proxy app; `handler` answers each request"""
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.requests = []
+        self.handler = lambda request, body: httpx.Response(200, json={})
+
+    async def _handle(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        self.requests.append((request, body))
+        return self.handler(request, body)
+
+    def call(self, method, path, **kwargs):
+        """One request to the proxy app, with Kong mocked"""
+        async def send():
+            self.proxy.app.state.upstream = httpx.AsyncClient(transport=httpx.MockTransport(self._handle))
+            try:
+                transport = httpx.ASGITransport(app=self.proxy.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as client:
+                    return await client.request(method, path, **kwargs)
+            finally:
+                await self.proxy.app.state.upstream.aclose()
+        return asyncio.run(send())
+
+
+@pytest.fixture
+def kong(proxy):
+    return MockKong(proxy)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Load Generator for the Kong Masking Proxy
+Replays seeded TestDataGenerator Claude requests against kong-masking-proxy.py
+at a target concurrency (closed loop) or request rate (open loop) and reports
+throughput, error rate and latency percentiles as JSON
+
+Leak checks use the proxy's own token shapes (unmasking.ANY_TOKEN), so run
+with the proxy's MASK_PATTERN_SOURCE.
+
+Offline setup (no network needed):
+    python ../kong-masking-proxy/test-http-proxy.py --port 8090 --latency-ms 200 --token-rate 100
+    KONG_URL=http://localhost:8090 python ../kong-masking-proxy/kong-masking-proxy.py
+    python load-generator.py --concurrency 32 --duration 30
+    python load-generator.py --rps 50 --duration 30 --stream-ratio 0.8
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import math
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+TESTS_DIR = Path(__file__).resolve().parent
+GENERATOR_PATH = TESTS_DIR.parent.parent / "nginx-kong-claude-enterprise" / "tests" / "test-data-generator.py"
+sys.path.insert(0, str(TESTS_DIR.parent / "kong-masking-proxy"))
+
+# Every token shape the proxy issues (counter, Kong-prefix and cipher tokens);
+# any left in a response means unmasking missed it
+from unmasking import ANY_TOKEN as MASKED_TOKEN  # noqa: E402
+
+# Small TestDataGenerator cases that look like real tool output; the big ones
+# (massive_array, performance_stress) can be mixed in with --cases
+DEFAULT_CASES = ["mixed_valid_invalid", "unicode_content", "boundary_values", "pattern_collision"]
+
+
+def load_generator():
+    spec = importlib.util.spec_from_file_location("test_data_generator", GENERATOR_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.TestDataGenerator()
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def build_requests(count, cases, stream_ratio, seed):
+    """Pre-generate `count` request bodies so generation is not part of the load"""
+    generator = load_generator()
+    random.seed(seed)
+    bodies = []
+    for i in range(count):
+        if i % 2 == 0:
+            data = generator.generate_edge_case_json(cases[(i // 2) % len(cases)])
+        else:
+            # A typical Claude Code turn: prose with a few resources in it
+            data = (
+                f"Instance {generator.generate_ec2_instance_id()} in {generator.generate_vpc_id()} "
+                f"({generator.generate_private_ip()}) cannot reach bucket "
+                f"{generator.generate_s3_bucket_name()} using role {generator.generate_iam_role()}. "
+                f"Security group {generator.generate_security_group()} was changed yesterday."
+            )
+        request = generator.generate_claude_request(data, stream=random.random() < stream_ratio)
+        bodies.append((request["stream"], json.dumps(request).encode("utf-8")))
+    return bodies
+
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = []
+        self.ttfb = []
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.leaked_tokens = 0
+
+    def report(self, elapsed):
+        total = sum(self.statuses.values()) + sum(self.errors.values())
+        failed = sum(self.errors.values()) + sum(
+            count for status, count in self.statuses.items() if status >= 400
+        )
+        latencies = sorted(self.latencies)
+        ttfb = sorted(self.ttfb)
+
+        def ms(values, pct):
+            value = percentile(values, pct)
+            return round(value * 1000, 3) if value is not None else None
+
+        return {
+            "requests": total,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+            "error_rate": round(failed / total, 4) if total else 0.0,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "errors": dict(self.errors),
+            "responses_with_masked_tokens": self.leaked_tokens,
+            "sent_mb_s": round(self.bytes_sent / elapsed / 1e6, 3) if elapsed else None,
+            "received_mb_s": round(self.bytes_received / elapsed / 1e6, 3) if elapsed else None,
+            "latency_ms": {
+                "p50": ms(latencies, 50), "p90": ms(latencies, 90),
+                "p99": ms(latencies, 99), "max": ms(latencies, 100),
+            },
+            "ttfb_ms": {"p50": ms(ttfb, 50), "p90": ms(ttfb, 90), "p99": ms(ttfb, 99)},
+        }
+
+
+async def send_one(client, url, stream, body, session, stats):
+    headers = {"content-type": "application/json", "x-masking-session": session}
+    started = time.perf_counter()
+    try:
+        async with client.stream("POST", url, content=body, headers=headers) as response:
+            first = None
+            received = bytearray()
+            async for chunk in response.aiter_bytes():
+                if first is None:
+                    first = time.perf_counter()
+                received += chunk
+        finished = time.perf_counter()
+    except httpx.HTTPError as e:
+        stats.errors[type(e).__name__] += 1
+        return
+
+    stats.statuses[response.status_code] += 1
+    stats.bytes_sent += len(body)
+    stats.bytes_received += len(received)
+    stats.latencies.append(finished - started)
+    if stream and first is not None:
+        stats.ttfb.append(first - started)
+    if response.status_code == 200 and MASKED_TOKEN.search(received.decode('utf-8', 'replace')):
+        stats.leaked_tokens += 1
+
+
+async def run_load(args, bodies):
+    stats = LoadStats()
+    url = args.url.rstrip("/") + "/v1/messages"
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    timeout = httpx.Timeout(args.timeout)
+    deadline = time.perf_counter() + args.duration
+    counter = 0
+
+    def next_request():
+        nonlocal counter
+        stream, body = bodies[counter % len(bodies)]
+        # Sessions repeat so the mapping store and cache see returning conversations
+        session = f"load-{counter % args.sessions}"
+        counter += 1
+        return stream, body, session
+
+    def more():
+        return time.perf_counter() < deadline and (not args.requests or counter < args.requests)
+
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        started = time.perf_counter()
+        if args.rps:
+            # Open loop: requests start on schedule whether or not earlier ones finished
+            semaphore = asyncio.Semaphore(args.concurrency)
+            tasks = set()
+
+            async def limited(*request):
+                async with semaphore:
+                    await send_one(client, url, *request, stats)
+
+            interval = 1 / args.rps
+            next_at = started
+            while more():
+                task = asyncio.create_task(limited(*next_request()))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                next_at += interval
+                await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            if tasks:
+                await asyncio.gather(*tasks)
+        else:
+            # Closed loop: `concurrency` clients, each sending back to back
+            async def worker():
+                while more():
+                    await send_one(client, url, *next_request(), stats)
+
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return stats.report(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Kong masking proxy")
+    parser.add_argument("--url", default="http://localhost:8082")
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="parallel clients (closed loop) or max in flight (with --rps)")
+    parser.add_argument("--rps", type=float, default=0, help="target request rate; 0 = closed loop")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many (0 = duration only)")
+    parser.add_argument("--stream-ratio", type=float, default=0.5)
+    parser.add_argument("--cases", nargs="+", default=DEFAULT_CASES)
+    parser.add_argument("--pool", type=int, default=64, help="distinct request bodies to cycle through")
+    parser.add_argument("--sessions", type=int, default=16, help="distinct masking sessions")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    bodies = build_requests(args.pool, args.cases, args.stream_ratio, args.seed)
+    print(f"🚀 {'%g rps' % args.rps if args.rps else 'closed loop'}, concurrency {args.concurrency}, "
+          f"{args.duration:g}s against {args.url}", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "target_rps": args.rps or None,
+            "duration_s": args.duration,
+            "stream_ratio": args.stream_ratio,
+            "cases": args.cases,
+            "seed": args.seed,
+        },
+        "results": asyncio.run(run_load(args, bodies)),
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
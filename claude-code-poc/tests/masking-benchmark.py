@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Masking Engine Benchmark
+Times mask_aws_resources, mask_request_body and the full proxy_messages path
+on seeded TestDataGenerator payloads and writes the results as JSON
+
+Usage:
+    python masking-benchmark.py --output bench.json
+    python masking-benchmark.py --baseline bench.json   # exit 1 on regression
+"""
+
+import argparse
+import asyncio
+import gc
+import importlib.util
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+TESTS_DIR = Path(__file__).resolve().parent
+PROXY_DIR = TESTS_DIR.parent / "kong-masking-proxy"
+GENERATOR_PATH = TESTS_DIR.parent.parent / "nginx-kong-claude-enterprise" / "tests" / "test-data-generator.py"
+
+DEFAULT_CASES = ["performance_stress", "massive_array", "deeply_nested", "unicode_content"]
+ALL_CASES = DEFAULT_CASES + ["mixed_valid_invalid", "boundary_values", "pattern_collision"]
+TARGETS = ["mask_aws_resources", "mask_request_body", "proxy_messages"]
+
+
+def load_module(name, path):
+    """Import a module from a hyphenated file name"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def build_payloads(generator, cases, seed):
+    """Generate one Claude request per case; each case gets its own seed so
+    adding or removing cases does not change the others"""
+    payloads = {}
+    for offset, case in enumerate(ALL_CASES):
+        if case not in cases:
+            continue
+        random.seed(seed + offset)
+        data = generator.generate_edge_case_json(case)
+        if case == "performance_stress":
+            data["metadata"]["generated_at"] = "1970-01-01T00:00:00"  # keep bytes reproducible
+        payloads[case] = generator.generate_claude_request(data)
+    return payloads
+
+
+def summarize(durations, input_bytes, matches, peak_memory):
+    durations = sorted(durations)
+    p50 = percentile(durations, 50)
+    return {
+        "input_bytes": input_bytes,
+        "matches": matches,
+        "iterations": len(durations),
+        "latency_ms": {
+            "p50": round(p50 * 1000, 3),
+            "p99": round(percentile(durations, 99) * 1000, 3),
+            "mean": round(sum(durations) / len(durations) * 1000, 3),
+            "min": round(durations[0] * 1000, 3),
+        },
+        "throughput_mb_s": round(input_bytes / p50 / 1e6, 2) if p50 else None,
+        "matches_per_s": round(matches / p50, 1) if p50 else None,
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def measure(fn, make_args, iterations, warmup):
+    """Time fn(*make_args()) per iteration; argument setup is not timed"""
+    for _ in range(warmup):
+        fn(*make_args())
+
+    durations = []
+    gc.collect()
+    for _ in range(iterations):
+        args = make_args()
+        started = time.perf_counter()
+        fn(*args)
+        durations.append(time.perf_counter() - started)
+
+    # Separate pass: tracemalloc slows allocation down too much to time with
+    args = make_args()
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return durations, peak
+
+
+async def measure_proxy(proxy, body, iterations, warmup):
+    """Drive proxy_messages through ASGI with an in-process echo upstream"""
+    import httpx
+
+    async def echo_upstream(request):
+        return httpx.Response(200, content=request.content, headers={"content-type": "application/json"})
+
+    proxy.app.state.upstream = httpx.AsyncClient(transport=httpx.MockTransport(echo_upstream))
+    transport = httpx.ASGITransport(app=proxy.app)
+    durations = []
+    peak = 0
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for i in range(warmup + iterations + 1):
+            # A fresh masking session per request, so every value is a first sighting
+            headers = {"content-type": "application/json", proxy.SESSION_HEADER: f"bench-{i}"}
+            measure_memory = i == warmup + iterations
+            if measure_memory:
+                tracemalloc.start()
+            started = time.perf_counter()
+            response = await client.post("/v1/messages", content=body, headers=headers)
+            elapsed = time.perf_counter() - started
+            if measure_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            if response.status_code != 200:
+                raise RuntimeError(f"proxy_messages returned {response.status_code}: {response.text[:200]}")
+            if warmup <= i < warmup + iterations:
+                durations.append(elapsed)
+    await proxy.app.state.upstream.aclose()
+    return durations, peak
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=TESTS_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, max_regression):
+    """Return the (case, target) pairs whose p50 got slower than allowed"""
+    with open(baseline_path) as f:
+        baseline = {(r["case"], r["target"]): r for r in json.load(f)["results"]}
+
+    regressions = []
+    for result in results:
+        before = baseline.get((result["case"], result["target"]))
+        if before is None:
+            continue
+        old, new = before["latency_ms"]["p50"], result["latency_ms"]["p50"]
+        change = (new - old) / old if old else 0.0
+        result["p50_change"] = round(change, 4)
+        if change > max_regression:
+            regressions.append(f"{result['case']}/{result['target']}: p50 {old}ms -> {new}ms ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Python AWS masker")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--cases", nargs="+", choices=ALL_CASES, default=DEFAULT_CASES)
+    parser.add_argument("--targets", nargs="+", choices=TARGETS, default=TARGETS)
+    parser.add_argument("--mode", choices=["tree", "bytes"], default="tree",
+                        help="MASKING_MODE for the proxy_messages target")
+    parser.add_argument("--cache", action="store_true",
+                        help="keep the incremental masking cache on (off by default: it would turn "
+                             "repeated iterations into cache hits)")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--baseline", help="previous results to compare p50 against")
+    parser.add_argument("--max-regression", type=float, default=0.10,
+                        help="allowed p50 slowdown vs --baseline before failing (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    # The proxy reads its configuration at import time
+    os.environ["MASKING_MODE"] = args.mode
+    if not args.cache:
+        os.environ["MASK_CACHE_MAX_BYTES"] = "0"
+    sys.path.insert(0, str(PROXY_DIR))
+    proxy = load_module("kong_masking_proxy", PROXY_DIR / "kong-masking-proxy.py")
+    logging.getLogger().setLevel(logging.WARNING)
+
+    from byte_masking import iter_json_matches, scan_json_bytes
+    from mapping_store import MappingStore, MaskingContext
+
+    generator = load_module("test_data_generator", GENERATOR_PATH).TestDataGenerator()
+    payloads = build_payloads(generator, args.cases, args.seed)
+
+    results = []
+    for case, request in payloads.items():
+        body = json.dumps(request).encode("utf-8")
+        content = request["messages"][0]["content"]
+        matches = sum(1 for _ in iter_json_matches(body, scan_json_bytes(body, proxy.default_engine)))
+
+        for target in args.targets:
+            if target == "mask_aws_resources":
+                durations, peak = measure(
+                    proxy.mask_aws_resources,
+                    lambda: (content, MaskingContext(MappingStore())),
+                    args.iterations, args.warmup
+                )
+                input_bytes = len(content.encode("utf-8"))
+                target_matches = len(proxy.default_engine.scan(content))
+            elif target == "mask_request_body":
+                durations, peak = measure(
+                    proxy.mask_request_body,
+                    lambda: (json.loads(body), MaskingContext(MappingStore())),
+                    args.iterations, args.warmup
+                )
+                input_bytes, target_matches = len(body), matches
+            else:
+                durations, peak = asyncio.run(measure_proxy(proxy, body, args.iterations, args.warmup))
+                input_bytes, target_matches = len(body), matches
+
+            result = {"case": case, "target": target}
+            result.update(summarize(durations, input_bytes, target_matches, peak))
+            results.append(result)
+            print(f"{case:>20} {target:>20}: p50 {result['latency_ms']['p50']:>9.3f}ms "
+                  f"p99 {result['latency_ms']['p99']:>9.3f}ms {result['throughput_mb_s']:>8} MB/s",
+                  file=sys.stderr)
+
+    regressions = compare(results, args.baseline, args.max_regression) if args.baseline else []
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "mode": args.mode,
+            "cache": args.cache,
+        },
+        "results": results,
+        "regressions": regressions,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if regressions:
+        print("❌ Regressions over " + f"{args.max_regression:.0%}:", file=sys.stderr)
+        for line in regressions:
+            print(f"   {line}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Admission control (admission.py)"""
+
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, client_key
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_per_client_limit_rejects_with_429():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=0, max_per_client=2)
+        releases = [await admission.acquire("a"), await admission.acquire("a")]
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire("a")
+        # Other clients are not affected
+        other = await admission.acquire("b")
+        releases[0]()
+        releases[0]()  # idempotent
+        again = await admission.acquire("a")
+        return rejected.value, admission.snapshot(), [releases[1], other, again]
+
+    rejected, stats, _ = run(scenario())
+    assert rejected.status == 429
+    assert 1 <= rejected.retry_after <= 60
+    assert stats['rejected_client_limit'] == 1
+    assert stats['admitted'] == 4
+
+
+def test_queue_is_served_in_arrival_order():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=1, max_per_client=0)
+        release = await admission.acquire("first")
+        order = []
+
+        async def waiter(name):
+            give_back = await admission.acquire(name)
+            order.append(name)
+            give_back()
+
+        tasks = [asyncio.create_task(waiter(name)) for name in ("second", "third")]
+        await asyncio.sleep(0)
+        queued = admission.snapshot()['queue_depth']
+        release()
+        await asyncio.gather(*tasks)
+        return order, queued, admission.snapshot()
+
+    order, queued, stats = run(scenario())
+    assert order == ["second", "third"]
+    assert queued == 2
+    assert stats['in_flight'] == 0 and stats['queue_depth'] == 0 and stats['clients'] == 0
+
+
+def test_full_queue_and_queue_timeout_reject_with_503():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=1, max_per_client=0, max_queue=1, queue_timeout=0.05)
+        release = await admission.acquire("a")
+        queued = asyncio.create_task(admission.acquire("b"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as full:
+            await admission.acquire("c")
+        with pytest.raises(AdmissionRejected) as timed_out:
+            await queued
+        release()
+        return full.value, timed_out.value, admission.snapshot()
+
+    full, timed_out, stats = run(scenario())
+    assert full.status == timed_out.status == 503
+    assert stats['rejected_queue_full'] == 1 and stats['rejected_queue_timeout'] == 1
+    assert stats['in_flight'] == 0 and stats['queue_depth'] == 0 and stats['clients'] == 0
+
+
+def test_cancelled_waiter_gives_its_slot_back():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=1, max_per_client=0)
+        release = await admission.acquire("a")
+        queued = asyncio.create_task(admission.acquire("b"))
+        await asyncio.sleep(0)
+        # The slot is handed over and the waiter cancelled in the same iteration
+        release()
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        final = await admission.acquire("c")
+        final()
+        return admission.snapshot()
+
+    stats = run(scenario())
+    assert stats['in_flight'] == 0 and stats['queue_depth'] == 0 and stats['clients'] == 0
+
+
+def test_client_key_hashes_api_keys():
+    key = client_key({'x-api-key': "sk-ant-secret"}, "10.0.0.1")
+    assert "secret" not in key and key == client_key({'x-api-key': "sk-ant-secret"}, "10.0.0.2")
+    # The configured header wins over the API key
+    assert (client_key({'x-tenant': "t1", 'x-api-key': "k"}, "ip", "x-tenant")
+            == client_key({'x-tenant': "t1"}, "ip", "x-tenant"))
+    assert client_key({}, "10.0.0.1") == "10.0.0.1"
@@ -0,0 +1,111 @@
+"""Batch masking and unmasking (batch_masking.py)"""
+
+import asyncio
+import json
+
+import httpx
+
+from batch_masking import MaskBatch, UnmaskBatch, iter_strings, map_strings
+from mapping_store import MappingStore, MaskingContext
+from masking_engine import default_engine
+
+DOCUMENT = {
+    'host': "i-0123456789abcdef0",
+    'nested': {'ips': ["10.0.0.5", 7, None, {'bucket': "prod-bucket-8299"}], 'ok': True},
+    'note': "account 123456789012",
+}
+
+
+def nest(value, depth):
+    for level in range(depth):
+        value = [value] if level % 2 else {'level': level, 'child': value}
+    return value
+
+
+def depth(value):
+    # Iterative: == and repr would recurse
+    levels = 0
+    while not isinstance(value, str):
+        value = value['child'] if isinstance(value, dict) else value[0]
+        levels += 1
+    return levels
+
+
+def round_trip(documents):
+    context = MaskingContext(MappingStore(), "session")
+    batch = MaskBatch(documents, default_engine)
+    masked = batch.apply(context.tokenize)
+    unmask = UnmaskBatch(masked)
+    return masked, unmask.apply({token: context.issued[token] for token in unmask.tokens
+                                 if token in context.issued})
+
+
+def test_document_order():
+    assert list(iter_strings(DOCUMENT)) == [
+        "i-0123456789abcdef0", "10.0.0.5", "prod-bucket-8299", "account 123456789012"]
+    seen = []
+    copy = map_strings(DOCUMENT, lambda text: seen.append(text) or text.upper())
+    assert seen == list(iter_strings(DOCUMENT))
+    assert copy['nested']['ips'] == ["10.0.0.5", 7, None, {'bucket': "PROD-BUCKET-8299"}]
+    assert DOCUMENT['host'] == "i-0123456789abcdef0"
+
+
+def test_round_trip():
+    masked, restored = round_trip([DOCUMENT, "ip 10.0.0.5", 42])
+    assert "i-0123456789abcdef0" not in str(masked)
+    assert masked[2] == 42
+    assert restored == [DOCUMENT, "ip 10.0.0.5", 42]
+
+
+def test_deep_nesting():
+    document = nest("on i-0123456789abcdef0", 50000)
+    masked, restored = round_trip([document])
+    assert list(iter_strings(masked)) == ["on EC2_INSTANCE_001"]
+    assert list(iter_strings(restored)) == ["on i-0123456789abcdef0"]
+    assert depth(masked[0]) == depth(restored[0]) == 50000
+
+
+def post_batch(proxy, path, content, content_type, chunk=7):
+    """POST a body to a batch endpoint in small chunks, as a slow client would send it"""
+    async def body():
+        for start in range(0, len(content), chunk):
+            yield content[start:start + chunk]
+
+    async def send():
+        transport = httpx.ASGITransport(app=proxy.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as client:
+            return await client.post(path, content=body(), headers={"content-type": content_type,
+                                                                     proxy.SESSION_HEADER: "batch"})
+    return asyncio.run(send())
+
+
+def test_ndjson_batches_stream_line_by_line(proxy, monkeypatch):
+    monkeypatch.setattr(proxy, "BATCH_SIZE", 2)
+    lines = [json.dumps({'host': f"i-0123456789abcdef{n}"}) for n in range(5)]
+    lines.insert(2, "{not json")
+    response = post_batch(proxy, "/v1/mask/batch", "\n".join(lines).encode(), "application/x-ndjson")
+    assert response.status_code == 200
+
+    masked = response.text.splitlines()
+    assert masked[2] == json.dumps({"error": "line 3 is not valid JSON"})
+    assert "i-0123456789abcdef" not in response.text
+
+    restored = post_batch(proxy, "/v1/unmask/batch", response.content, "application/x-ndjson")
+    documents = [json.loads(line) for line in restored.text.splitlines()]
+    assert documents[:2] + documents[3:] == [json.loads(line) for line in lines[:2] + lines[3:]]
+
+
+def test_batch_body_limit(proxy, monkeypatch):
+    monkeypatch.setattr(proxy, "BATCH_MAX_BYTES", 64)
+    text = b"account 123456789012\n" * 10
+    assert post_batch(proxy, "/v1/mask/batch", text, "text/plain").status_code == 413
+    assert proxy.admission.snapshot()["in_flight"] == 0
+
+
+def test_batch_endpoints_are_admission_controlled(proxy, monkeypatch):
+    monkeypatch.setattr(proxy, "admission", proxy.AdmissionController(max_in_flight=1, max_queue=0))
+    release = asyncio.run(proxy.admission.acquire("other"))
+    response = post_batch(proxy, "/v1/mask/batch", b"account 123456789012\n", "text/plain")
+    assert response.status_code == 503
+    assert response.json()["error"]["type"] == "overloaded_error"
+    release()
@@ -0,0 +1,60 @@
+"""Bulk scrubber chunking (bulk-scrubber.py)"""
+
+import importlib.util
+import io
+import sys
+from pathlib import Path
+
+import pytest
+
+from mapping_store import DEFAULT_SESSION, MappingStore, MaskingContext
+from masking_engine import MaskingEngine
+
+SCRUBBER_PATH = Path(__file__).resolve().parents[1] / "kong-masking-proxy" / "bulk-scrubber.py"
+spec = importlib.util.spec_from_file_location("bulk_scrubber", SCRUBBER_PATH)
+bulk_scrubber = sys.modules["bulk_scrubber"] = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bulk_scrubber)
+
+# Two lines apart, one value: only found when the file is scanned whole
+LOG = b"line\n" * 50 + b"instance i-0123\n4567 down\n" + b"line\n" * 50
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_unsplittable_engine_scans_across_lines(tmp_path, monkeypatch, workers):
+    engine = MaskingEngine({'ec2_instance': r'i-\d+\n\d+'}, splittable=False)
+    monkeypatch.setattr(bulk_scrubber, "default_engine", engine)
+    path = tmp_path / "app.log"
+    path.write_bytes(LOG)
+
+    out = io.BytesIO()
+    context = MaskingContext(MappingStore(), DEFAULT_SESSION)
+    stats = bulk_scrubber.scrub_file(str(path), out, context, workers, chunk_bytes=64)
+
+    assert stats['chunks'] == 1
+    assert out.getvalue() == LOG.replace(b"i-0123\n4567", b"EC2_INSTANCE_001")
+    assert context.issued == {'EC2_INSTANCE_001': "i-0123\n4567"}
+
+
+def test_unsplittable_engine_refuses_files_above_the_cap(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_scrubber, "default_engine", MaskingEngine({'x': r'x'}, splittable=False))
+    path = tmp_path / "app.log"
+    path.write_bytes(LOG)
+
+    with pytest.raises(bulk_scrubber.UnsplittableFileError):
+        bulk_scrubber.scrub_file(str(path), io.BytesIO(), MaskingContext(MappingStore(), DEFAULT_SESSION),
+                                 1, chunk_bytes=64, max_unsplit_bytes=len(LOG) - 1)
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_reverse_restores_tokens_glued_to_digits(tmp_path, workers):
+    text = "bucket prod-bucket-2024 on i-0123456789abcdef0\n" * 40
+    masked = tmp_path / "app.log.masked"
+    context = MaskingContext(MappingStore(), DEFAULT_SESSION)
+    with open(masked, 'wb') as out:
+        (tmp_path / "app.log").write_text(text)
+        bulk_scrubber.scrub_file(str(tmp_path / "app.log"), out, context, workers, chunk_bytes=256)
+    assert b"prod-bucket" not in masked.read_bytes()
+
+    out = io.BytesIO()
+    bulk_scrubber.scrub_file(str(masked), out, None, workers, chunk_bytes=256, unmask_map=context.issued)
+    assert out.getvalue().decode() == text
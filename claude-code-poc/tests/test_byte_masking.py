@@ -0,0 +1,88 @@
+"""Byte-mode request masking (byte_masking.py)"""
+
+import base64
+import json
+
+import pytest
+
+from byte_masking import InvalidRequestBody, apply_json_edits, scan_json_bytes
+from mapping_store import MappingStore, MaskingContext
+from masking_engine import default_engine
+from test_leaf_filter import REQUEST as LEAF_REQUEST
+from token_cipher import CipherTokenStore, TokenCipher, parse_keys
+from unmasking import Unmasker
+
+INSTANCE = "i-0123456789abcdef0"
+
+
+def mask_bytes(body):
+    context = MaskingContext(MappingStore(), "session")
+    scan = scan_json_bytes(body, default_engine)
+    return apply_json_edits(body, scan, context.tokenize), context
+
+
+def test_round_trip():
+    request = {
+        'model': 'claude-3-5-sonnet-20241022',
+        'max_tokens': 100,
+        'stream': False,
+        'temperature': 0.5,
+        'messages': [{'role': 'user', 'content': [
+            {'type': 'text', 'text': f"restart {INSTANCE} in account 123456789012"},
+            {'type': 'tool_result', 'tool_use_id': 'toolu_1', 'content': "ip 10.0.0.5\n\"quoted\""},
+        ]}],
+        'metadata': {'tags': [True, None, -1.5e3]},
+    }
+    body = json.dumps(request).encode('utf-8')
+    masked, context = mask_bytes(body)
+
+    assert INSTANCE.encode() not in masked
+    assert b'123456789012' not in masked
+    assert b'10.0.0.5' not in masked
+    assert json.loads(Unmasker(context.issued).unmask_bytes(masked)) == request
+
+
+@pytest.mark.parametrize("body", [
+    # unterminated string: the value would never be scanned
+    b'{"messages": [{"role": "user", "content": "' + INSTANCE.encode() + b' }',
+    # bare value outside any string
+    b'{"a": ' + INSTANCE.encode() + b'}',
+    b'{"a": "x", "b": 10.0.0.5}',
+    # single-quoted pseudo-JSON
+    b"{'a': '" + INSTANCE.encode() + b"'}",
+    b'{"a": "x"} ' + INSTANCE.encode(),
+])
+def test_rejects_what_it_cannot_tokenize(body):
+    with pytest.raises(ValueError):
+        scan_json_bytes(body, default_engine)
+
+
+def test_rejects_non_objects():
+    with pytest.raises(ValueError):
+        scan_json_bytes(b'["' + INSTANCE.encode() + b'"]', default_engine)
+
+
+def test_skips_the_same_fields_as_tree_mode(proxy):
+    # Cipher tokens do not depend on the order values are masked in
+    store = CipherTokenStore(TokenCipher(parse_keys("A:" + base64.b64encode(b'k' * 32).decode('ascii'))))
+    body = json.dumps(LEAF_REQUEST).encode('utf-8')
+
+    scan = scan_json_bytes(body, default_engine)
+    in_bytes = json.loads(apply_json_edits(body, scan, MaskingContext(store, "session").tokenize))
+    in_tree = proxy.mask_request_body(json.loads(body), MaskingContext(store, "session"))
+
+    assert in_bytes == in_tree
+    blocks = in_bytes['messages'][0]['content']
+    assert in_bytes['model'] == LEAF_REQUEST['model']
+    assert blocks[1]['source']['data'] == LEAF_REQUEST['messages'][0]['content'][1]['source']['data']
+    assert blocks[0]['text'] != LEAF_REQUEST['messages'][0]['content'][0]['text']
+
+
+@pytest.mark.parametrize("body", [
+    b'{"a": ["x"}',
+    b'{"a": "x"}}',
+    b'{"a": "x"} {"b": "' + INSTANCE.encode() + b'"}',
+])
+def test_rejects_unbalanced_structure(body):
+    with pytest.raises(InvalidRequestBody):
+        scan_json_bytes(body, default_engine)
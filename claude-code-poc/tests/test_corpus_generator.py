@@ -0,0 +1,54 @@
+"""Streamed stress corpora (nginx-kong-claude-enterprise/tests/test-data-generator.py)"""
+
+import importlib.util
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+from masking_engine import default_engine
+
+GENERATOR_PATH = (Path(__file__).resolve().parents[2] / "nginx-kong-claude-enterprise" / "tests"
+                  / "test-data-generator.py")
+if not GENERATOR_PATH.exists():
+    pytest.skip("test-data-generator.py not checked out", allow_module_level=True)
+
+spec = importlib.util.spec_from_file_location("test_data_generator", GENERATOR_PATH)
+test_data_generator = sys.modules["test_data_generator"] = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(test_data_generator)
+
+
+def test_seeded_shards_are_reproducible(tmp_path):
+    first = test_data_generator.generate_corpus(str(tmp_path / "a"), 64 * 1024, shards=2, seed=7,
+                                                record_bytes=2048)
+    second = test_data_generator.generate_corpus(str(tmp_path / "b"), 64 * 1024, shards=2, seed=7,
+                                                 record_bytes=2048)
+    for a, b in zip(first, second):
+        assert Path(a["path"]).read_bytes() == Path(b["path"]).read_bytes()
+    # Each shard has its own seed
+    assert Path(first[0]["path"]).read_bytes() != Path(first[1]["path"]).read_bytes()
+
+
+@pytest.mark.parametrize("fmt", ["ndjson", "json"])
+def test_corpus_size_format_and_density(tmp_path, fmt):
+    [shard] = test_data_generator.generate_corpus(str(tmp_path), 200 * 1024, seed=1, density=0.1,
+                                                  record_bytes=4096, fmt=fmt)
+    data = Path(shard["path"]).read_bytes()
+    assert len(data) == shard["bytes"]
+    assert 200 * 1024 <= len(data) < 200 * 1024 + 8192
+
+    text = data.decode()
+    requests = ([json.loads(line) for line in text.splitlines()] if fmt == "ndjson" else json.loads(text))
+    assert len(requests) == shard["records"]
+    content = requests[0]["messages"][0]["content"]
+    words = content.split(" ")
+    filler = set(test_data_generator.StreamingCorpusGenerator.FILLER_WORDS)
+    assert 0.08 < sum(word not in filler for word in words) / len(words) < 0.12
+    assert default_engine.scan(content)
+
+
+@pytest.mark.parametrize("text, size", [("2GB", 2 * 1024 ** 3), ("500mb", 500 * 1024 ** 2),
+                                        ("64k", 64 * 1024), ("1000", 1000), ("1.5KiB", 1536)])
+def test_parse_size(text, size):
+    assert test_data_generator.parse_size(text) == size
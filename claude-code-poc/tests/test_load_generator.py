@@ -0,0 +1,75 @@
+"""Load generator against the mock upstream, all in process (load-generator.py, test-http-proxy.py)"""
+
+import argparse
+import asyncio
+import importlib.util
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from conftest import PROXY_DIR
+
+TESTS_DIR = Path(__file__).resolve().parent
+
+
+def load(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = sys.modules[name] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+load_generator = load("load_generator", TESTS_DIR / "load-generator.py")
+mock_upstream = load("mock_upstream", PROXY_DIR / "test-http-proxy.py")
+
+needs_generator = pytest.mark.skipif(not load_generator.GENERATOR_PATH.exists(),
+                                     reason="test-data-generator.py not checked out")
+
+
+@needs_generator
+@pytest.mark.parametrize("rps", [0, 200])
+def test_load_through_the_proxy_and_mock_upstream(proxy, monkeypatch, rps):
+    def client(**kwargs):
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=proxy.app), **kwargs)
+
+    monkeypatch.setattr(load_generator, "httpx", SimpleNamespace(
+        AsyncClient=client, Limits=httpx.Limits, Timeout=httpx.Timeout, HTTPError=httpx.HTTPError))
+    monkeypatch.setitem(mock_upstream.MOCK_CONFIG, "response_words", 40)
+    args = argparse.Namespace(url="http://proxy", concurrency=4, rps=rps, duration=60, requests=12,
+                              sessions=3, timeout=30)
+    bodies = load_generator.build_requests(6, load_generator.DEFAULT_CASES, 0.5, 42)
+
+    async def run():
+        proxy.app.state.upstream = httpx.AsyncClient(transport=httpx.ASGITransport(app=mock_upstream.app))
+        try:
+            return await load_generator.run_load(args, bodies)
+        finally:
+            await proxy.app.state.upstream.aclose()
+
+    report = asyncio.run(run())
+    assert report["requests"] == 12
+    assert report["statuses"] == {"200": 12} and report["error_rate"] == 0.0
+    # The mock echoes every masked token it was sent; none may reach the client
+    assert report["responses_with_masked_tokens"] == 0
+    assert report["latency_ms"]["max"] >= report["latency_ms"]["p50"] > 0
+
+
+def test_report_counts_errors_and_leaks():
+    stats = load_generator.LoadStats()
+    stats.statuses.update({200: 3, 529: 1})
+    stats.errors["ConnectTimeout"] += 1
+    stats.latencies = [0.1, 0.2, 0.3, 0.4]
+    stats.leaked_tokens = 1
+    report = stats.report(elapsed=1.0)
+    assert report["requests"] == 5 and report["error_rate"] == 0.4
+    assert report["latency_ms"] == {"p50": 200.0, "p90": 400.0, "p99": 400.0, "max": 400.0}
+    assert report["ttfb_ms"] == {"p50": None, "p90": None, "p99": None}
+
+
+def test_mock_echoes_masked_tokens_only():
+    text = mock_upstream.build_response_text(b'{"content": "EC2_INSTANCE_001 and i-0123 and AWS_ACCOUNT_002"}')
+    assert "EC2_INSTANCE_001" in text and "AWS_ACCOUNT_002" in text
+    assert "i-0123" not in text
@@ -0,0 +1,73 @@
+"""Session-scoped mapping store (mapping_store.py)"""
+
+import asyncio
+from types import SimpleNamespace
+
+import mapping_store
+from mapping_store import ENTRY_OVERHEAD_BYTES, MappingStore, MaskingContext
+
+
+def test_same_value_same_token_within_a_session_only():
+    store = MappingStore()
+    first = store.get_or_create("a", 'ec2_instance', "i-0123456789abcdef0")
+    assert first == "EC2_INSTANCE_001"
+    assert store.get_or_create("a", 'ec2_instance', "i-0123456789abcdef0") == first
+    assert store.get_or_create("a", 'ec2_instance', "i-0fedcba9876543210") == "EC2_INSTANCE_002"
+    # Every session numbers its own tokens, and they map back to its own values
+    assert store.get_or_create("b", 'ec2_instance', "i-0fedcba9876543210") == "EC2_INSTANCE_001"
+    assert store.lookup("a", "EC2_INSTANCE_001") == "i-0123456789abcdef0"
+    assert store.lookup("b", "EC2_INSTANCE_001") == "i-0fedcba9876543210"
+    assert asyncio.run(store.resolve_tokens("a", ["EC2_INSTANCE_002", "EC2_INSTANCE_009"])) == {
+        "EC2_INSTANCE_002": "i-0fedcba9876543210"}
+
+
+def test_least_recently_used_entries_are_evicted():
+    store = MappingStore(max_entries=2)
+    store.get_or_create("s", 'private_ip', "10.0.0.1")
+    store.get_or_create("s", 'private_ip', "10.0.0.2")
+    store.get_or_create("s", 'private_ip', "10.0.0.1")   # now the most recent
+    store.get_or_create("s", 'private_ip', "10.0.0.3")
+    assert len(store) == 2
+    assert store.peek("s", "10.0.0.2") is None
+    assert store.peek("s", "10.0.0.1") == "PRIVATE_IP_001"
+    assert store.stats['evictions'] == 1
+
+
+def test_memory_ceiling():
+    store = MappingStore(max_bytes=3 * (ENTRY_OVERHEAD_BYTES + 30))
+    for number in range(10):
+        store.get_or_create("s", 'private_ip', f"10.0.0.{number}")
+    assert len(store) == 3
+    assert store.bytes_used <= store.max_bytes
+
+
+def test_expired_entries_get_a_new_token(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(mapping_store, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    store = MappingStore(ttl=10)
+    store.get_or_create("s", 'account_id', "123456789012")
+    now[0] += 5
+    # Use refreshes the TTL
+    assert store.peek("s", "123456789012") == "AWS_ACCOUNT_001"
+    now[0] += 9
+    assert store.get_or_create("s", 'account_id', "123456789012") == "AWS_ACCOUNT_001"
+    now[0] += 11
+    assert store.peek("s", "123456789012") is None
+    assert store.get_or_create("s", 'account_id', "999999999999") == "AWS_ACCOUNT_002"
+    assert store.stats['expirations'] == 1
+    assert store.lookup("s", "AWS_ACCOUNT_001") is None
+
+
+def test_restore_continues_the_numbering():
+    store = MappingStore()
+    store.restore("s", {"S3_BUCKET_004": "prod-bucket-2024"})
+    assert store.get_or_create("s", 's3_bucket', "prod-bucket-2024") == "S3_BUCKET_004"
+    assert store.get_or_create("s", 's3_bucket', "logs-bucket-2024") == "S3_BUCKET_005"
+
+
+def test_context_collects_the_requests_unmask_map():
+    store = MappingStore()
+    store.get_or_create("s", 'private_ip', "10.0.0.9")
+    context = MaskingContext(store, "s")
+    context.tokenize('private_ip', "10.0.0.5")
+    assert context.issued == {"PRIVATE_IP_002": "10.0.0.5"}
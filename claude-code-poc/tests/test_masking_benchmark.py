@@ -0,0 +1,56 @@
+"""Masking benchmark suite (masking-benchmark.py)"""
+
+import importlib.util
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+BENCHMARK_PATH = Path(__file__).resolve().parent / "masking-benchmark.py"
+spec = importlib.util.spec_from_file_location("masking_benchmark", BENCHMARK_PATH)
+masking_benchmark = sys.modules["masking_benchmark"] = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(masking_benchmark)
+
+pytestmark = pytest.mark.skipif(not masking_benchmark.GENERATOR_PATH.exists(),
+                                reason="test-data-generator.py not checked out")
+
+
+def bench(*args):
+    """One small run in a fresh interpreter (the proxy reads its settings at import)"""
+    return subprocess.run([sys.executable, str(BENCHMARK_PATH), "--iterations", "2", "--warmup", "0",
+                           "--cases", "boundary_values", *args],
+                          capture_output=True, text=True, timeout=120)
+
+
+def test_payloads_are_reproducible_per_case():
+    generator = masking_benchmark.load_module(
+        "test_data_generator", masking_benchmark.GENERATOR_PATH).TestDataGenerator()
+    both = masking_benchmark.build_payloads(generator, ["boundary_values", "unicode_content"], 7)
+    alone = masking_benchmark.build_payloads(generator, ["unicode_content"], 7)
+    assert json.dumps(both["unicode_content"]) == json.dumps(alone["unicode_content"])
+
+
+def test_report_and_regression_gate(tmp_path):
+    output = tmp_path / "bench.json"
+    run = bench("--output", str(output))
+    assert run.returncode == 0, run.stderr
+    report = json.loads(output.read_text())
+    assert {result["target"] for result in report["results"]} == set(masking_benchmark.TARGETS)
+    assert all(result["matches"] > 0 and result["iterations"] == 2 for result in report["results"])
+
+    # A baseline far faster than anything measurable is always a regression
+    for result in report["results"]:
+        result["latency_ms"]["p50"] = 1e-6
+    output.write_text(json.dumps(report))
+    run = bench("--baseline", str(output))
+    assert run.returncode == 1
+    assert "Regressions" in run.stderr
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert masking_benchmark.percentile(values, 50) == 50
+    assert masking_benchmark.percentile(values, 99) == 99
+    assert masking_benchmark.percentile([3], 99) == 3
@@ -0,0 +1,55 @@
+"""Incremental masking cache (masking_cache.py) on the tree-mode request walk"""
+
+import copy
+
+import pytest
+
+from leaf_filter import CONTENT_BLOCK, LeafStats
+from mapping_store import MappingStore, MaskingContext
+from masking_cache import MaskingCache
+from unmasking import Unmasker
+
+# Long enough to be cached; the id and name are schema fields of a content block
+BLOCK = {
+    'type': 'tool_use',
+    'id': 'i-0123456789abcdef0',
+    'name': 'describe',
+    'input': {'instance': 'i-0123456789abcdef0', 'note': 'x' * 300},
+}
+
+
+@pytest.fixture
+def cache(proxy, monkeypatch):
+    cache = MaskingCache(max_bytes=1024 * 1024, min_block_bytes=64)
+    monkeypatch.setattr(proxy, "masking_cache", cache)
+    return cache
+
+
+def mask(proxy, store, content, node=CONTENT_BLOCK):
+    context = MaskingContext(store, "session")
+    leaves = LeafStats()
+    return proxy.mask_message_content(copy.deepcopy(content), context, leaves, node), context, leaves
+
+
+def test_hits_count_cached_leaves(proxy, cache):
+    store = MappingStore()
+    first, context, leaves = mask(proxy, store, [BLOCK])
+    again, _, cached = mask(proxy, store, [BLOCK])
+
+    assert cache.stats['hits'] == 1
+    assert again == first
+    assert cached.cached == leaves.total > 0
+    assert cached.total == leaves.total
+    assert Unmasker(context.issued).unmask(str(first)) == str([BLOCK])
+
+
+def test_schema_node_is_part_of_the_key(proxy, cache):
+    # Under CONTENT_BLOCK the id is a schema field; in free-form JSON it is masked
+    store = MappingStore()
+    as_block, _, _ = mask(proxy, store, [BLOCK])
+    free_form, context, _ = mask(proxy, store, [BLOCK], node=None)
+
+    assert cache.stats['hits'] == 0
+    assert as_block[0]['id'] == 'i-0123456789abcdef0'
+    assert free_form[0]['id'] != 'i-0123456789abcdef0'
+    assert Unmasker(context.issued).unmask(free_form[0]['id']) == 'i-0123456789abcdef0'
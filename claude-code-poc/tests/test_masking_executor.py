@@ -0,0 +1,62 @@
+"""Size-aware masking execution (masking_executor.py)"""
+
+import asyncio
+import threading
+
+import pytest
+
+from masking_engine import default_engine
+from masking_executor import LoopLagMonitor, MaskingExecutor, split_windows
+
+TEXT = ("bucket prod-bucket-8299 on i-0123456789abcdef0, account 123456789012, "
+        "ip 10.0.0.5 and arn:aws:iam::123456789012:role/deploy\n") * 200
+
+
+@pytest.fixture
+def executor():
+    executor = MaskingExecutor(inline_max_bytes=100, thread_workers=2, scan_processes=2,
+                               chunk_min_chars=1000, window_chars=1000)
+    yield executor
+    executor.shutdown()
+
+
+def test_small_work_runs_inline_and_large_work_on_a_thread(executor):
+    async def scenario():
+        inline = await executor.run(10, threading.current_thread)
+        offloaded = await executor.run(1000, threading.current_thread)
+        return inline, offloaded
+
+    inline, offloaded = asyncio.run(scenario())
+    assert inline is threading.main_thread()
+    assert offloaded.name.startswith("masking")
+    assert executor.stats['inline'] == 1 and executor.stats['offloaded'] == 1
+
+
+@pytest.mark.parametrize("window_chars", [1, 50, 1000, 10 ** 6])
+def test_windows_cover_the_text_and_start_on_safe_splits(window_chars):
+    bounds = split_windows(TEXT, window_chars)
+    assert bounds[0][0] == 0 and bounds[-1][1] == len(TEXT)
+    assert all(end == start for (_, end), (start, _) in zip(bounds, bounds[1:]))
+    assert all(TEXT[start] in ' \n,;' for start, _ in bounds[1:])
+
+
+def test_parallel_scan_matches_a_whole_scan(executor):
+    assert executor.should_chunk(TEXT)
+    assert executor.parallel_scan(TEXT) == default_engine.scan(TEXT)
+    assert executor.stats['chunked_scans'] == 1
+
+
+def test_loop_lag_monitor_sees_a_blocked_loop():
+    async def scenario():
+        monitor = LoopLagMonitor(interval=0.01)
+        monitor.start()
+        await asyncio.sleep(0.02)
+        # Block the loop the way inline masking of a large body would
+        threading.Event().wait(0.1)
+        await asyncio.sleep(0.02)
+        await monitor.stop()
+        return monitor.snapshot()
+
+    stats = asyncio.run(scenario())
+    assert stats['samples'] >= 2
+    assert stats['lag_max_ms'] >= 50
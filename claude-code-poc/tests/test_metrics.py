@@ -0,0 +1,55 @@
+"""Prometheus exposition and the proxy's /metrics endpoint (metrics.py)"""
+
+import pytest
+
+from metrics import MetricsRegistry
+
+
+def test_exposition_text():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests", ("status",))
+    requests.labels("200").inc()
+    requests.labels("200").inc(2)
+    requests.labels('a"b\n').inc()
+    registry.gauge("queue_depth", "Queued", function=lambda: 7)
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.5, 0.1))
+    for value in (0.05, 0.2, 0.2, 3.0):
+        latency.observe(value)
+    registry.labeled_snapshot("hits_total", "Hits", "pattern", lambda: {'arn': 2})
+    registry.snapshot("store", "Store", lambda: {'entries': 4, 'type': "memory", 'ok': True})
+
+    assert registry.render().splitlines() == [
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total{status="200"} 3',
+        'requests_total{status="a\\"b\\n"} 1',
+        '# HELP queue_depth Queued',
+        '# TYPE queue_depth gauge',
+        'queue_depth 7',
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="0.5"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        'latency_seconds_sum 3.45',
+        'latency_seconds_count 4',
+        '# HELP hits_total Hits',
+        '# TYPE hits_total counter',
+        'hits_total{pattern="arn"} 2',
+        '# HELP store_entries Store (entries)',
+        '# TYPE store_entries gauge',
+        'store_entries 4',
+    ]
+
+
+def test_labels_must_match_the_declared_names():
+    counter = MetricsRegistry().counter("requests_total", "Requests", ("status", "mode"))
+    with pytest.raises(ValueError):
+        counter.labels("200")
+
+
+def test_metrics_endpoint(kong):
+    response = kong.call("GET", "/metrics")
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith("text/plain")
+    assert "# TYPE masking_proxy_request_seconds histogram" in response.text
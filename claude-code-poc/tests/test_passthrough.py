@@ -0,0 +1,49 @@
+"""Routes besides /v1/messages: count_tokens, models and the 404 catch-all (kong-masking-proxy.py)"""
+
+import gzip
+import json
+
+import httpx
+
+TEXT = "count i-0123456789abcdef0 please"
+
+
+async def streamed(content):
+    # As a real connection delivers it (bytes content counts as already read)
+    yield content
+
+
+def test_models_are_relayed_raw(kong):
+    models = json.dumps({'data': [{'id': 'claude'}]}).encode()
+    kong.handler = lambda request, body: httpx.Response(
+        200, content=streamed(gzip.compress(models)),
+        headers={'content-type': 'application/json', 'content-encoding': 'gzip', 'server': 'kong'})
+
+    response = kong.call("GET", "/v1/models?limit=5", headers={'x-api-key': 'key', 'connection': 'close'})
+
+    request, body = kong.requests[0]
+    assert request.url.path.endswith("/v1/models") and request.url.query == b"limit=5"
+    assert request.headers['x-api-key'] == 'key' and request.headers['host'] == 'api.anthropic.com'
+    assert body == b""
+    # Still encoded on the way through; only the client decodes it
+    assert response.headers['content-encoding'] == 'gzip'
+    assert 'server' not in response.headers
+    assert response.json() == {'data': [{'id': 'claude'}]}
+
+
+def test_count_tokens_is_masked(kong):
+    kong.handler = lambda request, body: httpx.Response(200, json={'input_tokens': 12})
+    response = kong.call("POST", "/v1/messages/count_tokens", json={
+        'model': 'claude', 'messages': [{'role': 'user', 'content': TEXT}],
+    })
+
+    request, body = kong.requests[0]
+    assert request.url.path.endswith("/v1/messages/count_tokens")
+    assert b"i-0123456789abcdef0" not in body and b"EC2_INSTANCE" in body
+    assert response.json() == {'input_tokens': 12}
+
+
+def test_unknown_routes_never_reach_kong(kong):
+    response = kong.call("POST", "/v1/complete", json={'prompt': TEXT})
+    assert response.status_code == 404
+    assert kong.requests == []
@@ -0,0 +1,96 @@
+"""Kong pattern registry (pattern_registry.py)"""
+
+import re
+import time
+
+import pytest
+
+import pattern_registry
+from masking_engine import AWS_PATTERNS, PATTERN_LITERALS, PATTERN_PRIORITY, PATTERN_TRIGGERS, MaskingEngine
+
+
+def test_shipped_artifact_matches_lua_sources():
+    # The container has only kong-patterns.json; refresh it with
+    # `python pattern_registry.py --write` when the plugin's patterns change
+    built = pattern_registry.build_registry()
+    shipped = pattern_registry.load_registry(plugin_dir=pattern_registry.PLUGIN_DIR / "missing")
+    assert shipped.source_hash == built.source_hash
+    assert shipped.entries == built.entries
+
+
+PROSE = ("Note: the feedback from the team is that our logs should stay in the cache "
+         "for 30 days. Version 2.1 shipped at 10:30 on Friday, see the design doc. ")
+
+
+@pytest.mark.parametrize("lua, regex", [
+    ("%d%a%w%x", "[0-9][A-Za-z][A-Za-z0-9][0-9A-Fa-f]"),
+    ("%S+", r"[^ \t\n\r\f\v]+"),
+    ("[%w_%-]+", r"[A-Za-z0-9_\-]+"),
+    ("[^/]+", "[^/]+"),
+    ("vpc%-", r"vpc\-"),
+    ("a%.b", r"a\.b"),
+    ("a.-b", "a(?s:.)*?b"),
+    ("%d-x", "[0-9]*?x"),
+    ("^arn:", "^arn:"),
+    ("id$", r"id\Z"),
+])
+def test_translates_lua_syntax(lua, regex):
+    assert pattern_registry.translate_lua_pattern(lua)[0] == regex
+
+
+def test_lua_semantics_are_kept():
+    # {8} is literal text in Lua, and `-` is lazy
+    assert re.fullmatch(pattern_registry.translate_lua_pattern("%x{8}")[0], "a{8}")
+    assert re.search(pattern_registry.translate_lua_pattern("<.->")[0], "<a><b>").group() == "<a>"
+
+
+@pytest.mark.parametrize("lua", ["%bxy", "%f[%w]a", "a()", "[a", "a%", "%1"])
+def test_unsupported_patterns_raise(lua):
+    with pytest.raises(pattern_registry.LuaPatternError):
+        pattern_registry.translate_lua_pattern(lua)
+
+
+def test_dead_patterns_are_left_out():
+    registry = pattern_registry.load_registry()
+    dead = {entry['name'] for entry in registry.entries if entry['dead']}
+    assert {'kms_key', 'route53_zone', 'cloudfront', 'api_gateway_id', 'elasticache'} <= dead
+    assert dead.isdisjoint(registry.patterns)
+
+
+@pytest.mark.parametrize("lua, accepted, rejected", [
+    ("[0-9]+%.[0-9]+%.[0-9]+%.[0-9]+", "ip 52.1.2.3", "version 2.1. Done"),
+    ("[0-9a-fA-F:]+:+[0-9a-fA-F:]+", "fe80::1", "Note: the"),
+    ("[a-z0-9][a-z0-9%-]*logs[a-z0-9%-]*", "app-logs", "the logs"),
+])
+def test_guards_hold_for_matches_only(lua, accepted, rejected):
+    guard = re.compile(pattern_registry.pattern_guard(lua))
+    regex = re.compile(pattern_registry.translate_lua_pattern(lua)[0])
+    assert regex.search(accepted) and guard.search(accepted)
+    assert not guard.search(rejected)
+
+
+def test_prefilter_cost_against_the_builtin_set():
+    registry = pattern_registry.load_registry()
+    kong = MaskingEngine(registry.patterns, registry.priority, registry.literals, registry.validators,
+                         splittable=False, triggers=PATTERN_TRIGGERS, guards=registry.guards)
+    builtin = MaskingEngine(AWS_PATTERNS, PATTERN_PRIORITY, PATTERN_LITERALS, triggers=PATTERN_TRIGGERS)
+    texts = [PROSE * repeat for repeat in (1, 3, 10)] * 100
+
+    assert not registry.literals.keys() & {'public_ip', 'ipv6', 'ec2_instance'}
+    assert all(len(literal) >= 3 for name, (literal,) in registry.literals.items() if name != 'rds_instance')
+    # Left: account_id (digits), ipv6 ("10:30") and rds_instance ("feedback",
+    # which the plugin masks too)
+    active = kong.active_patterns(PROSE)
+    assert {name for index, name in enumerate(kong.pattern_names) if active >> index & 1} == {
+        'account_id', 'ipv6', 'rds_instance'}
+
+    def cost(engine):
+        best = float('inf')
+        for _ in range(3):
+            started = time.perf_counter()
+            for text in texts:
+                engine.scan(text)
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    assert cost(kong) < 6 * cost(builtin)
@@ -0,0 +1,130 @@
+"""Redis mapping store (redis_mapping_store.py), against fakeredis"""
+
+import asyncio
+
+import pytest
+
+from mapping_store import MappingStore, MaskingContext
+from masking_engine import default_engine
+from redis_mapping_store import RedisMappingStore
+from unmasking import ANY_TOKEN, Unmasker
+
+fakeredis = pytest.importorskip("fakeredis")
+
+TEXT = "restart i-0123456789abcdef0 and i-0fedcba9876543210 in account 123456789012"
+OTHER = "then i-00000000000000001 too"
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def new_store(server):
+    return RedisMappingStore(fakeredis.FakeAsyncRedis(server=server), lease_size=10)
+
+
+async def mask(store, text):
+    context = MaskingContext(store, "session")
+    await store.prefetch(context.session, ((name, text[start:end])
+                                           for start, end, name in default_engine.scan(text)))
+    return default_engine.mask(text, context.tokenize), context
+
+
+def test_round_trip_across_workers():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        first, second = new_store(server), new_store(server)
+        masked, context = await mask(first, TEXT)
+        again, _ = await mask(second, TEXT)
+        found = await new_store(server).resolve_tokens("session", list(context.issued))
+        return masked, again, context, found
+
+    masked, again, context, found = run(scenario())
+    assert "0123456789abcdef0" not in masked
+    assert again == masked
+    assert Unmasker(context.issued).unmask(masked) == TEXT
+    assert found == context.issued
+
+
+def test_lost_race_keeps_the_winner_and_writes_no_forward_key():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        winner, loser = new_store(server), new_store(server)
+        winner_masked, _ = await mask(winner, TEXT)
+
+        # The loser's MGET ran before the winner's SET NX landed
+        real_mget = loser.redis.mget
+
+        async def stale_mget(keys):
+            return [None] * len(keys)
+
+        loser.redis.mget = stale_mget
+        loser_masked, context = await mask(loser, TEXT)
+        loser.redis.mget = real_mget
+        map_keys = await loser.redis.keys(loser.prefix + "map:*")
+        return winner_masked, loser_masked, context, map_keys
+
+    winner_masked, loser_masked, context, map_keys = run(scenario())
+    assert loser_masked == winner_masked
+    assert Unmasker(context.issued).unmask(loser_masked) == TEXT
+    # Three values, three forward keys: none for the loser's proposals
+    assert len(map_keys) == 3
+
+
+def test_fallback_tokens_cannot_collide_with_redis_tokens():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        store = new_store(server)
+        server.connected = False
+        offline, offline_context = await mask(store, TEXT)
+        server.connected = True
+        online, online_context = await mask(store, OTHER)
+        return offline, offline_context, online, online_context
+
+    offline, offline_context, online, online_context = run(scenario())
+    assert "i-0123456789abcdef0" not in offline
+    assert set(offline_context.issued).isdisjoint(online_context.issued)
+    # Local tokens still have the token shape the unmaskers look for
+    assert len(ANY_TOKEN.findall(offline)) == 3
+    issued = {**offline_context.issued, **online_context.issued}
+    assert Unmasker(issued).unmask(offline + " " + online) == TEXT + " " + OTHER
+
+
+def test_reused_token_replaces_the_older_value():
+    store = MappingStore()
+    store._insert("session", "first", "AWS_EC2_001", 0.0)
+    store._insert("session", "second", "AWS_EC2_001", 0.0)
+    assert store.lookup("session", "AWS_EC2_001") == "second"
+    assert store.peek("session", "first") is None
+    assert len(store) == 1
+
+
+def test_fallback_token_followed_by_digits_is_not_a_shared_token():
+    # A shared EC2_INSTANCE_001 glued to "8" must not read as a local token
+    local = {f"EC2_INSTANCE_L{number:03d}": f"local-{number}" for number in range(1, 20)}
+    unmasked = Unmasker({**local, "EC2_INSTANCE_001": "i-0123456789abcdef0"}).unmask("EC2_INSTANCE_0018")
+    assert unmasked == "i-0123456789abcdef08"
+    assert Unmasker(local).unmask("EC2_INSTANCE_L0018") == "local-18"
+
+
+def test_local_hits_refresh_the_redis_ttl_once_per_interval():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        store = new_store(server)
+        _, context = await mask(store, TEXT)
+        keys = await store.redis.keys(store.prefix + "map:*") + await store.redis.keys(store.prefix + "rev:*")
+        for key in keys:
+            await store.redis.expire(key, 60)
+
+        await mask(store, TEXT)
+        ttls = [await store.redis.ttl(key) for key in keys]
+        round_trips = store.stats['round_trips']
+        await mask(store, TEXT)
+        return len(context.issued), keys, ttls, round_trips, store
+
+    issued, keys, ttls, round_trips, store = run(scenario())
+    assert len(keys) == 2 * issued
+    assert all(ttl > 60 for ttl in ttls)
+    assert store.stats['ttl_refreshes'] == issued
+    # Within the interval, cached values cost no round trip at all
+    assert store.stats['round_trips'] == round_trips
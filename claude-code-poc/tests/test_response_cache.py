@@ -0,0 +1,159 @@
+"""Request coalescing and response cache (response_cache.py)"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import response_cache
+from response_cache import ENTRY_OVERHEAD_BYTES, ResponseCache, UpstreamResult
+
+HEADERS = {'x-api-key': "key", 'anthropic-version': "2023-06-01"}
+OK = UpstreamResult(200, {'content-type': "application/json"}, b'{"content":[]}')
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class Upstream:
+    """Counts calls; each call waits until released"""
+
+    def __init__(self, result=OK):
+        self.result = result
+        self.calls = 0
+        self.release = None
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def test_key_covers_body_path_and_key_headers():
+    cache = ResponseCache()
+    key = cache.key(b'{}', HEADERS, "/v1/messages")
+    assert key == cache.key(b'{}', {**HEADERS, 'user-agent': "other"}, "/v1/messages")
+    assert key != cache.key(b'{ }', HEADERS, "/v1/messages")
+    assert key != cache.key(b'{}', HEADERS, "/v1/messages/count_tokens")
+    assert key != cache.key(b'{}', {**HEADERS, 'x-api-key': "other"}, "/v1/messages")
+
+
+def test_identical_requests_share_one_upstream_call():
+    async def scenario():
+        cache = ResponseCache(max_bytes=0)
+        upstream = Upstream()
+        upstream.release = asyncio.Event()
+        key = cache.key(b'{}', HEADERS)
+        tasks = [asyncio.create_task(cache.fetch(key, 2, 0.0, upstream)) for _ in range(3)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return await asyncio.gather(*tasks), upstream.calls, cache.snapshot()
+
+    results, calls, stats = run(scenario())
+    assert calls == 1
+    assert sorted(source for _, source in results) == ["coalesced", "coalesced", "upstream"]
+    assert all(result is OK for result, _ in results)
+    assert stats['in_flight'] == 0 and stats['entries'] == 0
+    assert stats['bytes_saved'] == 2 * (2 + len(OK.content))
+
+
+def test_followers_see_the_leaders_error_and_the_next_request_retries():
+    async def scenario():
+        cache = ResponseCache(max_bytes=0)
+        upstream = Upstream(ConnectionError("upstream down"))
+        upstream.release = asyncio.Event()
+        key = cache.key(b'{}', HEADERS)
+        tasks = [asyncio.create_task(cache.fetch(key, 2, 0.0, upstream)) for _ in range(2)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        errors = await asyncio.gather(*tasks, return_exceptions=True)
+        upstream.result = OK
+        result, source = await cache.fetch(key, 2, 0.0, upstream)
+        return errors, result, source, upstream.calls
+
+    errors, result, source, calls = run(scenario())
+    assert all(isinstance(error, ConnectionError) for error in errors)
+    assert (result, source, calls) == (OK, "upstream", 2)
+
+
+def test_cancelled_follower_does_not_cancel_the_shared_call():
+    async def scenario():
+        cache = ResponseCache(max_bytes=0)
+        upstream = Upstream()
+        upstream.release = asyncio.Event()
+        key = cache.key(b'{}', HEADERS)
+        leader = asyncio.create_task(cache.fetch(key, 2, 0.0, upstream))
+        follower = asyncio.create_task(cache.fetch(key, 2, 0.0, upstream))
+        await asyncio.sleep(0)
+        follower.cancel()
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return await leader, follower.cancelled()
+
+    (result, source), cancelled = run(scenario())
+    assert cancelled and result is OK and source == "upstream"
+
+
+def test_cache_hits_expiry_and_non_200_responses(monkeypatch):
+    async def scenario():
+        cache = ResponseCache()
+        upstream = Upstream()
+        upstream.release = asyncio.Event()
+        upstream.release.set()
+        key = cache.key(b'{}', HEADERS)
+        sources = [(await cache.fetch(key, 2, 30.0, upstream))[1] for _ in range(2)]
+
+        # Errors are never cached
+        error_key = cache.key(b'{"bad":1}', HEADERS)
+        upstream.result = UpstreamResult(529, {}, b'{"type":"error"}')
+        sources += [(await cache.fetch(error_key, 2, 30.0, upstream))[1] for _ in range(2)]
+
+        now = time.monotonic()
+        # Only the cache's clock moves on, not the event loop's
+        monkeypatch.setattr(response_cache, "time", SimpleNamespace(monotonic=lambda: now + 31))
+        upstream.result = OK
+        sources.append((await cache.fetch(key, 2, 30.0, upstream))[1])
+        return sources, cache.snapshot()
+
+    sources, stats = run(scenario())
+    assert sources == ["upstream", "hit", "upstream", "upstream", "upstream"]
+    assert stats['hits'] == 1 and stats['expired'] == 1 and stats['stores'] == 2
+
+
+def test_cache_is_bounded_by_bytes_in_lru_order():
+    async def scenario():
+        size = len(OK.content) + ENTRY_OVERHEAD_BYTES
+        cache = ResponseCache(coalesce=False, max_bytes=2 * size)
+        upstream = Upstream()
+        upstream.release = asyncio.Event()
+        upstream.release.set()
+        first, second, third = (cache.key(body, HEADERS) for body in (b'1', b'2', b'3'))
+        await cache.fetch(first, 1, 30.0, upstream)
+        await cache.fetch(second, 1, 30.0, upstream)
+        await cache.fetch(first, 1, 30.0, upstream)   # first is now the most recent
+        await cache.fetch(third, 1, 30.0, upstream)   # evicts second
+        sources = [(await cache.fetch(key, 1, 30.0, upstream))[1] for key in (first, second)]
+        return sources, cache.snapshot(), size
+
+    sources, stats, size = run(scenario())
+    assert sources == ["hit", "upstream"]
+    assert stats['evictions'] >= 1 and stats['bytes_used'] <= 2 * size
+
+
+@pytest.mark.parametrize("header, temperature, ttl", [
+    (None, 0, 0.0),
+    ("true", 0, 30.0),
+    ("1", 0.0, 30.0),
+    ("10", 0, 10.0),
+    ("9999", 0, 300.0),
+    ("soon", 0, 0.0),
+    ("true", 0.7, 0.0),
+    ("true", None, 0.0),
+])
+def test_cache_ttl(header, temperature, ttl):
+    assert ResponseCache().cache_ttl(header, temperature) == ttl
+    assert ResponseCache(max_bytes=0).cache_ttl(header, temperature) == 0.0
@@ -0,0 +1,64 @@
+"""Streaming /v1/messages relay through a mocked Kong (kong-masking-proxy.py)"""
+
+import json
+
+import httpx
+
+TEXT = "restart i-0123456789abcdef0 in account 123456789012 behind 10.0.0.5"
+
+
+def sse_response(text, chunk_size):
+    """Kong answering with text echoed in small SSE events, cut into small reads"""
+    events = []
+    for start in range(0, len(text), 3):
+        payload = {'type': 'content_block_delta', 'index': 0,
+                   'delta': {'type': 'text_delta', 'text': text[start:start + 3]}}
+        events.append(f"event: content_block_delta\ndata: {json.dumps(payload)}\n\n")
+    events.append('event: message_stop\ndata: {"type":"message_stop"}\n\n')
+    raw = ''.join(events).encode()
+
+    async def chunks():
+        for start in range(0, len(raw), chunk_size):
+            yield raw[start:start + chunk_size]
+
+    return httpx.Response(200, headers={'content-type': 'text/event-stream', 'request-id': 'req_1'},
+                          content=chunks())
+
+
+def streamed_text(raw):
+    text = []
+    for line in raw.decode().splitlines():
+        if line.startswith('data:'):
+            payload = json.loads(line[5:])
+            if payload['type'] == 'content_block_delta':
+                text.append(payload['delta']['text'])
+    return ''.join(text)
+
+
+def test_stream_is_masked_upstream_and_unmasked_back(kong):
+    def echo(request, body):
+        return sse_response(json.loads(body)['messages'][0]['content'], chunk_size=5)
+
+    kong.handler = echo
+    response = kong.call("POST", "/v1/messages", json={
+        'model': 'claude', 'stream': True, 'max_tokens': 10,
+        'messages': [{'role': 'user', 'content': TEXT}],
+    })
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/event-stream')
+    assert response.headers['request-id'] == 'req_1'
+    sent = kong.requests[0][1].decode()
+    for value in ("i-0123456789abcdef0", "123456789012", "10.0.0.5"):
+        assert value not in sent
+    assert streamed_text(response.content) == TEXT
+
+
+def test_upstream_errors_are_relayed_as_is(kong):
+    kong.handler = lambda request, body: httpx.Response(
+        529, json={'type': 'error', 'error': {'type': 'overloaded_error', 'message': 'busy'}})
+    response = kong.call("POST", "/v1/messages", json={
+        'model': 'claude', 'stream': True, 'messages': [{'role': 'user', 'content': TEXT}],
+    })
+    assert response.status_code == 529
+    assert response.json()['error']['type'] == 'overloaded_error'
@@ -0,0 +1,88 @@
+"""Queued, screened structured logging (structured_logging.py)"""
+
+import io
+import json
+import logging
+import sys
+import time
+
+import pytest
+
+from structured_logging import (MAX_FIELD_CHARS, JsonFormatter, LogSampler, NonBlockingQueueHandler,
+                                SafeFormatter, redact_headers, setup_logging)
+
+
+def record(msg, *args, exc_info=None, **extra):
+    entry = logging.LogRecord("proxy", logging.INFO, __file__, 1, msg, args, exc_info)
+    entry.__dict__.update(extra)
+    return entry
+
+
+def test_json_lines_carry_extra_fields():
+    line = json.loads(JsonFormatter().format(record("done %d", 200, event="request", status=200)))
+    assert line["msg"] == "done 200" and line["level"] == "INFO" and line["logger"] == "proxy"
+    assert (line["event"], line["status"]) == ("request", 200)
+
+
+def test_bodies_and_header_maps_never_reach_a_line():
+    body = b'{"content": "i-0123456789abcdef0"}'
+    headers = {'x-api-key': "sk-ant-secret", 'content-type': "application/json"}
+    for formatter in (JsonFormatter(), SafeFormatter("%(message)s")):
+        text = formatter.format(record("body %s headers %s", body, headers, payload={'k': body}))
+        assert "i-0123" not in text and "sk-ant" not in text
+        assert f"<bytes len={len(body)}>" in text and "<dict len=2>" in text
+
+    text = SafeFormatter("%(message)s").format(record("headers %s", redact_headers(headers)))
+    assert "sk-ant" not in text and "<redacted>" in text and "application/json" in text
+
+
+def test_long_values_are_capped():
+    line = json.loads(JsonFormatter().format(record("%s", "x" * 1000, detail="y" * 1000)))
+    assert len(line["msg"]) == MAX_FIELD_CHARS + 1
+    assert len(line["detail"]) == MAX_FIELD_CHARS + 1
+
+
+def test_tracebacks_stay_inside_the_json_object():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        text = JsonFormatter().format(record("failed", exc_info=sys.exc_info()))
+    assert "\n" not in text
+    assert "ValueError: boom" in json.loads(text)["exc"]
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = NonBlockingQueueHandler(maxsize=2)
+    entries = [record("n %d", n) for n in range(5)]
+    for entry in entries:
+        handler.handle(entry)
+    assert handler.dropped == 3
+    # Not formatted on the caller's thread
+    queued = handler.queue.get_nowait()
+    assert queued.msg == "n %d" and queued.args == (0,)
+
+
+@pytest.mark.parametrize("rate, expected", [(0.0, 0), (1.0, 1000), (7.0, 1000), (-1.0, 0)])
+def test_sampler_bounds(rate, expected):
+    sampler = LogSampler(rate)
+    assert sum(sampler.sample() for _ in range(1000)) == expected
+
+
+def test_setup_logging_writes_through_the_background_thread():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    out = io.StringIO()
+    try:
+        setup_logging("INFO", "json", stream=out)
+        logging.getLogger("uvicorn.access").info("GET / %d", 200)
+        deadline = time.monotonic() + 5
+        while not out.getvalue() and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        for handler in handlers:
+            root.addHandler(handler)
+        root.setLevel(level)
+    line = json.loads(out.getvalue().splitlines()[0])
+    assert (line["logger"], line["msg"]) == ("uvicorn.access", "GET / 200")
@@ -0,0 +1,101 @@
+"""Stateless cipher tokens (token_cipher.py) through masking and unmasking"""
+
+import asyncio
+import base64
+
+import pytest
+
+from batch_masking import UnmaskBatch
+from mapping_store import MaskingContext
+from masking_engine import default_engine
+from test_leaf_filter import REQUEST as LEAF_REQUEST
+from token_cipher import CipherTokenStore, TokenCipher, TokenKeyError, parse_keys
+from unmasking import ANY_TOKEN, Unmasker
+
+TEXT = ("bucket prod-bucket-8299 on i-0123456789abcdef0, "
+        "account 123456789012, ip 10.0.0.5 and prod-bucket-2024")
+KEY_A = base64.b64encode(b'a' * 32).decode('ascii')
+KEY_B = base64.b64encode(b'b' * 32).decode('ascii')
+
+
+def cipher(spec=f"A:{KEY_A}", active=None):
+    return TokenCipher(parse_keys(spec), active)
+
+
+def mask(store, text=TEXT):
+    context = MaskingContext(store, "session")
+    return default_engine.mask(text, context.tokenize), context
+
+
+def test_round_trip():
+    store = CipherTokenStore(cipher())
+    masked, context = mask(store)
+    assert "i-0123456789abcdef0" not in masked
+    # prod-bucket- twice, one token; its second use runs into "2024"
+    assert len(ANY_TOKEN.findall(masked)) == 5
+    assert len(context.issued) == 4
+    assert Unmasker(context.issued).unmask(masked) == TEXT
+    # Another replica with the same keys needs no mappings
+    other = CipherTokenStore(cipher())
+    found = asyncio.run(other.resolve_tokens("session", UnmaskBatch([masked]).tokens))
+    assert UnmaskBatch([masked]).apply(found) == [TEXT]
+
+
+def test_equal_values_get_equal_tokens():
+    first, _ = mask(CipherTokenStore(cipher()))
+    second, _ = mask(CipherTokenStore(cipher()))
+    assert first == second
+
+
+@pytest.mark.parametrize("tail", ["7", "2024", "ABC", "Q2Z7", "_x"])
+def test_tokens_followed_by_token_characters(tail):
+    store = CipherTokenStore(cipher())
+    token = store.get_or_create("session", 'ec2_instance', "i-0123456789abcdef0")
+    text = f"id {token}{tail} done"
+    assert Unmasker({token: "i-0123456789abcdef0"}).unmask(text) == f"id i-0123456789abcdef0{tail} done"
+    batch = UnmaskBatch([text])
+    found = asyncio.run(store.resolve_tokens("session", batch.tokens))
+    assert batch.apply(found) == [f"id i-0123456789abcdef0{tail} done"]
+
+
+def test_key_rotation():
+    old = cipher(f"A:{KEY_A}")
+    rotated = cipher(f"A:{KEY_A},B:{KEY_B}", active="B")
+    token = old.encrypt('ec2_instance', "i-0123456789abcdef0")
+    new_token = rotated.encrypt('ec2_instance', "i-0123456789abcdef0")
+
+    assert new_token != token
+    assert new_token.startswith("EC2_INSTANCE_B")
+    assert rotated.decrypt(token) == rotated.decrypt(new_token) == "i-0123456789abcdef0"
+    # Retired keys stop decrypting
+    assert cipher(f"B:{KEY_B}").decrypt(token) is None
+
+
+def test_altered_tokens_do_not_decrypt():
+    c = cipher()
+    token = c.encrypt('ec2_instance', "i-0123456789abcdef0")
+    prefix, _, body = token.rpartition('_')
+    flipped = body[:-1] + ('A' if body[-1] != 'A' else 'B')
+
+    assert c.decrypt(f"{prefix}_{flipped}") is None
+    assert c.decrypt(token[:-1]) is None
+    assert c.decrypt("S3_BUCKET_" + body) is None
+    assert cipher(f"A:{KEY_B}").decrypt(token) is None
+
+
+@pytest.mark.parametrize("spec", ["", "AB:" + KEY_A, "A:not-base64!", "A:" + base64.b64encode(b'short').decode()])
+def test_bad_keys(spec):
+    with pytest.raises(TokenKeyError):
+        cipher(spec)
+
+
+def test_tree_walk_is_served_by_the_prefetch(proxy):
+    store = CipherTokenStore(cipher())
+    assert store.batch_prefetch
+    asyncio.run(store.prefetch("session", proxy.leaf_matches(LEAF_REQUEST)))
+    encrypted = store.stats['encrypted']
+    context = MaskingContext(store, "session")
+    proxy.mask_request_body(LEAF_REQUEST, context)
+
+    assert store.stats['encrypted'] == encrypted == len(context.issued)
+    assert store.stats['misses'] == 0
@@ -0,0 +1,94 @@
+"""Round trips through the response unmasking paths (unmasking.py)"""
+
+import json
+import re
+
+import pytest
+
+from batch_masking import UnmaskBatch
+from mapping_store import MappingStore, MaskingContext
+from masking_engine import default_engine
+from unmasking import SSEUnmasker, Unmasker, restore_tokens
+
+TEXT = ("bucket prod-bucket-8299 on i-0123456789abcdef0, "
+        "account 123456789012, ip 10.0.0.5 and prod-bucket-2024")
+
+
+def mask(text, store=None):
+    context = MaskingContext(store or MappingStore(), "session")
+    return default_engine.mask(text, context.tokenize), context
+
+
+def sse_events(text, size, newline='\n'):
+    events = []
+    for start in range(0, len(text), size):
+        payload = {'type': 'content_block_delta', 'index': 0,
+                   'delta': {'type': 'text_delta', 'text': text[start:start + size]}}
+        events.append(f"event: content_block_delta\ndata: {json.dumps(payload)}\n\n")
+    events.append('event: content_block_stop\ndata: {"type":"content_block_stop","index":0}\n\n')
+    return ''.join(events).replace('\n', newline).encode('utf-8')
+
+
+def sse_text(raw):
+    text = []
+    for line in re.split(r'\r\n|\r|\n', raw.decode('utf-8')):
+        if line.startswith('data:'):
+            payload = json.loads(line[5:])
+            if payload['type'] == 'content_block_delta':
+                text.append(payload['delta']['text'])
+    return ''.join(text)
+
+
+def test_token_followed_by_digits_is_restored():
+    masked, context = mask(TEXT)
+    assert 'prod-bucket' not in masked
+    assert Unmasker(context.issued).unmask(masked) == TEXT
+
+
+def test_buffered_json_body_round_trip():
+    masked, context = mask(TEXT)
+    body = json.dumps({'content': [{'type': 'text', 'text': masked}]}).encode('utf-8')
+    restored = json.loads(Unmasker(context.issued).unmask_bytes(body))
+    assert restored['content'][0]['text'] == TEXT
+
+
+@pytest.mark.parametrize("delta_size", [1, 2, 3, 5, 13, 1000])
+@pytest.mark.parametrize("chunk_size", [1, 7, 64])
+def test_sse_round_trip_across_chunk_boundaries(delta_size, chunk_size):
+    masked, context = mask(TEXT)
+    raw = sse_events(masked, delta_size)
+    unmasker = SSEUnmasker(Unmasker(context.issued))
+    out = b''.join(unmasker.feed(raw[start:start + chunk_size])
+                   for start in range(0, len(raw), chunk_size))
+    out += unmasker.flush()
+    assert sse_text(out) == TEXT
+
+
+@pytest.mark.parametrize("newline", ['\r\n', '\r'])
+def test_sse_crlf_and_cr_framing(newline):
+    masked, context = mask(TEXT)
+    raw = sse_events(masked, 3, newline)
+    unmasker = SSEUnmasker(Unmasker(context.issued))
+    half = len(raw) // 2
+    first = unmasker.feed(raw[:half])
+    # Events are relayed as they complete, not held until the stream ends
+    assert len(first) > half // 2
+    out = first + unmasker.feed(raw[half:]) + unmasker.flush()
+    assert sse_text(out) == TEXT
+    assert '\n\n' not in out.decode('utf-8').replace(newline + newline, '')
+
+
+def test_buffered_and_batch_paths_agree():
+    store = MappingStore()
+    masked, context = mask(TEXT, store)
+    batch = UnmaskBatch([masked])
+    originals = {token: context.issued[token] for token in batch.tokens if token in context.issued}
+    assert batch.apply(originals) == [Unmasker(context.issued).unmask(masked)] == [TEXT]
+
+
+def test_tokens_of_other_requests_stay_masked():
+    masked, context = mask(TEXT)
+    other = {token: original for token, original in context.issued.items() if 'EC2' not in token}
+    restored = Unmasker(other).unmask(masked)
+    assert 'EC2_INSTANCE_001' in restored
+    assert restore_tokens(masked, {}.get) == masked
@@ -0,0 +1,62 @@
+"""Shared Kong client: headers, pool statistics and settings (upstream_client.py)"""
+
+import asyncio
+
+import httpx
+
+from upstream_client import PoolMonitor, create_upstream_client, forwardable_headers, relayed_headers
+
+UPSTREAM = httpx.Headers({
+    'content-type': 'application/json',
+    'date': 'Sat, 17 Oct 2026 01:00:00 GMT',
+    'server': 'kong/3.4',
+    'connection': 'keep-alive, x-hop',
+    'x-hop': '1',
+    'transfer-encoding': 'chunked',
+    'request-id': 'req_1',
+})
+
+
+def test_forwardable_headers_drop_hop_by_hop():
+    assert forwardable_headers(UPSTREAM, drop=('request-id',)) == {
+        'content-type': 'application/json',
+        'date': 'Sat, 17 Oct 2026 01:00:00 GMT',
+        'server': 'kong/3.4',
+    }
+
+
+def test_relayed_headers_leave_date_and_server_to_our_server():
+    assert relayed_headers(UPSTREAM, drop=('content-type',)) == {'request-id': 'req_1'}
+
+
+def test_pool_monitor_times_the_wait_for_a_connection():
+    phases = []
+    monitor = PoolMonitor(on_phase=lambda phase, seconds: phases.append(phase))
+
+    async def request(events):
+        monitor.request_started()
+        trace = monitor.extensions()["trace"]
+        for event in events:
+            await trace(event, {})
+        monitor.request_finished()
+
+    asyncio.run(request(["connection.connect_tcp.started", "connection.start_tls.started",
+                         "http11.send_request_headers.started", "http11.receive_response_body.started"]))
+    # Reused connection: no connect phase
+    asyncio.run(request(["http11.send_request_headers.started"]))
+
+    assert phases == ["pool_wait", "upstream_connect", "pool_wait"]
+    stats = monitor.snapshot(httpx.AsyncClient())
+    assert (stats["in_flight"], stats["requests"], stats["new_connections"]) == (0, 2, 1)
+    assert stats["pool_wait_max_ms"] >= stats["pool_wait_avg_ms"] >= 0
+
+
+def test_client_settings_from_the_environment(monkeypatch):
+    monkeypatch.setenv("UPSTREAM_MAX_CONNECTIONS", "7")
+    monkeypatch.setenv("UPSTREAM_READ_TIMEOUT", "12.5")
+    client = create_upstream_client()
+    try:
+        assert client.timeout.read == 12.5
+        assert client._transport._pool._max_connections == 7
+    finally:
+        asyncio.run(client.aclose())
@@ -0,0 +1,125 @@
+"""Stats shared between launcher workers (worker_stats.py, proxy-launcher.py) and their merge (metrics.py)"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+import worker_stats
+from metrics import MetricsRegistry, merge_stats
+from worker_stats import SharedStats, WorkerSlot
+
+LAUNCHER_PATH = Path(__file__).resolve().parents[1] / "kong-masking-proxy" / "proxy-launcher.py"
+spec = importlib.util.spec_from_file_location("proxy_launcher", LAUNCHER_PATH)
+proxy_launcher = sys.modules["proxy_launcher"] = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(proxy_launcher)
+
+
+@pytest.fixture
+def stats():
+    stats = SharedStats.create(slots=3, slot_bytes=4096)
+    yield stats
+    stats.close(unlink=True)
+
+
+def sequence(stats, slot):
+    return worker_stats._HEADER.unpack_from(stats.shm.buf, slot * stats.slot_bytes)[0]
+
+
+def test_publish_read_and_clear(stats):
+    assert stats.read(0) is None
+    assert stats.publish(0, {'requests': 1})
+    assert stats.publish(0, {'requests': 2})
+    assert stats.read(0) == {'requests': 2}
+    # Even, two steps per write
+    assert sequence(stats, 0) == 4
+
+    stats.clear(0)
+    assert stats.read(0) is None
+    assert sequence(stats, 0) % 2 == 0
+
+
+def test_reader_never_returns_a_slot_being_written(stats):
+    stats.publish(1, {'requests': 1})
+    # A writer stopped half-way: odd sequence
+    worker_stats._HEADER.pack_into(stats.shm.buf, stats.slot_bytes, sequence(stats, 1) + 1, 0)
+    assert stats.read(1) is None
+    # The next publish completes the slot again
+    assert stats.publish(1, {'requests': 2})
+    assert stats.read(1) == {'requests': 2}
+
+
+def test_oversized_snapshot_keeps_the_previous_one(stats):
+    stats.publish(2, {'requests': 1})
+    assert not stats.publish(2, {'blob': 'x' * stats.slot_bytes})
+    assert stats.read(2) == {'requests': 1}
+
+
+def test_peers_are_read_across_processes(stats):
+    pid = os.fork()
+    if pid == 0:
+        code = 0 if WorkerSlot(stats, 1).publish({'requests': 5}, {}) else 1
+        os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+    me = WorkerSlot(stats, 0)
+    me.publish({'requests': 1}, {})
+    assert [peer['health'] for peer in me.peers()] == [{'requests': 5}]
+    assert me.peers()[0]['pid'] == pid
+
+
+def test_merge_stats():
+    merged = merge_stats([
+        {'requests': 2, 'wait_max_ms': 5.0, 'hit_ratio': 0.5, 'mode': "tree", 'patterns': 40,
+         'redis': True, 'store': {'entries': 3, 'avg_ms': 1.0}},
+        {'requests': 3, 'wait_max_ms': 9.0, 'hit_ratio': 1.0, 'mode': "tree", 'patterns': 40,
+         'redis': True, 'store': {'entries': 4, 'avg_ms': 3.0}, 'only_here': 1},
+    ])
+    assert merged == {'requests': 5, 'wait_max_ms': 9.0, 'hit_ratio': 0.75, 'mode': "tree", 'patterns': 40,
+                      'redis': True, 'store': {'entries': 7, 'avg_ms': 2.0}, 'only_here': 1}
+
+
+def test_metrics_render_instance_totals():
+    def worker(requests, latency):
+        registry = MetricsRegistry()
+        registry.counter("requests_total", "Requests", ("status",)).labels("200").inc(requests)
+        registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0)).observe(latency)
+        registry.snapshot("store", "Store stats", lambda: {'entries': requests, 'mode': "local"})
+        return registry
+
+    text = worker(2, 0.05).render(peers=[worker(3, 0.5).export()])
+    assert 'requests_total{status="200"} 5' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1.0"} 2' in text
+    assert 'latency_seconds_count 2' in text
+    assert 'store_entries 5' in text
+
+
+def test_launcher_frees_crashed_workers_slots_and_backs_off(monkeypatch):
+    launcher = proxy_launcher.Launcher(argparse.Namespace(workers=1))
+    monkeypatch.setattr(launcher, "run_worker", lambda slot: os._exit(3))
+    try:
+        first, second = launcher.spawn(), launcher.spawn()
+        assert sorted(launcher.workers.values()) == [0, 1]
+        # Two slots per worker, both taken
+        assert launcher.spawn() is None
+
+        deadline = time.monotonic() + 10
+        while launcher.workers and time.monotonic() < deadline:
+            launcher.reap()
+            time.sleep(0.01)
+        assert not launcher.workers
+        assert launcher.stats.read(0) is None and launcher.stats.read(1) is None
+
+        # Each crash in the window doubles the delay before its replacement
+        delays = sorted(due - time.monotonic() for due in launcher.respawns)
+        assert len(delays) == 2
+        assert delays[0] <= proxy_launcher.RESPAWN_DELAY < delays[1] <= 2 * proxy_launcher.RESPAWN_DELAY
+        assert first != second and launcher.exit_code == 0
+    finally:
+        launcher.stats.close(unlink=True)
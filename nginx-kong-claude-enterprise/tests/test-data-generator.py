@@ -2,12 +2,20 @@
 """
 Test Data Generator for P0 Risk Test Cases
 Generates various edge case test data for AWS resource masking
+
+Stress corpora (multi-GB NDJSON, generated in bulk and streamed to disk):
+    python test-data-generator.py --corpus out/ --size 2GB --density 0.05 --shards 8 --seed 42
 """
 
+import argparse
 import json
+import os
 import random
+import re
 import string
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 class TestDataGenerator:
@@ -239,8 +247,216 @@ class TestDataGenerator:
             json.dump(data, f, indent=2, ensure_ascii=False)
         print(f"Generated: {filename}")
 
+class StreamingCorpusGenerator:
+    """Bulk, reproducible generator for large masking corpora
+
+    IDs are cut from one block of random bytes per batch instead of one
+    random.choices() call per ID, and records are written as they are built,
+    so memory use stays flat however large the corpus gets. With a seed the
+    bytes come from random.Random(seed), otherwise from os.urandom.
+    """
+
+    FILLER_WORDS = (
+        "the", "instance", "is", "running", "in", "a", "private", "subnet", "and",
+        "its", "security", "group", "allows", "traffic", "from", "load", "balancer",
+        "check", "bucket", "policy", "before", "deploying", "changes", "to", "prod",
+        "logs", "show", "timeout", "errors", "after", "the", "last", "restart",
+    )
+    BUCKET_PREFIXES = ("my", "test", "prod", "dev", "data", "logs", "backup", "assets")
+    BUCKET_SUFFIXES = ("bucket", "storage", "archive", "backup")
+    RDS_ENGINES = ("mysql", "postgres", "oracle", "sqlserver", "aurora")
+    RDS_ENVS = ("prod", "dev", "test", "staging")
+
+    # Average bytes of one filler word / one resource including the separator,
+    # used to size records before they are built
+    _WORD_BYTES = 6
+    _RESOURCE_BYTES = 22
+
+    def __init__(self, seed=None, density=0.05, record_bytes=8192):
+        self._random = random.Random(seed) if seed is not None else None
+        self.density = density
+        self.record_bytes = record_bytes
+        self._digits = bytes(ord('0') + i % 10 for i in range(256))
+        # byte value -> filler word, so a block of random bytes picks the words
+        self._word_table = [self.FILLER_WORDS[i % len(self.FILLER_WORDS)] for i in range(256)]
+
+    def random_bytes(self, count):
+        return self._random.randbytes(count) if self._random else os.urandom(count)
+
+    def hex_ids(self, prefix, count, width=17):
+        """`count` IDs like i-0123456789abcdef0 from one block of random bytes"""
+        hex_text = self.random_bytes((count * width + 1) // 2).hex()
+        return [prefix + hex_text[i:i + width] for i in range(0, count * width, width)]
+
+    def private_ips(self, count):
+        data = self.random_bytes(count * 4)
+        ips = []
+        for i in range(0, count * 4, 4):
+            kind, b, c, d = data[i], data[i + 1], data[i + 2], data[i + 3]
+            if kind % 3 == 0:
+                ips.append(f"10.{b}.{c}.{d}")
+            elif kind % 3 == 1:
+                ips.append(f"172.{16 + b % 16}.{c}.{d}")
+            else:
+                ips.append(f"192.168.{c}.{d}")
+        return ips
+
+    def digit_strings(self, count, width):
+        digits = self.random_bytes(count * width).translate(self._digits).decode('ascii')
+        return [digits[i:i + width] for i in range(0, count * width, width)]
+
+    def bucket_names(self, count):
+        picks = self.random_bytes(count * 2)
+        numbers = self.digit_strings(count, 4)
+        return [
+            f"{self.BUCKET_PREFIXES[picks[2 * i] % len(self.BUCKET_PREFIXES)]}-"
+            f"{self.BUCKET_SUFFIXES[picks[2 * i + 1] % len(self.BUCKET_SUFFIXES)]}-{numbers[i]}"
+            for i in range(count)
+        ]
+
+    def rds_instances(self, count):
+        picks = self.random_bytes(count * 2)
+        numbers = self.digit_strings(count, 3)
+        return [
+            f"{self.RDS_ENGINES[picks[2 * i] % len(self.RDS_ENGINES)]}-"
+            f"{self.RDS_ENVS[picks[2 * i + 1] % len(self.RDS_ENVS)]}-{numbers[i]}"
+            for i in range(count)
+        ]
+
+    def iam_roles(self, count):
+        accounts = self.digit_strings(count, 12)
+        names = self.hex_ids("", count, 10)
+        return [f"arn:aws:iam::{account}:role/{name}-role" for account, name in zip(accounts, names)]
+
+    def resources(self, count):
+        """A shuffled mix of every resource kind, `count` in total"""
+        share = count // 7 + 1
+        mixed = (self.hex_ids("i-", share) + self.hex_ids("sg-", share) + self.hex_ids("vpc-", share)
+                 + self.private_ips(share) + self.bucket_names(share) + self.rds_instances(share)
+                 + self.iam_roles(share))
+        order = self.random_bytes(len(mixed) * 2)
+        keys = [order[2 * i] << 8 | order[2 * i + 1] for i in range(len(mixed))]
+        return [item for _, item in sorted(zip(keys, mixed))][:count]
+
+    def record_content(self):
+        """Filler prose with resources spread through it at `density`
+        (fraction of words that are resources)"""
+        per_word = self._WORD_BYTES * (1 - self.density) + self._RESOURCE_BYTES * self.density
+        total = max(1, int(self.record_bytes / per_word))
+        resource_count = int(total * self.density)
+        words = list(map(self._word_table.__getitem__, self.random_bytes(total)))
+        if resource_count:
+            step = total // resource_count
+            words[0:step * resource_count:step] = self.resources(resource_count)
+        return " ".join(words)
+
+    def write(self, path, target_bytes, fmt="ndjson", flush_bytes=1 << 20):
+        """Stream Claude requests to `path` until about `target_bytes` are written
+
+        fmt "ndjson" writes one compact request per line; "json" writes one
+        JSON array. Returns (bytes written, records).
+        """
+        written = records = 0
+        buffered = []
+        buffered_bytes = 0
+        with open(path, 'wb') as f:
+            if fmt == "json":
+                f.write(b'[\n')
+                written += 2
+            while written + buffered_bytes < target_bytes:
+                request = {
+                    "model": "claude-3-sonnet-20240229",
+                    "messages": [{"role": "user", "content": self.record_content()}],
+                    "max_tokens": 4096,
+                    "stream": False,
+                }
+                line = json.dumps(request, separators=(',', ':')).encode('utf-8')
+                if fmt == "json" and records:
+                    line = b',\n' + line
+                elif fmt == "ndjson":
+                    line += b'\n'
+                buffered.append(line)
+                buffered_bytes += len(line)
+                records += 1
+                if buffered_bytes >= flush_bytes:
+                    f.write(b''.join(buffered))
+                    written += buffered_bytes
+                    buffered, buffered_bytes = [], 0
+            f.write(b''.join(buffered))
+            written += buffered_bytes
+            if fmt == "json":
+                f.write(b'\n]\n')
+                written += 3
+        return written, records
+
+
+def _write_shard(job):
+    """Process pool entry point: one shard, seeded from the base seed and its index"""
+    path, target_bytes, seed, density, record_bytes, fmt = job
+    generator = StreamingCorpusGenerator(seed, density, record_bytes)
+    written, records = generator.write(path, target_bytes, fmt)
+    return {"path": path, "bytes": written, "records": records}
+
+
+def parse_size(text):
+    """'2GB', '500MB', '64k' or plain bytes -> int"""
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([kmgt]?)i?b?\s*', text.lower())
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid size: {text}")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** " kmgt".index(unit or " "))
+
+
+def generate_corpus(out_dir, total_bytes, shards=1, seed=None, density=0.05,
+                    record_bytes=8192, fmt="ndjson"):
+    """Write `total_bytes` of requests split over `shards` files in parallel"""
+    os.makedirs(out_dir, exist_ok=True)
+    extension = "ndjson" if fmt == "ndjson" else "json"
+    per_shard = -(-total_bytes // shards)
+    jobs = [
+        (os.path.join(out_dir, f"corpus-{index:05d}.{extension}"), per_shard,
+         None if seed is None else seed + index, density, record_bytes, fmt)
+        for index in range(shards)
+    ]
+    if shards == 1:
+        return [_write_shard(jobs[0])]
+    with ProcessPoolExecutor(max_workers=min(shards, os.cpu_count() or 1)) as pool:
+        return list(pool.map(_write_shard, jobs))
+
+
+def main_corpus(args):
+    """Generate a stress corpus (--corpus mode)"""
+    started = time.perf_counter()
+    shards = generate_corpus(args.corpus, args.size, args.shards, args.seed,
+                             args.density, args.record_bytes, args.format)
+    elapsed = time.perf_counter() - started
+    total = sum(shard["bytes"] for shard in shards)
+    for shard in shards:
+        print(f"Generated: {shard['path']} ({shard['bytes']:,} bytes, {shard['records']:,} records)")
+    print(f"\nCorpus complete: {total / 1e6:,.1f} MB in {elapsed:.1f}s ({total / 1e6 / elapsed:,.1f} MB/s)")
+
+
 def main():
     """Generate all test cases"""
+    parser = argparse.ArgumentParser(description="Generate AWS masking test data")
+    parser.add_argument("--corpus", metavar="DIR", help="write a streamed stress corpus to DIR")
+    parser.add_argument("--size", type=parse_size, default=parse_size("100MB"),
+                        help="corpus size target, e.g. 2GB (default 100MB)")
+    parser.add_argument("--density", type=float, default=0.05,
+                        help="fraction of words that are AWS resources (default 0.05)")
+    parser.add_argument("--shards", type=int, default=1, help="output files, generated in parallel")
+    parser.add_argument("--seed", type=int, help="make the corpus reproducible")
+    parser.add_argument("--record-bytes", type=int, default=8192, help="approximate request size")
+    parser.add_argument("--format", choices=["ndjson", "json"], default="ndjson")
+    args = parser.parse_args()
+
+    if args.corpus:
+        main_corpus(args)
+        return
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
     generator = TestDataGenerator()
     
     # Create directory for generated test cases
@@ -272,12 +488,16 @@ def main():
         ('{"incomplete": "json"',  "incomplete_json"),
         ('{"key": "value", invalid}', "invalid_syntax"),
         ('{"nested": {"deep": {"deeper": ' * 200 + '}}' * 200, "too_deep"),
-        ('{"huge_string": "' + 'x' * 10000000 + '"}', "huge_string"),
+        # 10 MB string value, written in 1 MB pieces instead of built in memory
+        (['{"huge_string": "'] + ['x' * 1000000] * 10 + ['"}'], "huge_string"),
     ]
     
     for content, name in malformed_cases:
         with open(f"test-cases/generated/malformed_{name}.txt", 'w') as f:
-            f.write(content)
+            if isinstance(content, list):
+                f.writelines(content)
+            else:
+                f.write(content)
         print(f"Generated: test-cases/generated/malformed_{name}.txt")
     
     print("\nTest data generation complete!")